@@ -34,9 +34,49 @@ The --image flag outputs an image (2D) data, the --spectra flag outputs a spectr
 --spectra automatically sets full y-binning across the given ROI.
 --outfile specifies the path, e.g. "C:\Data\antos\251013_SDK_CCD_test\spectrum1.txt"
 
+--live keeps the CCD initialized and acquires frames back to back (for alignment) until a line
+is written to stdin, stdin is closed, or (when run from a console) a key is pressed. Frame SEQ
+is saved to OUTFILE_liveN.txt with N = SEQ - 1 (plus the usual "_0001_AREA1_1") and announced on
+stdout with "@frame SEQ N". A file is never written twice: the reader claims a frame by renaming
+it away, and a frame still unclaimed LIVE_KEEP_FRAMES frames later is deleted (dropped).
+
+--job PATH runs a whole job file instead (see "Job files" below).
+
 Example command:
 .\MonoCCD_Cpp_2010.exe --exptime 10 --adc " 50 kHz HS" --gain "Ultimate Sens." --spectra --roi 1 2048 1 512 --bin 1 512 --outfile "C:\Data\antos\251013_SDK_CCD_test\spectrum1.txt"
 
+Telemetry:
+Besides its normal output, every run prints machine-readable records (parsed by horiba_driver.py)
+on stdout, one per line, all starting with '@':
+    @timing PHASE SECONDS    time spent in each phase (com_init, config_load, open_comms, initialize,
+                             params, acquisition, readout, save, mono_move, info)
+    @status ok SECONDS       printed at the end of a successful run (total time)
+    @status error            printed by die() before exiting
+    @frame SEQ N             a live-view frame was saved to OUTFILE_liveN.txt (--live only)
+    @step INDEX begin TYPE   a job step (TYPE ccd or mono, INDEX from 0) started (--job only)
+    @saved INDEX FRAME       frame FRAME (from 1) of job step INDEX was saved (--job only)
+    @step INDEX end SECONDS  a job step finished (--job only)
+
+Job files:
+.\MonoCCD_Cpp_2010.exe --job "C:\Data\plan.json"
+runs a sequence of mono moves and CCD acquisitions in one process, initializing each device only
+once (instead of once per call). The job file is JSON (normally written by horiba_driver.JobPlan):
+    {"version": 1,
+     "manifest": "C:\\Data\\plan_result.json",
+     "steps": [
+        {"type": "mono", "grating": 1200, "wavelength": 669},
+        {"type": "ccd", "exptime": 2.5, "adc": "1.00 MHz HS", "gain": "High Sens.", "spectra": true,
+         "roi": [1, 2048, 116, 136], "bin": [1, 512], "frames": 3, "outfile": "C:\\Data\\spec.txt"}]}
+The step settings are the same as the --mono/--ccd flags (wavelength is passed to the SDK as it
+is, so without the driver's correction). "frames" (default 1) acquisitions with the same settings
+are saved to OUTFILE_f001.txt, OUTFILE_f002.txt, ... (OUTFILE itself if there's only one). The
+whole file is checked before any device is touched. When the job ends (finished, failed, or stopped
+between frames/steps by the same stop request as --live), a result manifest is written to
+"manifest" (default: PATH with .json replaced by _result.json):
+    {"version": 1, "status": "ok" | "error" | "stopped", "error": MESSAGE or null, "total_s": ...,
+     "steps": [{"index": 0, "type": "mono", "status": ..., "seconds": ..., "files": [...]}, ...]}
+with one entry per step that was started.
+
 */
 
 #include "stdafx.h" 
@@ -50,6 +90,10 @@ Example command:
 #include <chrono>
 #include <thread>
 #include <functional>
+#include <fstream>
+#include <iterator>
+#include <memory>
+#include <conio.h>
 
 
 // This lives in C:\Program Files (x86)\Jobin Yvon\SDK\Examples\C++\MonoCCD_Cpp_2010_COMPILABLE_BACKUP
@@ -68,8 +112,33 @@ using std::wcerr;
 
 /** HELPER FUNCTIONS **/
 
+// Times consecutive phases of a run and prints "@timing <phase> <seconds>" records for the driver
+struct PhaseTimer {
+    std::chrono::steady_clock::time_point start = std::chrono::steady_clock::now();
+    std::chrono::steady_clock::time_point last = start;
+
+    // Report the time since the previous lap (or since the start)
+    void lap(const wchar_t* phase) {
+        auto now = std::chrono::steady_clock::now();
+        // Flushed right away so the driver can react to phases as they finish (e.g. end of exposure)
+        wcout << L"@timing " << phase << L" " << std::chrono::duration<double>(now - last).count() << std::endl;
+        last = now;
+    }
+
+    // Report the total time and that the run succeeded
+    void done() {
+        auto now = std::chrono::steady_clock::now();
+        wcout << L"@status ok " << std::chrono::duration<double>(now - start).count() << std::endl;
+    }
+};
+
+// Called by die() before exiting, if set (e.g. to write what a job got done)
+static void (*on_die)(const wchar_t* msg) = nullptr;
+
 // For killing the program with an error message
-static void die(wchar_t* msg, HRESULT hr = S_OK) {
+static void die(const wchar_t* msg, HRESULT hr = S_OK) {
+    if (on_die) on_die(msg);
+    wcout << L"@status error" << std::endl;
     if (FAILED(hr)) {
         _com_error e(hr);
         fwprintf(stderr, L"%ls (0x%08X: %s)\n", msg, hr, e.ErrorMessage());
@@ -125,6 +194,7 @@ struct ccdArgs {
     int x_bin = 1, y_bin = 1;
     bool bin_given = false; 
     std::wstring outfile; // file path to save data
+    bool live = false; // acquire continuously until told to stop
 };
 
 // command line args struct for spectrometer (monochromator) itself
@@ -138,6 +208,8 @@ struct monoArgs {
 
 struct Args {
     bool ccd_mode = true; // true if we're running ccd instead of mono (i.e. true if --ccd flag is set, false if --mono flag)
+    bool job_mode = false; // true if --job is given (everything else comes from the job file)
+    std::wstring job_path;
     ccdArgs ccda;
     monoArgs monoa;
 };
@@ -147,16 +219,25 @@ static Args parse_args(int argc, wchar_t** argv) {
     Args a;
     if (argc == 1) { fwprintf(stderr, L"Missing args!\n"); ExitProcess(2); }
     
-    // First arg after command itself should always be --ccd or --mono; check for this
+    // First arg after command itself should always be --ccd, --mono or --job; check for this
     int i = 1;
-    if (iequals(argv[i], L"--ccd")) {
+    if (iequals(argv[i], L"--job")) {
+        if (argc != 3) {
+            fwprintf(stderr, L"Usage: --job PATH\n");
+            ExitProcess(2);
+        }
+        a.job_mode = true;
+        a.job_path = argv[2];
+        return a;
+    }
+    else if (iequals(argv[i], L"--ccd")) {
         a.ccd_mode = true;
     }
     else if (iequals(argv[i], L"--mono")) {
         a.ccd_mode = false;
     }
     else {
-        fwprintf(stderr, L"First flag must be --ccd or --mono\n");
+        fwprintf(stderr, L"First flag must be --ccd, --mono or --job\n");
         ExitProcess(2);
     }
 
@@ -184,6 +265,7 @@ static Args parse_args(int argc, wchar_t** argv) {
                 a.ccda.y_bin = _wtoi(argv[++i]);
             }
             else if (k == L"--outfile" && (i + 1 < argc)) a.ccda.outfile = argv[++i];
+            else if (k == L"--live") a.ccda.live = true;
             else { 
                 fwprintf(stderr, L"Unknown/incomplete arg: %s\n\n", k.c_str()); 
                 ExitProcess(2); 
@@ -210,6 +292,7 @@ static Args parse_args(int argc, wchar_t** argv) {
 
     if (a.ccd_mode) {
         if (a.ccda.exptime <= 0) die(L"--exptime must be > 0");
+        if (a.ccda.live && a.ccda.outfile.empty()) die(L"--live requires --outfile");
     }
     else {
         if (a.monoa.wavelength_nm < 0 && a.monoa.set_wavelength) die(L"--wavelength <wavelength> is required for --mono");
@@ -218,217 +301,343 @@ static Args parse_args(int argc, wchar_t** argv) {
     return a;
 }
 
-// Run CCD capture (this function is called if --ccd flag is set)
-static int run_ccd(ccdArgs& args) {
-    HRESULT hr = CoInitializeEx(nullptr, COINIT_APARTMENTTHREADED);
-    if (FAILED(hr)) die(L"CoInitilizeEx failed", hr);
+// True once we've been asked to stop live view (a line on / EOF of stdin, or a key press in a console)
+static bool stop_requested() {
+    HANDLE in = GetStdHandle(STD_INPUT_HANDLE);
+    if (GetFileType(in) != FILE_TYPE_PIPE) return _kbhit() != 0;
+    DWORD available = 0;
+    // Fails once the other end has closed the pipe
+    if (!PeekNamedPipe(in, nullptr, 0, nullptr, &available, nullptr)) return true;
+    return available > 0;
+}
 
-    {
-        // Config browser
-        // (CComPtr is safer than using bare points, automatically releases/avoids leaks etc)
-        CComPtr<IJYConfigBrowerInterface> m_pConfigBrowser = nullptr;
-        hr = CoCreateInstance(__uuidof(JYConfigBrowerInterface), nullptr, CLSCTX_INPROC_SERVER,
-            __uuidof(IJYConfigBrowerInterface), (void**)&m_pConfigBrowser);
-        if (FAILED(hr)) die(L"CoCreateInstance(ConfigBrowser) failed", hr);
-        m_pConfigBrowser->Load();
+// Path live-view frame n (from 0) is saved to (the SDK still appends _0001_AREA1_1 when saving)
+static std::wstring live_frame_path(const std::wstring& outfile, long n) {
+    std::wstring base = outfile;
+    if (base.size() >= 4 && iequals(base.substr(base.size() - 4), L".txt")) base.resize(base.size() - 4);
+    return base + L"_live" + std::to_wstring(n) + L".txt";
+}
 
-        // Get CCD
-        CComBSTR name, uid;
-        m_pConfigBrowser->GetFirstCCD(&name, &uid);
-        if (!uid || uid.Length() == 0) die(L"No CCDs found (GetFirstCCD returned empty UID)");
+// How many frames a live-view frame waits to be claimed (renamed away) before it's deleted
+static const long LIVE_KEEP_FRAMES = 4;
 
-        // Create CCD object
-        CComPtr<IJYCCDReqd> ccd;
+// Delete live-view frame n if nobody claimed it (no-op if it was, or if n < 0)
+static void drop_live_frame(const std::wstring& outfile, long n) {
+    if (n < 0) return;
+    std::wstring path = live_frame_path(outfile, n);
+    path.resize(path.size() - 4);
+    DeleteFileW((path + L"_0001_AREA1_1.txt").c_str());
+}
 
-        CLSID clsid;
-        hr = CLSIDFromProgID(OLESTR("JYCCD.JYMCD"), &clsid);
-        if (FAILED(hr)) die(L"CLSIDFromProgID(JYCCD.JYMCD) failed", hr);
-        hr = CoCreateInstance(clsid, nullptr, CLSCTX_ALL, __uuidof(IJYCCDReqd), (void**)&ccd);
-        if (FAILED(hr)) die(L"CoCreateInstance(IJYCCDReqd) failed", hr);
+// Job files are versioned, so an old CLI refuses a job it doesn't understand
+static const int JOB_VERSION = 1;
 
-        CliCallbacks cb;
-        CJYDeviceSink ccdSink(&cb, ccd);
+// Path frame n (from 1) of a multi-frame job step is saved to (the SDK still appends _0001_AREA1_1)
+static std::wstring job_frame_path(const std::wstring& outfile, int frame) {
+    std::wstring base = outfile;
+    if (base.size() >= 4 && iequals(base.substr(base.size() - 4), L".txt")) base.resize(base.size() - 4);
+    wchar_t suffix[16];
+    swprintf_s(suffix, L"_f%03d", frame);
+    return base + suffix + L".txt";
+}
 
-        // Bind to the first UID and initialize
-        ccd->put_Uniqueid(uid);
-        ccd->Load();
-        hr = ccd->OpenCommunications();
-        if (FAILED(hr)) die(L"OpenCommunications failed to ccd");
-        hr = ccd->Initialize(CComVariant(false), CComVariant(VARIANT_FALSE));
-        if (FAILED(hr)) die(L"CCD init failed", hr);
-
-        // Wait for initialization event (up to 5 seconds, should take <1 s)
-        if (!PumpUntil([&] { return cb.ccdInitialized || cb.criticalError; }, 5000)) {
-            die(L"Initialize timed out (no Initialized event)");
+// Default result manifest of a job file: PLAN.json -> PLAN_result.json
+static std::wstring job_manifest_path(const std::wstring& job_path) {
+    std::wstring base = job_path;
+    if (base.size() >= 5 && iequals(base.substr(base.size() - 5), L".json")) base.resize(base.size() - 5);
+    return base + L"_result.json";
+}
+
+// Acquire one frame and save it to `path`. If `stoppable`, gives up (returning false)
+// as soon as a stop is requested, even in the middle of the exposure.
+static bool acquire_frame(CComPtr<IJYCCDReqd>& ccd, const std::wstring& path, PhaseTimer& timer, bool stoppable) {
+    // single shot, non-threaded acqusition
+    // Look into "DoAcquisition" in the SDK for threaded acq
+    VARIANT_BOOL busy = VARIANT_TRUE;
+    HRESULT hr = ccd->StartAcquisition(VARIANT_TRUE);
+    if (FAILED(hr)) die(L"StartAcquisition failed", hr);
+
+    while (busy == VARIANT_TRUE) {
+        if (stoppable && stop_requested()) {
+            // Leave the CCD idle rather than mid-exposure
+            ccd->StopAcquisition();
+            return false;
         }
-        if (cb.criticalError) die(L"Critical error during Initialize");
-
-        // If no ROI given, default to full CCD chip
-        int xSizeFull = 0, ySizeFull = 0;
-        {
-            int x = 0, y = 0;
-            hr = ccd->GetChipSize(&x, &y);
-            if (FAILED(hr)) die(L"GetChipSize failed", hr);
-            if (!args.roi_given) {
-                args.x_start = 1;
-                args.y_start = 1;
-                args.x_end = x;
-                args.y_end = y;
-            }
-            if (!args.bin_given) {
-                args.x_bin = 1;
-                // Full bin y range by default if in spectra mode
-                args.y_bin = args.image_mode ? 1 : (args.y_end - args.y_start + 1);
-            }
+        hr = ccd->AcquisitionBusy(&busy);
+        if (FAILED(hr)) die(L"AcquisitionBusy failed", hr);
+        Sleep(5);
+    }
+    timer.lap(L"acquisition");
+
+    CComPtr<IJYResultsObject> res;
+    hr = ccd->GetResult(&res);
+    if (FAILED(hr)) die(L"GetResult failed", hr);
+
+    CComPtr<IJYDataObject> data;
+    hr = res->GetFirstDataObject(&data);
+    if (FAILED(hr)) die(L"GetFirstDataObject failed", hr);
+
+    timer.lap(L"readout");
+
+    hr = data->put_FileType(jyTabDelimitted);
+    if (FAILED(hr)) die(L"put_FileType(jyTabDelimitted) failed", hr);
+    hr = data->Save(CComBSTR(path.c_str()));
+    if (FAILED(hr)) die(L"Save failed", hr);
+    timer.lap(L"save");
+    return true;
+}
+
+// Load the JY configuration (which lists the installed devices)
+static CComPtr<IJYConfigBrowerInterface> open_config_browser() {
+    // (CComPtr is safer than using bare points, automatically releases/avoids leaks etc)
+    CComPtr<IJYConfigBrowerInterface> m_pConfigBrowser = nullptr;
+    HRESULT hr = CoCreateInstance(__uuidof(JYConfigBrowerInterface), nullptr, CLSCTX_INPROC_SERVER,
+        __uuidof(IJYConfigBrowerInterface), (void**)&m_pConfigBrowser);
+    if (FAILED(hr)) die(L"CoCreateInstance(ConfigBrowser) failed", hr);
+    m_pConfigBrowser->Load();
+    return m_pConfigBrowser;
+}
+
+// Create the object for the first CCD in the configuration (uid is set to its UID)
+static CComPtr<IJYCCDReqd> create_ccd(CComPtr<IJYConfigBrowerInterface>& browser, CComBSTR& uid) {
+    CComBSTR name;
+    browser->GetFirstCCD(&name, &uid);
+    if (!uid || uid.Length() == 0) die(L"No CCDs found (GetFirstCCD returned empty UID)");
+
+    CComPtr<IJYCCDReqd> ccd;
+    CLSID clsid;
+    HRESULT hr = CLSIDFromProgID(OLESTR("JYCCD.JYMCD"), &clsid);
+    if (FAILED(hr)) die(L"CLSIDFromProgID(JYCCD.JYMCD) failed", hr);
+    hr = CoCreateInstance(clsid, nullptr, CLSCTX_ALL, __uuidof(IJYCCDReqd), (void**)&ccd);
+    if (FAILED(hr)) die(L"CoCreateInstance(IJYCCDReqd) failed", hr);
+    return ccd;
+}
+
+// Create the object for the first monochromator in the configuration (uid is set to its UID)
+static CComPtr<IJYMonoReqd> create_mono(CComPtr<IJYConfigBrowerInterface>& browser, CComBSTR& uid) {
+    CComBSTR name;
+    browser->GetFirstMono(&name, &uid);
+    if (!uid || uid.Length() == 0) die(L"No spec found (GetFirstMono returned empty)");
+
+    CComPtr<IJYMonoReqd> mono;
+    CLSID clsid;
+    HRESULT hr = CLSIDFromProgID(OLESTR("JYMono.Monochromator"), &clsid);
+    if (FAILED(hr)) die(L"CLSIDFromProgID(JYMono.Monochromator) failed", hr);
+    hr = CoCreateInstance(clsid, nullptr, CLSCTX_ALL, __uuidof(IJYMonoReqd), (void**)&mono);
+    if (FAILED(hr)) die(L"CoCreateInstance(IJYMonoReqd) failed", hr);
+    return mono;
+}
+
+// Bind a CCD/mono to its UID and initialize it. Its event sink (reporting to cb) must
+// already be connected, since that's how we find out the initialization is done.
+template <class Device>
+static void init_device(CComPtr<Device>& dev, CComBSTR& uid, CliCallbacks& cb, PhaseTimer& timer) {
+    dev->put_Uniqueid(uid);
+    dev->Load();
+    timer.lap(L"config_load");
+    HRESULT hr = dev->OpenCommunications();
+    if (FAILED(hr)) die(L"OpenCommunications failed", hr);
+    timer.lap(L"open_comms");
+    hr = dev->Initialize(CComVariant(false), CComVariant(VARIANT_FALSE));
+    if (FAILED(hr)) die(L"Device init failed", hr);
+
+    // Wait for initialization event (up to 5 seconds, should take <1 s)
+    if (!PumpUntil([&] { return cb.ccdInitialized || cb.criticalError; }, 5000)) {
+        die(L"Initialize timed out (no Initialized event)");
+    }
+    if (cb.criticalError) die(L"Critical error during Initialize");
+    timer.lap(L"initialize");
+}
+
+// Apply the acquisition settings (exposure, gain, ADC, ROI, binning, format) to an initialized CCD
+static void configure_ccd(CComPtr<IJYCCDReqd>& ccd, ccdArgs& args) {
+    HRESULT hr;
+
+    // If no ROI given, default to full CCD chip
+    {
+        int x = 0, y = 0;
+        hr = ccd->GetChipSize(&x, &y);
+        if (FAILED(hr)) die(L"GetChipSize failed", hr);
+        if (!args.roi_given) {
+            args.x_start = 1;
+            args.y_start = 1;
+            args.x_end = x;
+            args.y_end = y;
+        }
+        if (!args.bin_given) {
+            args.x_bin = 1;
+            // Full bin y range by default if in spectra mode
+            args.y_bin = args.image_mode ? 1 : (args.y_end - args.y_start + 1);
         }
+    }
 
-        // Set params for the ccd
-        ccd->SetDefaultUnits(jyutTime, jyuSeconds);
-        hr = ccd->put_IntegrationTime(args.exptime);
-        if (FAILED(hr)) die(L"put_IntegrationTime failed", hr);
-
-        // Loop through the available gain settings until we find one that matches the input param
-        if (!args.gain_name.empty()) {
-            long gainToken = -1;
-            CComBSTR gainStr;
-            bool found = false;
-            ccd->GetFirstGain(&gainStr, &gainToken);
-            while (gainToken > -1) {
-                std::wstring d(gainStr, gainStr.Length());
-                // Check if our gain_name matches the CCD's gainStr
-                if (iequals(d, args.gain_name)) {
-                    found = true;
-                    break;
-                }
-                // If not, keep looking
-                ccd->GetNextGain(&gainStr, &gainToken);
+    // Set params for the ccd
+    ccd->SetDefaultUnits(jyutTime, jyuSeconds);
+    hr = ccd->put_IntegrationTime(args.exptime);
+    if (FAILED(hr)) die(L"put_IntegrationTime failed", hr);
+
+    // Loop through the available gain settings until we find one that matches the input param
+    if (!args.gain_name.empty()) {
+        long gainToken = -1;
+        CComBSTR gainStr;
+        bool found = false;
+        ccd->GetFirstGain(&gainStr, &gainToken);
+        while (gainToken > -1) {
+            std::wstring d(gainStr, gainStr.Length());
+            // Check if our gain_name matches the CCD's gainStr
+            if (iequals(d, args.gain_name)) {
+                found = true;
+                break;
             }
-            if (!found) die(L"Gain not found");
-            hr = ccd->put_Gain(gainToken);
-            if (FAILED(hr)) die(L"put_Gain failed");
+            // If not, keep looking
+            ccd->GetNextGain(&gainStr, &gainToken);
         }
+        if (!found) die(L"Gain not found");
+        hr = ccd->put_Gain(gainToken);
+        if (FAILED(hr)) die(L"put_Gain failed");
+    }
 
-        // Do the same as above but for ADC settings
-        if (!args.adc_name.empty()) {
-            long adcToken = 0;
-            CComBSTR adcStr;
-            bool found = false;
-            ccd->GetFirstADC(&adcStr, &adcToken);
-            while (adcToken > -1) {
-                std::wstring d(adcStr, adcStr.Length());
-
-                /*std::wcout << L"adcStr: \""
-                    << static_cast<const wchar_t*>(adcStr)
-                    << L"\"; args.adc_name: "
-                    << args.adc_name << std::endl;*/
-
-                if (iequals(d, args.adc_name)) {
-                    found = true;
-                    break;
-                }
-                ccd->GetNextADC(&adcStr, &adcToken);
+    // Do the same as above but for ADC settings
+    if (!args.adc_name.empty()) {
+        long adcToken = 0;
+        CComBSTR adcStr;
+        bool found = false;
+        ccd->GetFirstADC(&adcStr, &adcToken);
+        while (adcToken > -1) {
+            std::wstring d(adcStr, adcStr.Length());
+
+            /*std::wcout << L"adcStr: \""
+                << static_cast<const wchar_t*>(adcStr)
+                << L"\"; args.adc_name: "
+                << args.adc_name << std::endl;*/
+
+            if (iequals(d, args.adc_name)) {
+                found = true;
+                break;
             }
-            if (!found) die(L"ADC not found", hr);
-            hr = ccd->SelectADC((jyADCType)adcToken);
-            if (FAILED(hr)) die(L"SelectADC failed", hr);
+            ccd->GetNextADC(&adcStr, &adcToken);
         }
+        if (!found) die(L"ADC not found", hr);
+        hr = ccd->SelectADC((jyADCType)adcToken);
+        if (FAILED(hr)) die(L"SelectADC failed", hr);
+    }
+
+    // Set acqusition format (image vs. spectrum)
+    {
+        jyCCDDataType format = args.image_mode ? JYMCD_ACQ_FORMAT_IMAGE : JYMCD_ACQ_FORMAT_SCAN;
+        hr = ccd->DefineAcquisitionFormat(format, 1);
+        if (FAILED(hr)) die(L"DefineAcquisitionFormat failed", hr);
+
+        long xSize = (args.x_end - args.x_start) + 1;
+        long ySize = (args.y_end - args.y_start) + 1;
+        long ybin = args.image_mode ? args.y_bin : ySize; // spectra: bin full Y across ROI
 
-        // Set acqusition format (image vs. spectrum)
-        {
-            jyCCDDataType format = args.image_mode ? JYMCD_ACQ_FORMAT_IMAGE : JYMCD_ACQ_FORMAT_SCAN;
-            hr = ccd->DefineAcquisitionFormat(format, 1);
-            if (FAILED(hr)) die(L"DefineAcquisitionFormat failed", hr);
+        hr = ccd->DefineArea(1, args.x_start, args.y_start, xSize, ySize, args.x_bin, ybin);
+        if (FAILED(hr)) die(L"DefineArea failed", hr);
+    }
 
-            long xSize = (args.x_end - args.x_start) + 1;
-            long ySize = (args.y_end - args.y_start) + 1;
-            long ybin = args.image_mode ? args.y_bin : ySize; // spectra: bin full Y across ROI
+    // Check if CCD is ready
+    VARIANT_BOOL ready = VARIANT_FALSE;
+    ccd->get_ReadyForAcquisition(&ready);
+    if (ready == VARIANT_FALSE) die(L"CCD not ready for acquisition");
+}
 
-            hr = ccd->DefineArea(1, args.x_start, args.y_start, xSize, ySize, args.x_bin, ybin);
-            if (FAILED(hr)) die(L"DefineArea failed", hr);
+// Set the grating and/or center wavelength of an initialized monochromator (waits until done)
+static void move_mono(CComPtr<IJYMonoReqd>& mono, const monoArgs& args) {
+    HRESULT hr;
+
+    // Set grating (for our iHR 550, the allowed values are 300.0, 600.0, 1200.0)
+    if (args.set_grating) {
+        wcout << L"Setting grating to " << args.grating << "\n";
+        hr = mono->MovetoGrating(args.grating);
+        if (FAILED(hr)) die(L"MovetoGrating failed", hr);
+        VARIANT_BOOL busy = VARIANT_TRUE;
+        // Wait until setting grating is done (VERY IMPORTANT! AND CAN TAKE A WHILE)
+        while (busy == VARIANT_TRUE) {
+            hr = mono->IsBusy(&busy);
+            if (FAILED(hr)) die(L"IsBusy failed", hr);
+            Sleep(50); // wait 50 ms between checks
         }
+    }
 
-        // Check if CCD is ready
-        VARIANT_BOOL ready = VARIANT_FALSE;
-        ccd->get_ReadyForAcquisition(&ready);
-        if (ready == VARIANT_FALSE) die(L"CCD not ready for acquisition");
-
-        // single shot, non-threaded acqusition
-        // Look into "DoAcquisition" in the SDK for threaded acq
-        {
-            VARIANT_BOOL busy = VARIANT_TRUE;
-            hr = ccd->StartAcquisition(VARIANT_TRUE);
-            if (FAILED(hr)) die(L"StartAcquisition failed", hr);
-
-            while (busy == VARIANT_TRUE) {
-                hr = ccd->AcquisitionBusy(&busy);
-                if (FAILED(hr)) die(L"AcquisitionBusy failed", hr);
-                Sleep(5);
-            }
+    // Set center wavelength
+    if (args.set_wavelength) {
+        mono->SetDefaultUnits(jyutWavelength, jyuNanometers);
+        hr = mono->MovetoWavelength(args.wavelength_nm);
+        if (FAILED(hr)) die(L"MovetoWavelength failed", hr);
+        // Wait until done
+        VARIANT_BOOL busy = VARIANT_TRUE;
+        while (busy == VARIANT_TRUE) {
+            hr = mono->IsBusy(&busy);
+            if (FAILED(hr)) die(L"IsBusy failed");
+            Sleep(10); // this is usually fast
+        }
+    }
+}
 
-            CComPtr<IJYResultsObject> res;
-            hr = ccd->GetResult(&res);
-            if (FAILED(hr)) die(L"GetResult failed", hr);
+// Run CCD capture (this function is called if --ccd flag is set)
+static int run_ccd(ccdArgs& args) {
+    PhaseTimer timer;
+    HRESULT hr = CoInitializeEx(nullptr, COINIT_APARTMENTTHREADED);
+    if (FAILED(hr)) die(L"CoInitilizeEx failed", hr);
+    timer.lap(L"com_init");
 
-            CComPtr<IJYDataObject> data;
-            hr = res->GetFirstDataObject(&data);
-            if (FAILED(hr)) die(L"GetFirstDataObject failed", hr);
+    {
+        CComPtr<IJYConfigBrowerInterface> m_pConfigBrowser = open_config_browser();
 
-            hr = data->put_FileType(jyTabDelimitted);
-            if (FAILED(hr)) die(L"put_FileType(jyTabDelimitted) failed", hr);
-            hr = data->Save(CComBSTR(args.outfile.c_str()));
-            if (FAILED(hr)) die(L"Save failed", hr);
-        }
+        // Get CCD
+        CComBSTR uid;
+        CComPtr<IJYCCDReqd> ccd = create_ccd(m_pConfigBrowser, uid);
 
-        wcout << L"OK: saved to " << args.outfile << L"\n";
+        CliCallbacks cb;
+        CJYDeviceSink ccdSink(&cb, ccd);
+
+        init_device(ccd, uid, cb, timer);
+        configure_ccd(ccd, args);
+        timer.lap(L"params");
+
+        if (args.live) {
+            // Everything above is only paid once. Every frame gets its own file, so the
+            // driver never reads one that's being rewritten; it claims a frame by renaming
+            // it, and frames it was too slow for are deleted instead of piling up
+            long seq = 0;
+            while (!stop_requested()) {
+                drop_live_frame(args.outfile, seq - LIVE_KEEP_FRAMES);
+                if (!acquire_frame(ccd, live_frame_path(args.outfile, seq), timer, true)) break;
+                ++seq;
+                wcout << L"@frame " << seq << L" " << seq - 1 << std::endl;
+            }
+            wcout << L"OK: live view stopped after " << seq << L" frames\n";
+        }
+        else {
+            acquire_frame(ccd, args.outfile, timer, false);
+            wcout << L"OK: saved to " << args.outfile << L"\n";
+        }
     }
     CoUninitialize();
+    timer.done();
     return 0;
 }
 
 // Changes monochromator settings; run if --mono flag is set
 static int run_mono(monoArgs& args) {
+    PhaseTimer timer;
 
     HRESULT hr = CoInitializeEx(nullptr, COINIT_APARTMENTTHREADED);
     if (FAILED(hr)) die(L"CoInitilizeEx failed", hr);
+    timer.lap(L"com_init");
 
     {
-        // Config browser
-        CComPtr<IJYConfigBrowerInterface> m_pConfigBrowser = nullptr;
-        hr = CoCreateInstance(__uuidof(JYConfigBrowerInterface), nullptr, CLSCTX_INPROC_SERVER,
-            __uuidof(IJYConfigBrowerInterface), (void**)&m_pConfigBrowser);
-        if (FAILED(hr)) die(L"CoCreateInstance(ConfigBrowser) failed", hr);
-        m_pConfigBrowser->Load();
+        CComPtr<IJYConfigBrowerInterface> m_pConfigBrowser = open_config_browser();
 
         // Get monochromator
-        CComBSTR name, monoID;
-        m_pConfigBrowser->GetFirstMono(&name, &monoID);
-        if (!monoID || monoID.Length() == 0) die(L"No spec found (GetFirstMono returned empty)");
-
-        // Create mono object
-        CComPtr<IJYMonoReqd> mono;
-
-        CLSID clsid;
-        hr = CLSIDFromProgID(OLESTR("JYMono.Monochromator"), &clsid);
-        if (FAILED(hr)) die(L"CLSIDFromProgID(JYMono.Monochromator) failed", hr);
-        hr = CoCreateInstance(clsid, nullptr, CLSCTX_ALL, __uuidof(IJYMonoReqd), (void**)&mono);
-        if (FAILED(hr)) die(L"CoCreateInstance(IJYCCDReqd) failed", hr);
+        CComBSTR monoID;
+        CComPtr<IJYMonoReqd> mono = create_mono(m_pConfigBrowser, monoID);
 
         CliCallbacks cb;
         CJYDeviceSink ccdSink(&cb, mono);
 
-        // Bind to the first UID and initialize
-        mono->put_Uniqueid(monoID);
-        mono->Load();
-        hr = mono->OpenCommunications();
-        if (FAILED(hr)) die(L"OpenCommunications failed to mono");
-        hr = mono->Initialize(CComVariant(false), CComVariant(VARIANT_FALSE));
-        if (FAILED(hr)) die(L"CCD init failed", hr);
-
-        // Wait for initialization event (up to 5 seconds, should take <1 s)
-        if (!PumpUntil([&] { return cb.ccdInitialized || cb.criticalError; }, 5000)) {
-            die(L"Initialize timed out (no Initialized event)");
-        }
-        if (cb.criticalError) die(L"Critical error during Initialize");
+        init_device(mono, monoID, cb, timer);
 
         // If user is just requesting info, print it to the console and exit
         if (args.get_info) {
@@ -459,43 +668,20 @@ static int run_mono(monoArgs& args) {
             hr = mono->GetCurrentSlitWidth(Side_Exit, &side_exit);
 
             wcout << L"front_entrance:" << front_entrance << L"\nside_entrance:" << side_entrance << L"\nfront_exit:" << front_exit << "\nside_exit:" << side_exit << std::endl;
-            
+
             double curr_wavelength;
             hr = mono->GetCurrentWavelength(&curr_wavelength);
             if (FAILED(hr)) die(L"GetCurrentWavelength", hr);
 
             wcout << L"wavelength:" << curr_wavelength << std::endl;
+            timer.lap(L"info");
+            timer.done();
 
             return 0;
         }
 
-        // Set grating (for our iHR 550, the allowed values are 300.0, 600.0, 1200.0)
-        if (args.set_grating) {
-            wcout << L"Setting grating to " << args.grating << "\n";
-            hr = mono->MovetoGrating(args.grating);
-            if (FAILED(hr)) die(L"MovetoGrating failed", hr);
-            VARIANT_BOOL busy = VARIANT_TRUE; 
-            // Wait until setting grating is done (VERY IMPORTANT! AND CAN TAKE A WHILE)
-            while (busy == VARIANT_TRUE) {
-                hr = mono->IsBusy(&busy);
-                if (FAILED(hr)) die(L"IsBusy failed", hr);
-                Sleep(50); // wait 50 ms between checks
-            }
-        }
-
-        // Set center wavelength 
-        if (args.set_wavelength) {
-            mono->SetDefaultUnits(jyutWavelength, jyuNanometers);
-            hr = mono->MovetoWavelength(args.wavelength_nm);
-            if (FAILED(hr)) die(L"MovetoWavelength failed", hr);
-            // Wait until done
-            VARIANT_BOOL busy = VARIANT_TRUE;
-            while (busy == VARIANT_TRUE) {
-                hr = mono->IsBusy(&busy);
-                if (FAILED(hr)) die(L"IsBusy failed");
-                Sleep(10); // this is usually fast
-            }
-        }
+        move_mono(mono, args);
+        timer.lap(L"mono_move");
 
         // DEBUG: report final wavelength pos
         //double pos_nm = 0.0;
@@ -504,15 +690,419 @@ static int run_mono(monoArgs& args) {
         //wcout << L"Mono wl set to " << pos_nm << L" nm\n";
     }
     CoUninitialize();
+    timer.done();
     return 0;
 
 }
 
+/** JOB FILES **/
+
+// Minimal JSON value, just enough for job files
+struct JsonValue {
+    enum Type { Null, Bool, Number, String, Array, Object } type = Null;
+    bool b = false;
+    double num = 0;
+    std::wstring str;
+    std::vector<JsonValue> arr;
+    std::vector<std::pair<std::wstring, JsonValue>> obj;
+};
+
+// Recursive descent JSON parser (no dependencies). On failure, `error` says what and where.
+struct JsonParser {
+    const std::wstring& s;
+    size_t i = 0;
+    std::wstring error;
+
+    JsonParser(const std::wstring& text) : s(text) {}
+
+    void skip_ws() { while (i < s.size() && iswspace(s[i])) ++i; }
+
+    bool fail(const wchar_t* msg) {
+        if (error.empty()) error = std::wstring(msg) + L" at offset " + std::to_wstring(i);
+        return false;
+    }
+
+    bool parse(JsonValue& v) {
+        skip_ws();
+        if (i >= s.size()) return fail(L"unexpected end");
+        if (s[i] == L'{') return parse_object(v);
+        if (s[i] == L'[') return parse_array(v);
+        if (s[i] == L'"') { v.type = JsonValue::String; return parse_string(v.str); }
+        if (s.compare(i, 4, L"true") == 0) { v.type = JsonValue::Bool; v.b = true; i += 4; return true; }
+        if (s.compare(i, 5, L"false") == 0) { v.type = JsonValue::Bool; v.b = false; i += 5; return true; }
+        if (s.compare(i, 4, L"null") == 0) { v.type = JsonValue::Null; i += 4; return true; }
+        const wchar_t* start = s.c_str() + i;
+        wchar_t* end = nullptr;
+        v.num = wcstod(start, &end);
+        if (end == start) return fail(L"invalid value");
+        v.type = JsonValue::Number;
+        i += end - start;
+        return true;
+    }
+
+    bool parse_string(std::wstring& out) {
+        ++i; // opening quote
+        while (i < s.size() && s[i] != L'"') {
+            wchar_t c = s[i++];
+            if (c != L'\\') { out += c; continue; }
+            if (i >= s.size()) break;
+            wchar_t e = s[i++];
+            switch (e) {
+            case L'n': out += L'\n'; break;
+            case L't': out += L'\t'; break;
+            case L'r': out += L'\r'; break;
+            case L'b': out += L'\b'; break;
+            case L'f': out += L'\f'; break;
+            case L'u':
+                // wchar_t is UTF-16 on Windows, so surrogate pairs can be copied as they are
+                if (i + 4 > s.size()) return fail(L"bad \\u escape");
+                out += (wchar_t)wcstol(s.substr(i, 4).c_str(), nullptr, 16);
+                i += 4;
+                break;
+            default: out += e; // \" \\ \/
+            }
+        }
+        if (i >= s.size()) return fail(L"unterminated string");
+        ++i; // closing quote
+        return true;
+    }
+
+    bool parse_array(JsonValue& v) {
+        v.type = JsonValue::Array;
+        ++i;
+        skip_ws();
+        if (i < s.size() && s[i] == L']') { ++i; return true; }
+        while (true) {
+            JsonValue item;
+            if (!parse(item)) return false;
+            v.arr.push_back(item);
+            skip_ws();
+            if (i < s.size() && s[i] == L',') { ++i; continue; }
+            if (i < s.size() && s[i] == L']') { ++i; return true; }
+            return fail(L"expected , or ]");
+        }
+    }
+
+    bool parse_object(JsonValue& v) {
+        v.type = JsonValue::Object;
+        ++i;
+        skip_ws();
+        if (i < s.size() && s[i] == L'}') { ++i; return true; }
+        while (true) {
+            skip_ws();
+            if (i >= s.size() || s[i] != L'"') return fail(L"expected a key");
+            std::wstring key;
+            if (!parse_string(key)) return false;
+            skip_ws();
+            if (i >= s.size() || s[i] != L':') return fail(L"expected :");
+            ++i;
+            JsonValue item;
+            if (!parse(item)) return false;
+            v.obj.emplace_back(key, item);
+            skip_ws();
+            if (i < s.size() && s[i] == L',') { ++i; continue; }
+            if (i < s.size() && s[i] == L'}') { ++i; return true; }
+            return fail(L"expected , or }");
+        }
+    }
+};
+
+// JSON string literal, with everything but printable ASCII escaped (so the file is plain ASCII)
+static std::string json_string(const std::wstring& s) {
+    std::string out = "\"";
+    for (wchar_t c : s) {
+        if (c == L'"' || c == L'\\') {
+            out += '\\';
+            out += (char)c;
+        }
+        else if (c < 0x20 || c > 0x7e) {
+            char buf[8];
+            sprintf_s(buf, "\\u%04x", (unsigned)c);
+            out += buf;
+        }
+        else {
+            out += (char)c;
+        }
+    }
+    return out + "\"";
+}
+
+// One step of a job file: a mono move, or `frames` CCD acquisitions with the same settings
+struct JobStep {
+    bool is_ccd = true;
+    ccdArgs ccda;
+    monoArgs monoa;
+    int frames = 1;
+};
+
+struct Job {
+    std::vector<JobStep> steps;
+    std::wstring manifest_path;
+    bool uses_ccd = false;
+    bool uses_mono = false;
+};
+
+// For rejecting an invalid job file (before any device is touched, same exit code as bad args)
+static void bad_job(const std::wstring& msg) {
+    fwprintf(stderr, L"Invalid job file: %s\n", msg.c_str());
+    ExitProcess(2);
+}
+
+static bool is_int_array(const JsonValue& v, size_t n) {
+    if (v.type != JsonValue::Array || v.arr.size() != n) return false;
+    for (auto& x : v.arr) {
+        if (x.type != JsonValue::Number || x.num != (int)x.num) return false;
+    }
+    return true;
+}
+
+static JobStep parse_job_step(const JsonValue& v, size_t index) {
+    std::wstring where = L"step " + std::to_wstring(index) + L": ";
+    if (v.type != JsonValue::Object) bad_job(where + L"not an object");
+
+    JobStep step;
+    bool type_given = false;
+    for (auto& kv : v.obj) {
+        if (kv.first != L"type") continue;
+        if (kv.second.type == JsonValue::String && iequals(kv.second.str, L"ccd")) step.is_ccd = true;
+        else if (kv.second.type == JsonValue::String && iequals(kv.second.str, L"mono")) step.is_ccd = false;
+        else bad_job(where + L"\"type\" must be \"ccd\" or \"mono\"");
+        type_given = true;
+    }
+    if (!type_given) bad_job(where + L"missing \"type\"");
+
+    // Same settings as the --ccd/--mono flags
+    for (auto& kv : v.obj) {
+        const std::wstring& k = kv.first;
+        const JsonValue& x = kv.second;
+        if (k == L"type") continue;
+
+        if (step.is_ccd) {
+            if (k == L"exptime" && x.type == JsonValue::Number) step.ccda.exptime = x.num;
+            else if (k == L"adc" && x.type == JsonValue::String) step.ccda.adc_name = x.str;
+            else if (k == L"gain" && x.type == JsonValue::String) step.ccda.gain_name = x.str;
+            else if (k == L"spectra" && x.type == JsonValue::Bool) step.ccda.image_mode = !x.b;
+            else if (k == L"roi" && is_int_array(x, 4)) {
+                step.ccda.roi_given = true;
+                step.ccda.x_start = (int)x.arr[0].num;
+                step.ccda.x_end = (int)x.arr[1].num;
+                step.ccda.y_start = (int)x.arr[2].num;
+                step.ccda.y_end = (int)x.arr[3].num;
+            }
+            else if (k == L"bin" && is_int_array(x, 2)) {
+                step.ccda.bin_given = true;
+                step.ccda.x_bin = (int)x.arr[0].num;
+                step.ccda.y_bin = (int)x.arr[1].num;
+            }
+            else if (k == L"outfile" && x.type == JsonValue::String) step.ccda.outfile = x.str;
+            else if (k == L"frames" && x.type == JsonValue::Number && x.num == (int)x.num) step.frames = (int)x.num;
+            else bad_job(where + L"unknown or invalid \"" + k + L"\"");
+        }
+        else {
+            if (k == L"wavelength" && x.type == JsonValue::Number) {
+                step.monoa.wavelength_nm = x.num;
+                step.monoa.set_wavelength = true;
+            }
+            else if (k == L"grating" && x.type == JsonValue::Number) {
+                step.monoa.grating = x.num;
+                step.monoa.set_grating = true;
+            }
+            else bad_job(where + L"unknown or invalid \"" + k + L"\"");
+        }
+    }
+
+    if (step.is_ccd) {
+        if (step.ccda.exptime <= 0) bad_job(where + L"\"exptime\" must be > 0");
+        if (step.ccda.outfile.empty()) bad_job(where + L"\"outfile\" is required");
+        if (step.frames < 1) bad_job(where + L"\"frames\" must be >= 1");
+    }
+    else {
+        if (!step.monoa.set_wavelength && !step.monoa.set_grating) bad_job(where + L"needs \"wavelength\" and/or \"grating\"");
+        if (step.monoa.set_wavelength && step.monoa.wavelength_nm < 0) bad_job(where + L"\"wavelength\" must be >= 0");
+    }
+    return step;
+}
+
+// Read and check a whole job file (exits with an error message if anything is wrong with it)
+static Job load_job(const std::wstring& path) {
+    std::ifstream f(path.c_str(), std::ios::binary);
+    if (!f) bad_job(L"can't open " + path);
+    std::string bytes((std::istreambuf_iterator<char>(f)), std::istreambuf_iterator<char>());
+    if (bytes.size() >= 3 && bytes.compare(0, 3, "\xEF\xBB\xBF") == 0) bytes.erase(0, 3); // UTF-8 BOM
+
+    std::wstring text;
+    if (!bytes.empty()) {
+        int n = MultiByteToWideChar(CP_UTF8, 0, bytes.data(), (int)bytes.size(), nullptr, 0);
+        text.resize(n);
+        MultiByteToWideChar(CP_UTF8, 0, bytes.data(), (int)bytes.size(), &text[0], n);
+    }
+
+    JsonValue root;
+    JsonParser parser(text);
+    if (!parser.parse(root)) bad_job(parser.error);
+    if (root.type != JsonValue::Object) bad_job(L"top level must be an object");
+
+    Job job;
+    bool steps_given = false;
+    for (auto& kv : root.obj) {
+        if (kv.first == L"version" && kv.second.type == JsonValue::Number) {
+            if (kv.second.num != JOB_VERSION) bad_job(L"unsupported version " + std::to_wstring(kv.second.num));
+        }
+        else if (kv.first == L"manifest" && kv.second.type == JsonValue::String) {
+            job.manifest_path = kv.second.str;
+        }
+        else if (kv.first == L"steps" && kv.second.type == JsonValue::Array) {
+            steps_given = true;
+            for (size_t k = 0; k < kv.second.arr.size(); ++k) {
+                job.steps.push_back(parse_job_step(kv.second.arr[k], k));
+            }
+        }
+        else bad_job(L"unknown or invalid \"" + kv.first + L"\"");
+    }
+    if (!steps_given) bad_job(L"\"steps\" is required");
+
+    for (auto& step : job.steps) {
+        if (step.is_ccd) job.uses_ccd = true;
+        else job.uses_mono = true;
+    }
+    if (job.manifest_path.empty()) job.manifest_path = job_manifest_path(path);
+    return job;
+}
+
+// What each step of a running job did, written to the result manifest when the job ends
+struct StepResult {
+    std::wstring type;
+    std::string status = "running";
+    double seconds = 0;
+    std::vector<std::wstring> files;
+};
+
+struct JobLog {
+    std::wstring manifest_path;
+    std::vector<StepResult> steps;
+    std::chrono::steady_clock::time_point start = std::chrono::steady_clock::now();
+
+    void write(const char* status, const std::wstring& error = L"") {
+        std::ofstream f(manifest_path.c_str());
+        f << "{\"version\": " << JOB_VERSION << ", \"status\": \"" << status << "\", \"error\": "
+          << (error.empty() ? std::string("null") : json_string(error))
+          << ", \"total_s\": " << std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count()
+          << ", \"steps\": [";
+        for (size_t k = 0; k < steps.size(); ++k) {
+            const StepResult& r = steps[k];
+            f << (k ? ", " : "") << "{\"index\": " << k << ", \"type\": " << json_string(r.type)
+              << ", \"status\": \"" << r.status << "\", \"seconds\": " << r.seconds << ", \"files\": [";
+            for (size_t j = 0; j < r.files.size(); ++j) {
+                f << (j ? ", " : "") << json_string(r.files[j]);
+            }
+            f << "]}";
+        }
+        f << "]}\n";
+    }
+};
+
+// The running job, so die() can still write its manifest
+static JobLog* g_job_log = nullptr;
+
+static void write_failed_job_manifest(const wchar_t* msg) {
+    for (auto& r : g_job_log->steps) {
+        if (r.status == "running") r.status = "error";
+    }
+    g_job_log->write("error", msg);
+}
+
+// Run a job file (this function is called with --job): every device a step needs is
+// initialized once, then the steps run back to back in this one process
+static int run_job(const std::wstring& path) {
+    Job job = load_job(path);
+
+    JobLog log;
+    log.manifest_path = job.manifest_path;
+    g_job_log = &log;
+    on_die = write_failed_job_manifest;
+
+    PhaseTimer timer;
+    HRESULT hr = CoInitializeEx(nullptr, COINIT_APARTMENTTHREADED);
+    if (FAILED(hr)) die(L"CoInitilizeEx failed", hr);
+    timer.lap(L"com_init");
+
+    bool stopped = false;
+    {
+        CComPtr<IJYConfigBrowerInterface> m_pConfigBrowser = open_config_browser();
+
+        // Only the devices some step actually uses
+        CComPtr<IJYCCDReqd> ccd;
+        CComPtr<IJYMonoReqd> mono;
+        CliCallbacks ccdCb, monoCb;
+        std::unique_ptr<CJYDeviceSink> ccdSink, monoSink;
+        if (job.uses_ccd) {
+            CComBSTR uid;
+            ccd = create_ccd(m_pConfigBrowser, uid);
+            ccdSink.reset(new CJYDeviceSink(&ccdCb, ccd));
+            init_device(ccd, uid, ccdCb, timer);
+        }
+        if (job.uses_mono) {
+            CComBSTR uid;
+            mono = create_mono(m_pConfigBrowser, uid);
+            monoSink.reset(new CJYDeviceSink(&monoCb, mono));
+            init_device(mono, uid, monoCb, timer);
+        }
+
+        for (size_t k = 0; k < job.steps.size() && !stopped; ++k) {
+            // A stop request (same as for --live) ends the job between frames/steps
+            if (stop_requested()) {
+                stopped = true;
+                break;
+            }
+            JobStep& step = job.steps[k];
+            auto step_start = std::chrono::steady_clock::now();
+            log.steps.push_back(StepResult());
+            StepResult& result = log.steps.back();
+            result.type = step.is_ccd ? L"ccd" : L"mono";
+            wcout << L"@step " << k << L" begin " << result.type << std::endl;
+
+            if (step.is_ccd) {
+                configure_ccd(ccd, step.ccda);
+                timer.lap(L"params");
+                for (int frame = 1; frame <= step.frames; ++frame) {
+                    if (frame > 1 && stop_requested()) {
+                        stopped = true;
+                        break;
+                    }
+                    std::wstring outfile = step.frames == 1 ? step.ccda.outfile : job_frame_path(step.ccda.outfile, frame);
+                    acquire_frame(ccd, outfile, timer, false);
+                    result.files.push_back(outfile);
+                    wcout << L"@saved " << k << L" " << frame << std::endl;
+                }
+            }
+            else {
+                move_mono(mono, step.monoa);
+                timer.lap(L"mono_move");
+            }
+
+            result.seconds = std::chrono::duration<double>(std::chrono::steady_clock::now() - step_start).count();
+            result.status = stopped ? "stopped" : "ok";
+            wcout << L"@step " << k << L" end " << result.seconds << std::endl;
+        }
+    }
+    CoUninitialize();
+
+    log.write(stopped ? "stopped" : "ok");
+    on_die = nullptr;
+    g_job_log = nullptr;
+    wcout << L"OK: job " << (stopped ? L"stopped" : L"done") << L", results in " << job.manifest_path << L"\n";
+    timer.done();
+    return 0;
+}
+
 int wmain(int argc, wchar_t* argv[]) {
 
     Args args = parse_args(argc, argv);
 
-    if (args.ccd_mode) {
+    if (args.job_mode) {
+        return run_job(args.job_path);
+    }
+    else if (args.ccd_mode) {
         return run_ccd(args.ccda);
     }
     else {
@@ -13,6 +13,134 @@ in CLI.cpp and recompiled.
 
 A. Wellisz 2025-10
 
+TELEMETRY:
+Horiba_CLI.exe prints "@timing <phase> <seconds>" and "@status ..." records
+on stdout. These are stripped from the normal output, stored as a
+`CallTiming` per CLI call, and aggregated into rolling statistics that
+are available through `Horiba.stats()` (e.g.
+obtain(gw.horiba.stats()), see below), which is handy for noticing when
+device init starts taking seconds instead of <1 s.
+
+Dicts (stats(), poll(), queue_stats(), get_spec_info(), ...) come back
+over RPyC as netrefs, so every key access is another round trip. Copy
+them over in one go with `rpyc.utils.classic.obtain(...)`.
+
+ASYNCHRONOUS CAPTURES:
+A synchronous `capture_spectrum` call over RPyC has to finish within
+RPYC_SYNC_TIMEOUT, which caps the exposure time. Instead, use the job
+interface, which runs the acquisition on a worker thread inside the
+instrument server so that every RPyC call is short:
+
+```
+job_id = gw.horiba.start_capture(exposure_s=600, outfile=...)
+while not gw.horiba.wait(job_id, timeout=5):
+    pass  # free to do other things (e.g. check for a stop request)
+gw.horiba.result(job_id)
+```
+
+Monochromator moves can be run the same way with `start_move(wavelength=...,
+grating=...)` (on their own worker, so they don't queue behind captures).
+
+RETURNING DATA:
+`capture_spectrum(..., return_data=True)` reads the saved file on the
+instrument server and returns the data as one (bytes, dtype, shape)
+tuple, which RPyC copies in one go (instead of per-element netref
+traffic), so the experiment doesn't have to share a filesystem with the
+instrument server. Rebuild the array on the client with
+    np.frombuffer(data, dtype=dtype).reshape(shape)
+
+DEVICE SCHEDULING:
+The monochromator and the CCD are separate devices (separate CLI runs),
+so the driver has one lock per device instead of one for the whole
+spectrometer (`DeviceScheduler`). The only cross-device rule is that the
+monochromator never moves while the CCD is exposing (or waiting to
+start an exposure). The CLI reports the end of the exposure as soon as
+it happens, so a move can start while the previous acquisition is still
+reading out, saving and transferring data. `capture_windows` uses this
+for multi-wavelength acquisitions.
+
+PRIORITIES:
+Every call that touches hardware waits in a per-device priority queue
+(`PriorityLock`), so GUI requests can't get in the way of a running
+experiment. Calls take a `priority` of "acquisition" (served first,
+default for captures), "normal" (default for everything else) or "gui"
+(served last). GUIs should also pass `max_age_s` to `get_spec_info`,
+which is then answered from the latest known state without touching the
+hardware if that is recent enough (moves invalidate it).
+`queue_stats()` reports queue depths and wait times.
+
+ACQUISITION SESSIONS:
+Priorities only order the requests that are waiting, and between two
+captures of a scan the devices are free, so on their own they wouldn't
+stop a GUI from moving the grating in the middle of a scan. While an
+acquisition session is active, "gui" priority moves (and `start_live`)
+raise `AcquisitionActiveError` instead. Every capture job
+(`start_capture`, `start_capture_windows`, `start_job_plan`) is a
+session until SESSION_LINGER_S after it ends; scans hold one for their
+whole duration with `begin_acquisition_session(name)` /
+`end_acquisition_session(token)`. Those expire SESSION_LEASE_S after the
+last capture activity, in case the experiment dies without ending them.
+`acquisition_session()` is the name of the active one (None if there's none).
+
+LIVE VIEW:
+For focusing/alignment, `start_live(exposure_s=0.05, ...)` runs the CLI
+in --live mode, which initializes the CCD once and then acquires frames
+back to back. Only the newest frame is kept (`LatestFrame`); frames
+nobody fetched in time are dropped. Poll it with
+`get_live_frame(after=last_seq)` and stop with `stop_live()`, which
+aborts the current exposure and lets the CLI shut the CCD down
+normally. Live view holds the CCD (captures wait until it's stopped),
+but doesn't block monochromator moves.
+Every frame is saved to a file of its own, which the driver claims
+(renames) as soon as the CLI announces it, so a frame is never read
+while the CLI rewrites it. The limit: a frame that isn't claimed within
+LIVE_KEEP_FRAMES (4) frames, e.g. because the driver's output reader
+stalled, is deleted by the CLI and just counts as dropped.
+
+JOB FILES:
+For long unattended batches, a `JobPlan` (mono moves and CCD acquisitions,
+each with any number of frames) runs in a single `Horiba_CLI.exe --job`
+process, so the devices are initialized once instead of once per call:
+
+```
+plan = JobPlan()
+plan.move(wavelength=700, grating=1200)
+plan.capture(r"C:\Data\scan\spec700.txt", exposure_s=60, frames=10)
+job_id = gw.horiba.start_job_plan(plan.as_dict())
+gw.horiba.poll(job_id)["progress"]  # steps/frames done, ETA
+gw.horiba.result(job_id)            # result manifest, once it's done
+```
+
+`cancel(job_id)` stops a running plan after the current frame. The plan
+is checked (`check_job`) before anything touches the hardware. Without
+the hardware, `Horiba(exe_path=[sys.executable, "horiba_driver.py",
+"--simulate"])` runs plans with a stand-in for the CLI (`simulate_job`).
+
+DISPERSION MODEL:
+`Horiba.dispersion` (a `DispersionModel`) predicts the wavelength axis,
+the detector window and the SDK's wavelength offset per grating without
+running the CLI: `predict_window`, `predict_axis`, and `plan_windows`
+(centers covering a range, e.g. for `capture_windows`). It calibrates
+itself from every spectrum captured with `return_data=True` (and from
+--info, if the CLI reports the detector range), and is stored in
+`calibration_path`. `set_spec_wavelength` and job plans use its
+calibrated offset instead of the nominal WAVELENGTH_OFFSET_NM, and
+`get_spec_info` fills in the actual "center", "wl_start" and "wl_end".
+
+RECORD AND REPLAY:
+`start_recording(path)` records every CLI call (arguments, each output
+line with its timing, exit code) and every spectrum or frame it saved to
+a session directory, until `stop_recording()`. `Horiba(replay=path,
+replay_speed=10)` plays a session back without the CLI or the hardware
+(e.g. on a Linux box): the same calls, in the same order, give the same
+output and data with the recorded timing, `replay_speed` times faster
+(the durations in the telemetry and job manifests are divided by it too,
+so `stats()` matches the wall time).
+That's for benchmarking and regression-testing whatever sits on top of
+the driver (experiments, dataserv, viewers) with real data, or stressing
+it at many times the real acquisition rate. Only the CLI is replayed;
+the idle time between calls is up to the caller.
+
 KNOWN ISSUES:
 - Sometimes (not always) causes problems if LabSpec6 is open
 - Filenames always have "_0001_AREA1_1" appended to them. This is dealt with in the gui
@@ -29,29 +157,1448 @@ os.rename(full_path_JY, full_path)
 
 """
 
+import array
+import bisect
+import heapq
+import itertools
+import json
+import math
+import os
+import shutil
+import statistics
 import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+# Number of recent CLI calls kept per (command, phase) for the rolling stats
+TIMING_HISTORY = 500
+
+# Finished jobs nobody collected with `result` (or `abandon`ed) are forgotten after this long (s)
+JOB_RESULT_TTL_S = 3600
+
+# The JY SDK always appends this to the filename it's given
+JY_SUFFIX = "_0001_AREA1_1"
+
+# The wavelength set by the SDK is about this far (nm) off the actual center wavelength
+# (nominal value, used until DispersionModel has calibration data for a grating)
+WAVELENGTH_OFFSET_NM = 31
+
+# Version of the job file format (see JobPlan and CLI.cpp)
+JOB_VERSION = 1
+
+# Upper bin edges (s) of the rolling timing histograms; the last bin is open-ended
+HISTOGRAM_EDGES_S = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5,
+                     1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class HoribaCLIError(subprocess.CalledProcessError):
+    """Horiba_CLI.exe exited with an error. The CLI's error message is included."""
+
+    def __str__(self):
+        msg = super().__str__()
+        if self.stderr:
+            msg += f": {self.stderr.strip()}"
+        return msg
+
+
+class CallTiming:
+    """
+    Timing of one Horiba_CLI.exe call.
+
+    `phases` maps phase name -> seconds, as reported by the CLI
+    (com_init, config_load, open_comms, initialize, params,
+    acquisition, readout, save, mono_move, info).
+    `wall_s` is the total time seen from Python (including process
+    startup), `cli_total_s` the total reported by the CLI (None if it
+    died before finishing).
+    """
+
+    def __init__(self, command, phases, wall_s, cli_total_s, ok):
+        self.command = command
+        self.phases = phases
+        self.wall_s = wall_s
+        self.cli_total_s = cli_total_s
+        self.ok = ok
+        self.timestamp = time.time()
+
+    def as_dict(self):
+        return {
+            'command': self.command,
+            'phases': dict(self.phases),
+            'wall_s': self.wall_s,
+            'cli_total_s': self.cli_total_s,
+            'ok': self.ok,
+            'timestamp': self.timestamp,
+        }
+
+
+def parse_cli_output(command, stdout, wall_s, returncode):
+    """
+    Split the stdout of Horiba_CLI.exe into normal output and telemetry.
+    Returns (output without "@" records, CallTiming).
+    """
+    phases = {}
+    cli_total_s = None
+    lines = []
+    for line in stdout.splitlines():
+        if not line.startswith("@"):
+            lines.append(line)
+            continue
+        fields = line[1:].split()
+        try:
+            if fields[0] == "timing":
+                phases[fields[1]] = phases.get(fields[1], 0.0) + float(fields[2])
+            elif fields[0] == "status" and fields[1] == "ok":
+                cli_total_s = float(fields[2])
+        except (IndexError, ValueError):
+            # Don't let a garbled record break the actual command
+            continue
+
+    timing = CallTiming(command, phases, wall_s, cli_total_s, ok=(returncode == 0))
+    return "\n".join(lines), timing
+
+
+def _summarize(durations):
+    """Summary stats + histogram of a sequence of durations (s)."""
+    values = sorted(durations)
+    counts = [0] * (len(HISTOGRAM_EDGES_S) + 1)
+    for v in values:
+        counts[bisect.bisect_left(HISTOGRAM_EDGES_S, v)] += 1
+    return {
+        'count': len(values),
+        'mean_s': statistics.fmean(values),
+        'median_s': statistics.median(values),
+        'p90_s': values[min(len(values) - 1, int(0.9 * len(values)))],
+        'min_s': values[0],
+        'max_s': values[-1],
+        'last_s': durations[-1],
+        'histogram': {'edges_s': list(HISTOGRAM_EDGES_S), 'counts': counts},
+    }
+
+
+def jy_saved_path(outfile):
+    """Path the SDK actually saves to when asked to save to `outfile`."""
+    return outfile[:-len(".txt")] + JY_SUFFIX + ".txt"
+
+
+def live_frame_path(outfile, n):
+    """File the CLI saves live-view frame `n` (the N of "@frame SEQ N") to when run with --live --outfile `outfile`."""
+    return jy_saved_path(outfile[:-len(".txt")] + f"_live{n}.txt")
+
+
+def job_frame_path(outfile, frame, frames):
+    """File frame `frame` (from 1) of a job step with `frames` frames is saved to (before the SDK suffix)."""
+    if frames == 1:
+        return outfile
+    return outfile[:-len(".txt")] + f"_f{frame:03d}.txt"
+
+
+def job_manifest_path(job_path):
+    """Default result manifest of a job file (PLAN.json -> PLAN_result.json)."""
+    return job_path[:-len(".json")] + "_result.json"
+
+
+def unpack_wavelengths(payload):
+    """First column (the wavelength axis of a spectrum) of a `pack_data_file` payload."""
+    data, dtype, (rows, columns) = payload
+    values = array.array("d")
+    values.frombytes(data)
+    if (dtype == "<f8") != (sys.byteorder == "little"):
+        values.byteswap()
+    return list(values[0::columns])
+
+
+def pack_data_file(path):
+    """
+    Read a tab-delimited data file saved by the CLI into one contiguous
+    block of float64s. Returns (bytes, dtype, shape) where shape is
+    (rows, columns) of the file, e.g. (2048, 2) for a spectrum
+    (wavelength, counts).
+    """
+    values = array.array("d")
+    rows = 0
+    with open(path, "r") as f:
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+            values.extend(float(x) for x in fields)
+            rows += 1
+    columns = len(values) // rows if rows else 0
+    dtype = "<f8" if sys.byteorder == "little" else ">f8"
+    return values.tobytes(), dtype, (rows, columns)
+
+
+def claim_live_frame(path):
+    """
+    Take a live-view frame file away from the CLI (see LIVE VIEW) and
+    return its data as for `pack_data_file`. None if the CLI already
+    dropped it.
+    """
+    claimed = path + ".claimed"
+    try:
+        os.replace(path, claimed)
+    except OSError:
+        return None
+    try:
+        return pack_data_file(claimed)
+    finally:
+        os.remove(claimed)
+
+
+# Request priorities (lower is served first)
+PRIORITIES = {"acquisition": 0, "normal": 1, "gui": 2}
+
+# How long (s) a capture job's acquisition session lasts after the job, to cover
+# the gap until a scan's next capture (see ACQUISITION SESSIONS)
+SESSION_LINGER_S = 2
+
+# Sessions started with begin_acquisition_session end this long (s) after the
+# last capture activity unless they're ended (or renewed) before
+SESSION_LEASE_S = 600
+
+
+class AcquisitionActiveError(RuntimeError):
+    """A "gui" priority request that would disturb an active acquisition session."""
+
+
+class PriorityLock:
+    """
+    Lock whose waiters are served in order of priority (see PRIORITIES),
+    then in order of arrival. Keeps the recent wait times per priority.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._locked = False
+        # heap of (priority, arrival #) tickets
+        self._waiting = []
+        self._arrivals = itertools.count()
+        self._wait_times = defaultdict(lambda: deque(maxlen=TIMING_HISTORY))
+
+    def acquire(self, priority="normal"):
+        ticket = (PRIORITIES[priority], next(self._arrivals))
+        start = time.perf_counter()
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            self._cond.wait_for(lambda: not self._locked and self._waiting[0] == ticket)
+            heapq.heappop(self._waiting)
+            self._locked = True
+            self._wait_times[priority].append(time.perf_counter() - start)
+
+    def release(self):
+        with self._cond:
+            self._locked = False
+            self._cond.notify_all()
+
+    @contextmanager
+    def hold(self, priority="normal"):
+        self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def locked(self):
+        return self._locked
+
+    def depth(self):
+        """Number of requests waiting for the lock."""
+        with self._cond:
+            return len(self._waiting)
+
+    def wait_times(self):
+        """{priority: [recent wait times (s)]}"""
+        with self._cond:
+            return {priority: list(times) for priority, times in self._wait_times.items()}
+
+
+class DeviceScheduler:
+    """
+    Serializes access to each device separately (by priority), and
+    enforces that the monochromator doesn't move during a CCD exposure
+    (and that an exposure doesn't start during a move).
+    """
+
+    def __init__(self):
+        # Only one CLI process per device at a time
+        self.ccd_lock = PriorityLock()
+        self.mono_lock = PriorityLock()
+        self._cond = threading.Condition()
+        self._exposing = False
+        self._moving = False
+        # Acquisition sessions: token -> [name, expiry (time.monotonic()) or None, lease (s) or None]
+        self._sessions = {}
+        self._session_ids = itertools.count(1)
+
+    def begin_session(self, name, lease_s=None):
+        """Start an acquisition session (see ACQUISITION SESSIONS) and return its token."""
+        with self._cond:
+            token = next(self._session_ids)
+            expires = None if lease_s is None else time.monotonic() + lease_s
+            self._sessions[token] = [name, expires, lease_s]
+            return token
+
+    def end_session(self, token, linger_s=0):
+        """End a session, right away or `linger_s` s from now."""
+        with self._cond:
+            if token not in self._sessions:
+                return
+            if linger_s > 0:
+                self._sessions[token][1:] = [time.monotonic() + linger_s, None]
+            else:
+                del self._sessions[token]
+
+    def renew_sessions(self):
+        """Restart the lease of every leased session (on capture activity)."""
+        now = time.monotonic()
+        with self._cond:
+            for session in self._sessions.values():
+                if session[2] is not None:
+                    session[1] = now + session[2]
+
+    def active_session(self):
+        """Name of the (oldest) active acquisition session, None if there's none."""
+        now = time.monotonic()
+        with self._cond:
+            for token, (name, expires, _) in list(self._sessions.items()):
+                if expires is not None and expires <= now:
+                    del self._sessions[token]
+            return next((name for name, _, _ in self._sessions.values()), None)
+
+    def check_gui(self, priority, action):
+        """Raise AcquisitionActiveError if a "gui" request to `action` would disturb a session."""
+        if priority != "gui":
+            return
+        name = self.active_session()
+        if name is not None:
+            raise AcquisitionActiveError(f"Can't {action} while {name} is running; try again once it's over")
+
+    @contextmanager
+    def ccd(self, priority="acquisition"):
+        """
+        Hold the CCD. The exposure is considered active from entering until
+        `end_exposure` is called (or the block exits).
+        """
+        with self.ccd_lock.hold(priority):
+            with self._cond:
+                self._cond.wait_for(lambda: not self._moving)
+                self._exposing = True
+            try:
+                yield
+            finally:
+                self.end_exposure()
+
+    def end_exposure(self):
+        """Exposure is over (readout/saving may still be going): the mono may move."""
+        with self._cond:
+            self._exposing = False
+            self._cond.notify_all()
+
+    @contextmanager
+    def mono_move(self, priority="normal"):
+        """
+        Hold the monochromator for a move (waits for any active exposure to
+        end). "gui" moves raise AcquisitionActiveError during a session.
+        """
+        with self.mono_lock.hold(priority):
+            # Checked once it's our turn, so a session that started while we waited counts too
+            self.check_gui(priority, "move the monochromator")
+            with self._cond:
+                self._cond.wait_for(lambda: not self._exposing)
+                self._moving = True
+            try:
+                yield
+            finally:
+                with self._cond:
+                    self._moving = False
+                    self._cond.notify_all()
+
+    @contextmanager
+    def job(self, priority="acquisition"):
+        """Hold both devices (a job plan moves and exposes within one CLI run)."""
+        with self.ccd_lock.hold(priority), self.mono_lock.hold(priority):
+            with self._cond:
+                self._exposing = True
+                self._moving = True
+            try:
+                yield
+            finally:
+                with self._cond:
+                    self._exposing = False
+                    self._moving = False
+                    self._cond.notify_all()
+
+    @contextmanager
+    def mono_query(self, priority="normal"):
+        """Hold the monochromator for something that doesn't move it (e.g. --info)."""
+        with self.mono_lock.hold(priority):
+            yield
+
+    def state(self):
+        with self._cond:
+            return {
+                "ccd_busy": self.ccd_lock.locked(),
+                "mono_busy": self.mono_lock.locked(),
+                "exposing": self._exposing,
+                "moving": self._moving,
+                "session": self.active_session(),
+            }
+
+    def queue_stats(self):
+        """Queue depth, whether it's busy, and wait time stats per priority, per device."""
+        stats = {}
+        for device, lock in (("ccd", self.ccd_lock), ("mono", self.mono_lock)):
+            stats[device] = {
+                "depth": lock.depth(),
+                "busy": lock.locked(),
+                "wait": {priority: _summarize(times)
+                         for priority, times in lock.wait_times().items() if times},
+            }
+        return stats
+
+
+class LatestFrame:
+    """
+    Holds only the newest live-view frame. A frame that is replaced before
+    anyone read it is counted as dropped.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.seq = 0
+        self.payload = None
+        self.dropped = 0
+        self.closed = False
+        self._last_read = 0
+        # arrival times of recent frames, for the frame rate
+        self._times = deque(maxlen=50)
+
+    def put(self, payload):
+        with self._cond:
+            if self.seq > self._last_read:
+                self.dropped += 1
+            self.seq += 1
+            self.payload = payload
+            self._times.append(time.perf_counter())
+            self._cond.notify_all()
+
+    def get(self, after=0, timeout=0):
+        """
+        Newest frame as (seq, payload) once there is one newer than `after`.
+        Waits up to `timeout` s; returns None if there's nothing new (or the
+        live view stopped).
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self.seq > after or self.closed, timeout)
+            if self.seq <= after:
+                return None
+            self._last_read = self.seq
+            return self.seq, self.payload
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def fps(self):
+        with self._cond:
+            if len(self._times) < 2:
+                return None
+            return (len(self._times) - 1) / (self._times[-1] - self._times[0])
+
+
+class CaptureJob:
+    """Bookkeeping for one asynchronous capture or move (see Horiba.start_capture, start_move)."""
+
+    def __init__(self, job_id, func, kwargs):
+        self.job_id = job_id
+        self.func = func
+        self.kwargs = kwargs
+        self.future = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        # Set as soon as the (last) exposure is over, before readout/saving
+        self.exposure_done = threading.Event()
+        # JobProgress, for job plans (see start_job_plan)
+        self.progress = None
+
+    def state(self):
+        if self.future.cancelled():
+            return "cancelled"
+        if self.future.done():
+            return "error" if self.future.exception() is not None else "done"
+        if self.started is not None:
+            return "running"
+        return "queued"
+
+
+_CCD_STEP_KEYS = {"type", "exptime", "adc", "gain", "spectra", "roi", "bin", "outfile", "frames"}
+_MONO_STEP_KEYS = {"type", "wavelength", "grating"}
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_int_list(value, n):
+    return (isinstance(value, list) and len(value) == n
+            and all(_is_number(v) and v == int(v) for v in value))
+
+
+def check_job(data):
+    """
+    Raise ValueError if `data` (a parsed job file) isn't something the
+    CLI's --job mode accepts. Same rules as load_job in CLI.cpp.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Invalid job file: top level must be an object")
+    unknown = set(data) - {"version", "manifest", "steps"}
+    if unknown:
+        raise ValueError(f"Invalid job file: unknown keys {sorted(unknown)}")
+    if "version" in data and data["version"] != JOB_VERSION:
+        raise ValueError(f"Invalid job file: unsupported version {data['version']}")
+    if "manifest" in data and not isinstance(data["manifest"], str):
+        raise ValueError("Invalid job file: \"manifest\" must be a string")
+    if not isinstance(data.get("steps"), list):
+        raise ValueError("Invalid job file: \"steps\" is required")
+
+    for index, step in enumerate(data["steps"]):
+        where = f"Invalid job file: step {index}:"
+        if not isinstance(step, dict):
+            raise ValueError(f"{where} not an object")
+        kind = str(step.get("type", "")).lower()
+        if kind == "ccd":
+            checks = {
+                "exptime": lambda v: _is_number(v) and v > 0,
+                "adc": lambda v: isinstance(v, str),
+                "gain": lambda v: isinstance(v, str),
+                "spectra": lambda v: isinstance(v, bool),
+                "roi": lambda v: _is_int_list(v, 4),
+                "bin": lambda v: _is_int_list(v, 2),
+                "outfile": lambda v: isinstance(v, str) and v != "",
+                "frames": lambda v: _is_number(v) and v == int(v) and v >= 1,
+            }
+            required = ("exptime", "outfile")
+        elif kind == "mono":
+            checks = {
+                "wavelength": lambda v: _is_number(v) and v >= 0,
+                "grating": _is_number,
+            }
+            required = ()
+        else:
+            raise ValueError(f"{where} \"type\" must be \"ccd\" or \"mono\"")
+
+        for key, value in step.items():
+            if key != "type" and (key not in checks or not checks[key](value)):
+                raise ValueError(f"{where} unknown or invalid {key!r}")
+        for key in required:
+            if key not in step:
+                raise ValueError(f"{where} {key!r} is required")
+        if kind == "mono" and "wavelength" not in step and "grating" not in step:
+            raise ValueError(f"{where} needs \"wavelength\" and/or \"grating\"")
+
+
+class JobPlan:
+    """
+    A job file for `Horiba_CLI.exe --job` (see JOB FILES): mono moves and
+    CCD acquisitions, run in order in one CLI process. Build it with
+    `move` and `capture`, then run it with `Horiba.run_job_plan` or
+    `start_job_plan` (which also take the `as_dict()` form, e.g. over RPyC).
+    """
+
+    def __init__(self, steps = None, manifest = None):
+        self.steps = list(steps or [])
+        # Where the CLI writes the result manifest (None: next to the job file)
+        self.manifest = manifest
+
+    def move(self, wavelength = None, grating = None):
+        """
+        Set the grating and/or the center wavelength (same as `Horiba.move_mono`).
+        Converted with the nominal WAVELENGTH_OFFSET_NM here; `run_job_plan`
+        switches to the calibrated offset.
+        """
+        step = {"type": "mono"}
+        if grating is not None:
+            step["grating"] = float(grating)
+        if wavelength is not None:
+            step["wavelength"] = float(wavelength) - WAVELENGTH_OFFSET_NM
+        self.steps.append(step)
+        return self
+
+    def capture(self, outfile, exposure_s = 1, frames = 1, spectra = True, gain = "High Light",
+                adc = " 50 kHz HS", xstart = 1, xend = 2048, ystart = 1, yend = 512, xbin = 1, ybin = 512):
+        """
+        Take `frames` acquisitions with the same settings (same arguments as
+        `Horiba.capture_spectrum`). With more than one frame, they're saved
+        to OUTFILE_f001.txt, OUTFILE_f002.txt, ... (see `job_frame_path`).
+        """
+        step = {"type": "ccd", "exptime": float(exposure_s), "outfile": outfile, "spectra": bool(spectra),
+                "frames": int(frames)}
+        if gain:
+            step["gain"] = gain
+        if adc:
+            step["adc"] = adc
+        if xstart and xend and ystart and yend:
+            step["roi"] = [int(xstart), int(xend), int(ystart), int(yend)]
+        if xbin and ybin:
+            step["bin"] = [int(xbin), int(ybin)]
+        self.steps.append(step)
+        return self
+
+    def outfiles(self):
+        """(step index, frame, file) of every file the plan saves (without the SDK suffix)."""
+        files = []
+        for index, step in enumerate(self.steps):
+            if step["type"] == "ccd":
+                frames = step.get("frames", 1)
+                for frame in range(1, frames + 1):
+                    files.append((index, frame, job_frame_path(step["outfile"], frame, frames)))
+        return files
+
+    def as_dict(self):
+        data = {"version": JOB_VERSION, "steps": [dict(step) for step in self.steps]}
+        if self.manifest is not None:
+            data["manifest"] = self.manifest
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        check_job(data)
+        return cls(data["steps"], data.get("manifest"))
+
+    def validate(self):
+        """Raise ValueError if the CLI would reject this plan (see `check_job`)."""
+        check_job(self.as_dict())
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.as_dict(), f, indent=1)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            return cls.from_dict(json.load(f))
+
+
+class JobProgress:
+    """
+    Progress of a running job plan, from the CLI's @step/@saved records.
+    Also lets the plan be stopped (after the current frame).
+    """
+
+    def __init__(self, num_steps = None):
+        self.num_steps = num_steps
+        self.current_step = None
+        self.steps_done = 0
+        self.frames_saved = 0
+        self.started = time.time()
+        self._proc = None
+        self._stop = threading.Event()
+
+    def on_record(self, fields):
+        if fields[0] == "step" and fields[2] == "begin":
+            self.current_step = int(fields[1])
+        elif fields[0] == "step" and fields[2] == "end":
+            self.current_step = None
+            self.steps_done += 1
+        elif fields[0] == "saved":
+            self.frames_saved += 1
+
+    def on_start(self, proc):
+        self._proc = proc
+        if self._stop.is_set():
+            self.request_stop()
+
+    def request_stop(self):
+        """Ask the CLI to stop after the current frame/step (same as stopping live view)."""
+        self._stop.set()
+        proc = self._proc
+        if proc is None:
+            return
+        try:
+            proc.stdin.write("stop\n")
+            proc.stdin.flush()
+        except (OSError, ValueError):
+            # already exited
+            pass
+
+    def as_dict(self):
+        elapsed_s = time.time() - self.started
+        eta_s = None
+        if self.steps_done and self.num_steps is not None:
+            eta_s = elapsed_s / self.steps_done * (self.num_steps - self.steps_done)
+        return {
+            "num_steps": self.num_steps,
+            "steps_done": self.steps_done,
+            "current_step": self.current_step,
+            "frames_saved": self.frames_saved,
+            "elapsed_s": elapsed_s,
+            "eta_s": eta_s,
+            "stop_requested": self._stop.is_set(),
+        }
+
+
+# Nominal optics (iHR 550 + SynapsePlus), only the starting point of DispersionModel:
+# anything these get wrong is absorbed by the calibrated corrections
+FOCAL_LENGTH_MM = 550.0
+INCLUDED_ANGLE_DEG = 12.4
+PIXEL_MM = 0.0135
+CHIP_PIXELS = 2048
+
+# Calibration samples kept per grating (newest first out)
+DISPERSION_SAMPLES = 50
+
+# Points kept of each acquired wavelength axis (the axis is smooth, so a few are plenty)
+DISPERSION_AXIS_POINTS = 9
+
+
+def _solve(a, b):
+    """Solve the small linear system a x = b (Gaussian elimination with partial pivoting)."""
+    n = len(b)
+    m = [list(row) + [rhs] for row, rhs in zip(a, b)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(m[r][col]))
+        if abs(m[pivot][col]) < 1e-12:
+            raise ValueError("singular system")
+        m[col], m[pivot] = m[pivot], m[col]
+        for r in range(col + 1, n):
+            f = m[r][col] / m[col][col]
+            for c in range(col, n + 1):
+                m[r][c] -= f * m[col][c]
+    x = [0.0] * n
+    for r in reversed(range(n)):
+        x[r] = (m[r][n] - sum(m[r][c] * x[c] for c in range(r + 1, n))) / m[r][r]
+    return x
+
+
+def _polyfit(xs, ys, degree):
+    """Least-squares polynomial coefficients (increasing degree)."""
+    k = degree + 1
+    ata = [[sum(x ** (i + j) for x in xs) for j in range(k)] for i in range(k)]
+    aty = [sum(y * x ** i for x, y in zip(xs, ys)) for i in range(k)]
+    return _solve(ata, aty)
+
+
+def _polyval(coeffs, x):
+    return sum(c * x ** i for i, c in enumerate(coeffs))
+
+
+class DispersionModel:
+    """
+    Pixel -> wavelength model of the spectrometer, per grating, so the
+    wavelength axis, the detector window and the SDK's wavelength offset
+    can be predicted without running the CLI (see DISPERSION MODEL).
+
+    Each grating gets the grating equation (with the nominal optics above)
+    plus two fitted corrections:
+        offset(sdk):  actual center - SDK wavelength, a polynomial in the
+                      SDK wavelength (WAVELENGTH_OFFSET_NM until calibrated)
+        shape(u):     wavelength error across the detector, a polynomial in
+                      u = (pixel - center pixel) / center pixel
+    fitted to calibration samples: wavelengths at known (full-chip, 0-based)
+    pixels for a known grating and SDK wavelength, from acquired spectra
+    (`add_axis`) or from --info output that reports the detector range
+    (`add_info`).
+    """
+
+    def __init__(self, samples = None):
+        # {grating: [{"sdk_wavelength", "pixels", "wavelengths", "timestamp"}, ...]}
+        self.samples = {int(g): list(s) for g, s in (samples or {}).items()}
+        self._fits = {}
+        self._lock = threading.Lock()
+
+    # Grating equation
+
+    @staticmethod
+    def _grating_axis(grating, center, pixels):
+        """Wavelengths (nm) at `pixels` for an actual center wavelength, from the nominal optics."""
+        d = 1e6 / grating  # groove spacing, nm
+        half_angle = math.radians(INCLUDED_ANGLE_DEG) / 2
+        psi = math.asin(max(-1.0, min(1.0, center / (2 * d * math.cos(half_angle)))))
+        alpha, beta = psi - half_angle, psi + half_angle
+        center_pixel = (CHIP_PIXELS - 1) / 2
+        return [d * (math.sin(alpha) + math.sin(beta + math.atan((p - center_pixel) * PIXEL_MM / FOCAL_LENGTH_MM)))
+                for p in pixels]
+
+    # Calibration data
+
+    def add_sample(self, grating, sdk_wavelength, pixels, wavelengths):
+        """Add wavelengths measured at (full-chip, 0-based) `pixels` and refit that grating."""
+        grating = int(grating)
+        sample = {"sdk_wavelength": float(sdk_wavelength), "pixels": [float(p) for p in pixels],
+                  "wavelengths": [float(w) for w in wavelengths], "timestamp": time.time()}
+        with self._lock:
+            samples = self.samples.setdefault(grating, [])
+            samples.append(sample)
+            del samples[:-DISPERSION_SAMPLES]
+            self._fits.pop(grating, None)
+
+    def add_axis(self, grating, sdk_wavelength, wavelengths, xstart = 1, xbin = 1):
+        """Add the wavelength axis of an acquired spectrum (ROI starting at `xstart`, binned by `xbin`)."""
+        n = len(wavelengths)
+        if n < 2:
+            return
+        picks = sorted({round(i * (n - 1) / (DISPERSION_AXIS_POINTS - 1)) for i in range(DISPERSION_AXIS_POINTS)})
+        # Center of each binned pixel on the chip
+        pixels = [xstart - 1 + xbin * i + (xbin - 1) / 2 for i in picks]
+        self.add_sample(grating, sdk_wavelength, pixels, [wavelengths[i] for i in picks])
+
+    def add_info(self, info):
+        """Add an --info result, if it reports the detector range (wl_start/wl_end)."""
+        try:
+            grating, sdk = info["current_grating"], info["wavelength"]
+            wl_start, wl_end = float(info["wl_start"]), float(info["wl_end"])
+        except (KeyError, TypeError, ValueError):
+            return
+        self.add_sample(grating, sdk, [0, CHIP_PIXELS - 1], [wl_start, wl_end])
+
+    # Fitting
+
+    def _fit(self, grating):
+        """(offset coefficients in (sdk - 600) / 100, shape coefficients in u) for one grating."""
+        with self._lock:
+            if grating in self._fits:
+                return self._fits[grating]
+            samples = list(self.samples.get(grating, []))
+
+        center_pixel = (CHIP_PIXELS - 1) / 2
+        offsets, shape_u, shape_r = [], [], []
+        for sample in samples:
+            # Actual center: the one for which the grating equation matches the sample on average
+            center = sample["sdk_wavelength"] + WAVELENGTH_OFFSET_NM
+            for _ in range(3):
+                model = self._grating_axis(grating, center, sample["pixels"])
+                center += sum(w - m for w, m in zip(sample["wavelengths"], model)) / len(model)
+            offsets.append(((sample["sdk_wavelength"] - 600) / 100, center - sample["sdk_wavelength"]))
+            model = self._grating_axis(grating, center, sample["pixels"])
+            for p, w, m in zip(sample["pixels"], sample["wavelengths"], model):
+                shape_u.append((p - center_pixel) / center_pixel)
+                shape_r.append(w - m)
+
+        offset = [WAVELENGTH_OFFSET_NM]
+        positions = {round(x, 3) for x, _ in offsets}
+        if offsets:
+            degree = min(2, len(positions) - 1)
+            try:
+                offset = _polyfit([x for x, _ in offsets], [y for _, y in offsets], degree)
+            except ValueError:
+                pass
+        shape = [0.0]
+        # (--info samples only have the two ends of the detector, which still fixes the scale)
+        degree = min(3, len({round(u, 3) for u in shape_u}) - 1)
+        if degree >= 1:
+            try:
+                shape = _polyfit(shape_u, shape_r, degree)
+            except ValueError:
+                pass
+
+        with self._lock:
+            self._fits[grating] = (offset, shape)
+        return offset, shape
+
+    # Predictions
+
+    def sdk_offset(self, grating, sdk_wavelength):
+        """Actual center - SDK wavelength (nm) at this SDK wavelength."""
+        offset, _ = self._fit(int(grating))
+        return _polyval(offset, (sdk_wavelength - 600) / 100)
+
+    def center(self, grating, sdk_wavelength):
+        """Actual center wavelength when the SDK reports `sdk_wavelength`."""
+        return sdk_wavelength + self.sdk_offset(grating, sdk_wavelength)
+
+    def sdk_wavelength(self, grating, center):
+        """SDK wavelength to command for an actual center wavelength of `center`."""
+        sdk = center - WAVELENGTH_OFFSET_NM
+        for _ in range(20):
+            step = center - self.center(grating, sdk)
+            sdk += step
+            if abs(step) < 1e-6:
+                break
+        return sdk
+
+    def wavelengths(self, grating, center, pixels):
+        """Wavelengths (nm) at (full-chip, 0-based) `pixels` at this actual center."""
+        _, shape = self._fit(int(grating))
+        center_pixel = (CHIP_PIXELS - 1) / 2
+        model = self._grating_axis(grating, center, pixels)
+        return [m + _polyval(shape, (p - center_pixel) / center_pixel) for p, m in zip(pixels, model)]
+
+    def axis(self, grating, center, xstart = 1, xend = CHIP_PIXELS, xbin = 1):
+        """Wavelength (nm) of each (binned) pixel of the ROI xstart-xend at this actual center."""
+        pixels = [xstart - 1 + xbin * i + (xbin - 1) / 2 for i in range((xend - xstart + 1) // xbin)]
+        return self.wavelengths(grating, center, pixels)
+
+    def window(self, grating, center):
+        """(first, last) wavelength (nm) on the full detector at this actual center."""
+        first, last = self.wavelengths(grating, center, [0, CHIP_PIXELS - 1])
+        return first, last
+
+    def summary(self):
+        """Per grating: number of samples, fitted offset and shape coefficients."""
+        with self._lock:
+            gratings = {g: len(s) for g, s in self.samples.items()}
+        result = {}
+        for grating, count in gratings.items():
+            offset, shape = self._fit(grating)
+            result[grating] = {"samples": count, "offset": offset, "shape": shape}
+        return result
+
+    # Storage
+
+    def as_dict(self):
+        with self._lock:
+            return {"version": 1, "samples": {str(g): list(s) for g, s in self.samples.items()}}
+
+    def save(self, path):
+        """Write the calibration samples atomically (JSON)."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.as_dict(), f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load calibration samples (an empty, uncalibrated model if there's no file yet)."""
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls()
+        return cls(data.get("samples", {}))
+
+
+# Version of the recorded session format (see SessionRecorder)
+SESSION_VERSION = 1
+
+
+def _arg_value(args, flag):
+    """Value following `flag` in a CLI argument list (None if it isn't there)."""
+    if flag in args and args.index(flag) + 1 < len(args):
+        return args[args.index(flag) + 1]
+    return None
+
+
+def _load_job_file(args):
+    """Contents of the job file of a --job call (None if it can't be read)."""
+    try:
+        with open(_arg_value(args, "--job"), "r") as f:
+            return json.load(f)
+    except (TypeError, OSError, ValueError):
+        return None
+
+
+def _announced_file(command, args, job, fields):
+    """
+    File a CLI call has just written, going by the "@" record `fields` it
+    printed (None: the end of the call). None if the record announces no file.
+    """
+    outfile = _arg_value(args, "--outfile")
+    if fields is None:
+        if command == "capture" and outfile:
+            return jy_saved_path(outfile)
+        return None
+    if command == "live" and fields[0] == "frame" and outfile:
+        return live_frame_path(outfile, int(fields[2]))
+    if command == "job" and fields[0] == "saved" and job is not None:
+        index, frame = int(fields[1]), int(fields[2])
+        if index < len(job["steps"]) and "outfile" in job["steps"][index]:
+            step = job["steps"][index]
+            return jy_saved_path(job_frame_path(step["outfile"], frame, step.get("frames", 1)))
+    return None
+
+
+class SessionRecorder:
+    """
+    Records every CLI call to a session directory (see RECORD AND REPLAY):
+    session.json, calls.jsonl (one call per line: command, arguments, each
+    output line with its time, exit code, ...) and files/ (every spectrum
+    or frame the calls saved). Calls are written as soon as they finish,
+    so a session that dies halfway is still usable.
+    """
+
+    def __init__(self, path, exe_path = None):
+        self.path = path
+        os.makedirs(os.path.join(path, "files"), exist_ok=True)
+        self.created = time.time()
+        with open(os.path.join(path, "session.json"), "w") as f:
+            json.dump({"version": SESSION_VERSION, "created": self.created, "exe_path": exe_path}, f)
+        self._lock = threading.Lock()
+        self._calls_file = open(os.path.join(path, "calls.jsonl"), "w")
+        self._seqs = itertools.count()
+        self.calls = 0
+        self.files = 0
+
+    def begin(self, command, args):
+        """Start recording a call; returns the handle to pass its output lines and end to."""
+        return _CallRecording(self, next(self._seqs), command, args)
+
+    def _keep(self, source, seq, n):
+        name = f"{seq:06d}_{n:04d}.txt"
+        try:
+            shutil.copyfile(source, os.path.join(self.path, "files", name))
+        except OSError:
+            return None
+        with self._lock:
+            self.files += 1
+        return name
+
+    def _write(self, record):
+        with self._lock:
+            if self._calls_file is None:
+                return  # stopped while the call was running
+            self._calls_file.write(json.dumps(record) + "\n")
+            self._calls_file.flush()
+            self.calls += 1
+
+    def close(self):
+        with self._lock:
+            if self._calls_file is not None:
+                self._calls_file.close()
+                self._calls_file = None
+
+    def summary(self):
+        return {"path": self.path, "calls": self.calls, "files": self.files}
+
+
+class _CallRecording:
+    """One call being recorded (see SessionRecorder.begin)."""
+
+    def __init__(self, recorder, seq, command, args):
+        self.recorder = recorder
+        self.args = list(args)
+        self.job = _load_job_file(args) if command == "job" else None
+        self.start = time.perf_counter()
+        self.record = {"seq": seq, "command": command, "args": self.args,
+                       "t": time.time() - recorder.created, "events": [], "files": []}
+
+    def _keep(self, fields, event):
+        source = _announced_file(self.record["command"], self.args, self.job, fields)
+        if source is not None:
+            name = self.recorder._keep(source, self.record["seq"], len(self.record["files"]))
+            if name is not None:
+                self.record["files"].append({"event": event, "name": name})
+
+    def line(self, line):
+        """An output line, as soon as the CLI printed it (keeps the file it announces, if any)."""
+        events = self.record["events"]
+        events.append([time.perf_counter() - self.start, line.rstrip("\n")])
+        if line.startswith("@"):
+            self._keep(line[1:].split(), len(events) - 1)
+
+    def end(self, stderr, returncode):
+        self._keep(None, None)
+        if self.job is not None:
+            manifest_path = self.job.get("manifest") or job_manifest_path(_arg_value(self.args, "--job"))
+            try:
+                with open(manifest_path, "r") as f:
+                    self.record["manifest"] = json.load(f)
+            except (OSError, ValueError):
+                pass
+        self.record.update(wall_s=time.perf_counter() - self.start, stderr=stderr, returncode=returncode)
+        self.recorder._write(self.record)
+
+
+class _ReplayStdin:
+    def __init__(self, stop):
+        self._stop = stop
+
+    def write(self, text):
+        self._stop.set()
+
+    def flush(self):
+        pass
+
+
+class _ReplayProcess:
+    """What `on_start` gets during a replay instead of the Popen object (only stdin works)."""
+
+    def __init__(self):
+        self.stop = threading.Event()
+        self.stdin = _ReplayStdin(self.stop)
+
+
+# Field holding the duration (s) in each kind of "@" record that has one
+_RECORD_DURATION_FIELD = {"timing": 2, "status": 2, "step": 3}
+
+
+def _scale_record(line, speed):
+    """An output line with the duration in its "@" record (if any) divided by `speed`."""
+    fields = line[1:].split()
+    index = _RECORD_DURATION_FIELD.get(fields[0]) if line.startswith("@") and fields else None
+    if speed == 1 or index is None or len(fields) <= index:
+        return line
+    try:
+        fields[index] = repr(float(fields[index]) / speed)
+    except ValueError:
+        # e.g. "@step 0 begin ccd"
+        return line
+    return "@" + " ".join(fields)
+
+
+class ReplayBackend:
+    """
+    Plays a recorded session (see SessionRecorder) back instead of running
+    the CLI: each call gets the next recorded call of the same command (in
+    recorded order, starting over when they run out), its output lines at
+    the recorded times divided by `speed` (and so are the durations the
+    "@" records and job manifests report, so they agree with the wall
+    time), and the recorded files saved to wherever the new call asked for
+    them. Live view repeats the recorded
+    frames until it's stopped; a stopped job ends after the current frame.
+    """
+
+    def __init__(self, path, speed = 1.0):
+        self.path = path
+        self.speed = speed
+        with open(os.path.join(path, "session.json"), "r") as f:
+            meta = json.load(f)
+        if meta.get("version") != SESSION_VERSION:
+            raise ValueError(f"Unsupported session version {meta.get('version')} in {path}")
+        self._calls = defaultdict(list)
+        with open(os.path.join(path, "calls.jsonl"), "r") as f:
+            for line in f:
+                if line.strip():
+                    call = json.loads(line)
+                    self._calls[call["command"]].append(call)
+        self._lock = threading.Lock()
+        self._next = defaultdict(int)
+
+    def summary(self):
+        """Number of recorded calls per command."""
+        return {command: len(calls) for command, calls in self._calls.items()}
+
+    def _take(self, command):
+        with self._lock:
+            calls = self._calls.get(command)
+            if not calls:
+                return None
+            call = calls[self._next[command] % len(calls)]
+            self._next[command] += 1
+            return call
+
+    def run(self, command, args, on_line, on_start = None):
+        """Replay one call; `on_line` gets each output line. Returns (stderr, returncode)."""
+        call = self._take(command)
+        if call is None:
+            return f"ERROR: no recorded '{command}' call in {self.path}\n", 1
+        proc = _ReplayProcess()
+        if on_start is not None:
+            on_start(proc)
+        job = _load_job_file(args) if command == "job" else None
+        files = {f["event"]: f["name"] for f in call["files"]}
+        start = time.perf_counter()
+        step = [0, start]  # job step running, and since when
+
+        def emit(t, line, event, recorded=True):
+            delay = start + t / self.speed - time.perf_counter()
+            if delay > 0:
+                proc.stop.wait(delay)
+            if event in files:
+                self._restore(files[event], command, args, job, line[1:].split())
+            if line.startswith("@step") and line.split()[2] == "begin":
+                step[:] = [int(line.split()[1]), time.perf_counter()]
+            on_line((_scale_record(line, self.speed) if recorded else line) + "\n")
+
+        # Lines that announce a file (frames, saved spectra): a stop skips to the end after one of them
+        events = call["events"]
+        announcing = [i for i, (_, line) in enumerate(events) if i in files]
+        last = announcing[-1] if announcing else -1
+        for i, (t, line) in enumerate(events[:last + 1]):
+            emit(t, line, i)
+            if proc.stop.is_set() and i in files:
+                break
+        if command == "live" and announcing and not proc.stop.is_set():
+            self._loop_frames(call, announcing, emit, proc, start)
+        stopped = proc.stop.is_set()
+        for t, line in events[last + 1:]:
+            if stopped and line.startswith("@step"):
+                # The recorded job went on; end the step we stopped in instead (actual duration)
+                emit(0, f"@step {step[0]} end {time.perf_counter() - step[1]}", None, recorded=False)
+                continue
+            if stopped and line.startswith("@status ok"):
+                emit(0, f"@status ok {time.perf_counter() - start}", None, recorded=False)
+                continue
+            emit(0 if stopped else t, line, None)
+
+        if None in files:
+            self._restore(files[None], command, args, job, None)
+        if job is not None and "manifest" in call:
+            self._write_manifest(call["manifest"], args, job, step[0] if stopped else None)
+        return call["stderr"], call["returncode"]
+
+    def _loop_frames(self, call, announcing, emit, proc, start):
+        """Keep repeating the recorded live frames (at the recorded frame period) until stopped."""
+        events = call["events"]
+        first, last = events[announcing[0]][0], events[announcing[-1]][0]
+        period = (last - first) / max(len(announcing) - 1, 1)
+        seq = int(events[announcing[-1]][1].split()[1])
+        t = last
+        while not proc.stop.is_set():
+            for i in announcing:
+                t += period
+                seq += 1
+                fields = events[i][1].split()
+                emit(t, f"{fields[0]} {seq} {fields[2]}", i)
+                if proc.stop.is_set():
+                    return
+
+    def _restore(self, name, command, args, job, fields):
+        target = _announced_file(command, args, job, fields)
+        if target is not None:
+            shutil.copyfile(os.path.join(self.path, "files", name), target)
+
+    def _write_manifest(self, manifest, args, job, stopped_in = None):
+        """The recorded result manifest, with the file names of the new job (cut short at step `stopped_in`)."""
+        manifest = json.loads(json.dumps(manifest))
+        if isinstance(manifest.get("total_s"), (int, float)):
+            manifest["total_s"] /= self.speed
+        steps = []
+        for result in manifest["steps"]:
+            if isinstance(result.get("seconds"), (int, float)):
+                result["seconds"] /= self.speed
+            index = result["index"]
+            if index >= len(job["steps"]) or (stopped_in is not None and index > stopped_in):
+                break
+            step = job["steps"][index]
+            if "outfile" in step:
+                frames = step.get("frames", 1)
+                saved = [job_frame_path(step["outfile"], frame, frames) for frame in range(1, frames + 1)]
+                result["files"] = [path for path in saved if os.path.exists(jy_saved_path(path))]
+            steps.append(result)
+        if stopped_in is not None:
+            manifest["status"] = "stopped"
+            if steps:
+                steps[-1]["status"] = "stopped"
+        manifest["steps"] = steps
+        with open(job.get("manifest") or job_manifest_path(_arg_value(args, "--job")), "w") as f:
+            json.dump(manifest, f)
+
 
 class Horiba:
     """This class controls both the SynapsePlus CCD and the iHR 550 Spectrometer"""
 
-    def __init__(self, exe_path = r"C:\Table4-Code\nspyre_ian\drivers\horiba\Horiba_CLI.exe", ystart=116, yend=136):
+    def __init__(self, exe_path = r"C:\Table4-Code\nspyre_ian\drivers\horiba\Horiba_CLI.exe", ystart=116, yend=136,
+                 calibration_path = None, replay = None, replay_speed = 1.0):
         """
-        `exe_path` is the hard-coded path to the CLI exe.
+        `exe_path` is the hard-coded path to the CLI exe. It can also be a
+        command as a list, e.g. [sys.executable, "horiba_driver.py", "--simulate"]
+        to run job plans without the hardware (see `simulate_job`).
         
         `ystart` and `yend` are the CCD ROI start/end values. This probably
         doesn't change very often. (Current value updated as of 2025-10-15)
+
+        `calibration_path` is where the dispersion model's calibration is
+        kept (default: horiba_dispersion.json next to this file, or not
+        saved at all when replaying).
+
+        `replay` is a recorded session directory to play back instead of
+        running the CLI, `replay_speed` times faster (see RECORD AND REPLAY).
         """
         self.exe_path = exe_path
         self.ystart = 116
         self.yend = 136
 
+        # Rolling CLI timing telemetry, see stats()
+        self._timing_lock = threading.Lock()
+        self._timing_history = defaultdict(lambda: deque(maxlen=TIMING_HISTORY))
+        self.last_timing = None
+
+        # Per-device locks, see DeviceScheduler
+        self.devices = DeviceScheduler()
+
+        # Latest known mono info as (time.time(), info), see get_spec_info(max_age_s=...)
+        self._info_lock = threading.Lock()
+        self._info_cache = None
+
+        # Last known grating and SDK wavelength (kept across moves, unlike the info cache)
+        self._mono = {"grating": None, "sdk_wavelength": None}
+
+        # Record and replay, see RECORD AND REPLAY
+        self._recorder = None
+        self._replay = None if replay is None else ReplayBackend(replay, replay_speed)
+
+        # Wavelength calibration, see DISPERSION MODEL (a replay doesn't touch the real one)
+        if calibration_path is None and replay is None:
+            calibration_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "horiba_dispersion.json")
+        self.calibration_path = calibration_path
+        self.dispersion = DispersionModel() if calibration_path is None else DispersionModel.load(calibration_path)
+
+        # Asynchronous capture jobs. One worker, since there is only one CCD
+        self._jobs = {}
+        self._jobs_lock = threading.Lock()
+        self._job_ids = itertools.count(1)
+        self._job_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="horiba_capture")
+        # Moves get their own worker (the mono and CCD are scheduled separately, see DeviceScheduler)
+        self._move_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="horiba_move")
+
+        # Live view, see start_live
+        self._live_thread = None
+        self._live_proc = None
+        self._live_stop = threading.Event()
+        self._live_frames = LatestFrame()
+        self._live_error = None
+
     def __enter__(self):
         return self
     
-    def __exit__(self):
-        pass
+    def __exit__(self, *args):
+        self.stop_live()
+        self._job_executor.shutdown(wait=True)
+        self._move_executor.shutdown(wait=True)
 
-    def get_spec_info(self):
+    def _run_cli(self, command, args, on_record=None, on_start=None):
+        """
+        Run Horiba_CLI.exe with `args`, record its timing telemetry under
+        `command` and return its stdout (without the telemetry records).
+        Raises HoribaCLIError (with the CLI's error message) on failure.
+
+        `on_record` is called with the fields of each "@" record (e.g.
+        ["timing", "acquisition", "2.5"]) as soon as the CLI prints it.
+        `on_start` is called with the Popen object once the CLI is running.
+        """
+        if isinstance(self.exe_path, (list, tuple)):
+            command_line = list(self.exe_path) + args
+        else:
+            command_line = [self.exe_path] + args
+        recorder = self._recorder
+        recording = None if recorder is None else recorder.begin(command, args)
+        stdout_lines = []
+
+        def on_line(line):
+            stdout_lines.append(line)
+            if recording is not None:
+                recording.line(line)
+            if on_record is not None and line.startswith("@"):
+                try:
+                    on_record(line[1:].split())
+                except Exception:
+                    # never let a callback stop us from reading the output
+                    pass
+
+        start = time.perf_counter()
+        if self._replay is not None:
+            stderr, returncode = self._replay.run(command, args, on_line, on_start)
+        else:
+            with subprocess.Popen(
+                command_line,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+            ) as proc:
+                if on_start is not None:
+                    on_start(proc)
+                for line in proc.stdout:
+                    on_line(line)
+                # stderr only ever holds a short die() message, so reading it last can't deadlock
+                stderr = proc.stderr.read()
+                returncode = proc.wait()
+        wall_s = time.perf_counter() - start
+        if recording is not None:
+            recording.end(stderr, returncode)
+
+        output, timing = parse_cli_output(command, "".join(stdout_lines), wall_s, returncode)
+        self._record_timing(timing)
+
+        if returncode != 0:
+            raise HoribaCLIError(returncode, command_line,
+                                 output=output, stderr=stderr)
+        return output
+
+    def start_recording(self, path):
+        """
+        Record every CLI call from now on (and what it saved) to the session
+        directory `path`, replacing any session recorded there before.
+        See RECORD AND REPLAY.
+        """
+        self.stop_recording()
+        self._recorder = SessionRecorder(path, exe_path=self.exe_path)
+
+    def stop_recording(self):
+        """Stop recording; returns {"path", "calls", "files"} (None if nothing was being recorded)."""
+        recorder, self._recorder = self._recorder, None
+        if recorder is None:
+            return None
+        recorder.close()
+        return recorder.summary()
+
+    def set_replay_speed(self, speed):
+        """How many times faster than recorded a replay runs (see RECORD AND REPLAY)."""
+        if self._replay is None:
+            raise RuntimeError("Not replaying a session")
+        self._replay.speed = speed
+
+    def _record_timing(self, timing):
+        with self._timing_lock:
+            self.last_timing = timing
+            history = self._timing_history
+            for phase, seconds in timing.phases.items():
+                history[(timing.command, phase)].append(seconds)
+            history[(timing.command, 'wall')].append(timing.wall_s)
+            # Process startup, DLL loading, etc. (everything the CLI doesn't time itself)
+            if timing.cli_total_s is not None:
+                history[(timing.command, 'overhead')].append(timing.wall_s - sum(timing.phases.values()))
+            history[(timing.command, 'errors')].append(0.0 if timing.ok else 1.0)
+
+    def stats(self):
+        """
+        Rolling timing statistics of the last TIMING_HISTORY CLI calls, as
+            {command: {phase: {'count', 'mean_s', 'median_s', 'p90_s', 'min_s',
+                               'max_s', 'last_s', 'histogram'}}}
+        where command is one of 'info', 'wavelength', 'grating', 'capture', 'live', 'job'.
+        'wall' is the total time of each call as seen from Python and
+        'overhead' the part of it not covered by any CLI phase.
+        'errors' is a 0/1 series, so its mean is the error rate.
+        Over RPyC, wrap the call in `obtain(...)` to copy the whole thing at
+        once (each key access on the netref is a round trip otherwise).
+        """
+        with self._timing_lock:
+            snapshot = {key: list(values) for key, values in self._timing_history.items()}
+
+        result = {}
+        for (command, phase), durations in snapshot.items():
+            if durations:
+                result.setdefault(command, {})[phase] = _summarize(durations)
+        return result
+
+    def get_last_timing(self):
+        """Timing of the most recent CLI call as a dict (None if there wasn't one)."""
+        with self._timing_lock:
+            return None if self.last_timing is None else self.last_timing.as_dict()
+
+    def get_cached_info(self):
+        """
+        Latest known mono info (same as `get_spec_info`, plus "age_s") without
+        touching the hardware. None if it isn't known (e.g. after a move).
+        """
+        with self._info_lock:
+            if self._info_cache is None:
+                return None
+            timestamp, info = self._info_cache
+        info = dict(info)
+        info["age_s"] = time.time() - timestamp
+        return info
+
+    def _invalidate_info(self):
+        with self._info_lock:
+            self._info_cache = None
+
+    def queue_stats(self):
+        """
+        Queue depth, busy flag and wait time statistics (per priority) of
+        each device's request queue, e.g.
+            {"ccd": {"depth": 0, "busy": True, "wait": {"acquisition": {...}}}, "mono": {...}}
+        """
+        return self.devices.queue_stats()
+
+    def get_spec_info(self, max_age_s = None, priority = "normal"):
         """
         Gets monochromator info, parses key:value output into a dictionary.
 
@@ -67,14 +1614,24 @@ class Horiba:
             wavelength:599.985
             wl_start:552.122
             wl_end:710.087
+        "wavelength" is the SDK's wavelength. "center" (the actual center
+        wavelength) is added, and "wl_start"/"wl_end" too if the CLI
+        doesn't report them, from the dispersion model.
+
+        If `max_age_s` is given and the latest known info is at most that
+        old, it's returned without touching the hardware.
+        `priority` is one of "acquisition", "normal", "gui".
         """
-        result = subprocess.run(
-            [self.exe_path, "--mono", "--info"],
-            capture_output=True, text=True, check=True
-        )
+        if max_age_s is not None:
+            cached = self.get_cached_info()
+            if cached is not None and cached.pop("age_s") <= max_age_s:
+                return cached
+
+        with self.devices.mono_query(priority):
+            output = self._run_cli("info", ["--mono", "--info"])
         info = {}
 
-        for line in result.stdout.strip().splitlines():
+        for line in output.strip().splitlines():
             line = line.strip()
             if not line: 
                 continue
@@ -95,38 +1652,139 @@ class Horiba:
                 except ValueError:
                     info[key] = value
 
+        if "current_grating" in info and "wavelength" in info:
+            self._mono = {"grating": info["current_grating"], "sdk_wavelength": info["wavelength"]}
+            if "wl_start" in info and "wl_end" in info:
+                self._learn(lambda: self.dispersion.add_info(info))
+            info["center"] = self.dispersion.center(info["current_grating"], info["wavelength"])
+            wl_start, wl_end = self.dispersion.window(info["current_grating"], info["center"])
+            info.setdefault("wl_start", wl_start)
+            info.setdefault("wl_end", wl_end)
+
+        with self._info_lock:
+            self._info_cache = (time.time(), dict(info))
         return info
 
-    def set_spec_wavelength(self, wavelength):
+    def set_spec_wavelength(self, wavelength, priority = "normal"):
         """
         Sets the wavelength.
 
         Runs the following command, for example:
             .\CLI.exe --mono --wavelength 580.5
 
-        For some reason, the wavelength set by the SDK is 31 nm off the actual center wavelength.
+        For some reason, the wavelength set by the SDK is ~31 nm off the actual
+        center wavelength. `wavelength` is the actual center; the SDK is sent
+        `sdk_wavelength(wavelength)` (calibrated offset for the current grating).
         """
-        result = subprocess.run(
-            [self.exe_path, "--mono", "--wavelength", str(wavelength-31)],  timeout=999999
-        )
+        with self.devices.mono_move(priority):
+            self._invalidate_info()
+            sdk_wavelength = self.sdk_wavelength(wavelength)
+            self._run_cli("wavelength", ["--mono", "--wavelength", str(sdk_wavelength)])
+            self._mono["sdk_wavelength"] = sdk_wavelength
         return
 
-    def set_spec_grating(self, grating):
+    def set_spec_grating(self, grating, priority = "normal"):
         """
         Sets the spec grating.
 
         Runs (e.g.)
             .\Horiba_CLI.exe --mono --grating 1200
         """
-        result = subprocess.run(
-            [self.exe_path, "--mono", "--grating", str(float(grating))],  timeout=999999
-        )
+        with self.devices.mono_move(priority):
+            self._invalidate_info()
+            self._run_cli("grating", ["--mono", "--grating", str(float(grating))])
+            self._mono["grating"] = int(float(grating))
         return
 
+    def _learn(self, add):
+        """Add calibration data to the dispersion model (`add()`) and save it; never fails a call."""
+        try:
+            add()
+            if self.calibration_path is not None:
+                self.dispersion.save(self.calibration_path)
+        except Exception:
+            pass
+
+    def sdk_wavelength(self, center, grating = None):
+        """SDK wavelength for an actual center wavelength (current grating by default)."""
+        grating = self._mono["grating"] if grating is None else grating
+        if grating is None:
+            return center - WAVELENGTH_OFFSET_NM
+        return self.dispersion.sdk_wavelength(int(grating), center)
+
+    def predict_window(self, center = None, grating = None):
+        """
+        Predicted detector window without touching the hardware, as
+            {"grating", "center", "wl_start", "wl_end", "sdk_wavelength", "sdk_offset"}
+        for an actual center wavelength `center` and `grating` (default: the
+        current ones, as far as the driver knows). None if they're unknown.
+        """
+        grating = self._mono["grating"] if grating is None else int(grating)
+        if grating is None:
+            return None
+        if center is None:
+            if self._mono["sdk_wavelength"] is None:
+                return None
+            center = self.dispersion.center(grating, self._mono["sdk_wavelength"])
+        sdk_wavelength = self.dispersion.sdk_wavelength(grating, center)
+        wl_start, wl_end = self.dispersion.window(grating, center)
+        return {"grating": grating, "center": center, "wl_start": wl_start, "wl_end": wl_end,
+                "sdk_wavelength": sdk_wavelength, "sdk_offset": center - sdk_wavelength}
+
+    def predict_axis(self, center = None, grating = None, xstart = 1, xend = CHIP_PIXELS, xbin = 1):
+        """Predicted wavelength (nm) of each pixel of the ROI (see `predict_window` for the defaults)."""
+        window = self.predict_window(center, grating)
+        if window is None:
+            return None
+        return self.dispersion.axis(window["grating"], window["center"], xstart, xend, xbin)
+
+    def plan_windows(self, wl_start, wl_end, grating = None, overlap = 0.1):
+        """
+        Center wavelengths whose detector windows cover wl_start-wl_end,
+        neighbouring windows overlapping by `overlap` (fraction of a window),
+        e.g. for `capture_windows`.
+        """
+        grating = self._mono["grating"] if grating is None else int(grating)
+        if grating is None:
+            raise ValueError("Grating unknown, pass it explicitly")
+        centers = []
+        start = wl_start
+        while True:
+            # Find the center whose window starts at `start` (a few fixed-point steps)
+            first, last = self.dispersion.window(grating, start)
+            center = start + (last - first) / 2
+            for _ in range(5):
+                first, last = self.dispersion.window(grating, center)
+                center += start - first
+            first, last = self.dispersion.window(grating, center)
+            centers.append(center)
+            if last >= wl_end:
+                return centers
+            start = last - overlap * (last - first)
+
+    def dispersion_summary(self):
+        """Calibration samples and fitted corrections per grating (see DispersionModel)."""
+        return self.dispersion.summary()
+
+    def move_mono(self, wavelength = None, grating = None, priority = "normal"):
+        """Set the grating and/or the center wavelength (in that order)."""
+        if grating is not None:
+            self.set_spec_grating(grating, priority=priority)
+        if wavelength is not None:
+            self.set_spec_wavelength(wavelength, priority=priority)
+
+    def capture_roi(self, xstart = 1, xend = CHIP_PIXELS, ystart = 1, yend = 512):
+        """
+        (xstart, xend, ystart, yend) a capture or live view asked for this
+        ROI actually uses: the y range always comes from the driver.
+        """
+        return xstart, xend, self.ystart, self.yend
+
     # Right now, CCD ROI (in y dir) should be approx 116 to 136
     def capture_spectrum(self, exposure_s = 1, outfile = None, spectra = True,
                          gain = "High Light", adc = " 50 kHz HS", xstart = 1, xend = 2048,
-                         ystart = 1, yend = 512, xbin = 1, ybin = 512):
+                         ystart = 1, yend = 512, xbin = 1, ybin = 512, return_data = False,
+                         on_exposure_done = None, priority = "acquisition"):
         """
         Capture one spectrum using the CCD.
 
@@ -134,6 +1792,18 @@ class Horiba:
 
         `outfile` must be an absolute path ending with the .txt file name.
 
+        If `return_data=True`, the saved data is returned as a
+        (bytes, dtype, shape) tuple (see `pack_data_file`), the file is
+        renamed to exactly `outfile` (without the "_0001_AREA1_1" the SDK
+        adds), and `outfile` may be None, in which case a temporary file
+        is used and deleted afterwards. Otherwise returns None.
+
+        `on_exposure_done` (optional) is called once, from the calling
+        thread, as soon as the exposure is over (before readout/saving).
+        The monochromator can't move from the start of this call until then.
+
+        `priority` is one of "acquisition" (default), "normal", "gui".
+
         `gain` is a string and must exactly match one of the following:
             "High Light", "Best Dynamic", "High Sens.", "Ultimate Sens."
         `adc` is a string and must exactly match one of the following:
@@ -160,10 +1830,13 @@ class Horiba:
         """
 
         # Get ROI vals from object init
-        ystart = self.ystart
-        yend = self.yend
+        xstart, xend, ystart, yend = self.capture_roi(xstart, xend, ystart, yend)
 
-        args = [self.exe_path, "--ccd", "--exptime", str(exposure_s)]
+        keep_file = outfile is not None
+        if return_data and not keep_file:
+            outfile = os.path.join(tempfile.gettempdir(), f"horiba_{uuid.uuid4().hex}.txt")
+
+        args = ["--ccd", "--exptime", str(exposure_s)]
         if spectra:
             args.append("--spectra")
         if outfile:
@@ -177,16 +1850,543 @@ class Horiba:
         if xbin and ybin:
             args += ["--bin", str(xbin), str(ybin)]
         
-        # Doesn't actually print anything to stdout so no need to store the result
+        # Only prints "OK: saved to ..." (+ telemetry) so no need to store the result
         # Also, subprocess.run doesn't return until the .exe finishes running
-        result = subprocess.run(args, capture_output = True, text = True, check = True, timeout=999999)
+        # Errors (from die() in CLI.cpp) are raised as HoribaCLIError with the message from stderr
+        exposure_over = threading.Event()
 
-        # TODO: Detect if there was an error on stderr?
+        def exposure_finished():
+            if exposure_over.is_set():
+                return
+            exposure_over.set()
+            self.devices.end_exposure()
+            if on_exposure_done is not None:
+                on_exposure_done()
+
+        def on_record(fields):
+            if fields[:2] == ["timing", "acquisition"]:
+                exposure_finished()
+
+        with self.devices.ccd(priority):
+            # The mono can't move until the exposure is over, so this is where the spectrum is taken
+            position = dict(self._mono)
+            try:
+                self._run_cli("capture", args, on_record=on_record)
+            finally:
+                exposure_finished()
+
+        if not return_data:
+            return
+
+        saved_path = jy_saved_path(outfile)
+        payload = pack_data_file(saved_path)
+        if spectra and None not in position.values():
+            self._learn(lambda: self.dispersion.add_axis(
+                position["grating"], position["sdk_wavelength"], unpack_wavelengths(payload), xstart, xbin))
+        if keep_file:
+            os.replace(saved_path, outfile)
+        else:
+            os.remove(saved_path)
+        return payload
+
+    def capture_windows(self, wavelengths, outfiles = None, **kwargs):
+        """
+        Capture one spectrum at each center wavelength in `wavelengths`
+        (e.g. to stitch together a range wider than the detector).
+        `outfiles` is a list of the same length (or None), all other
+        arguments are passed on to `capture_spectrum`. Returns the list of
+        `capture_spectrum` return values.
+
+        The move to the next wavelength starts as soon as the previous
+        exposure ends, so it overlaps that step's readout, saving and data
+        transfer.
+        """
+        if outfiles is None:
+            outfiles = [None] * len(wavelengths)
+        if len(outfiles) != len(wavelengths):
+            raise ValueError("Need exactly one outfile per wavelength")
+        kwargs.pop("on_exposure_done", None)
+
+        # Readout/saving of step i runs here while the main loop moves to step i+1
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="horiba_readout") as readout:
+            futures = []
+            for wavelength, outfile in zip(wavelengths, outfiles):
+                # DeviceScheduler makes this wait for the previous exposure (only) to end
+                self.set_spec_wavelength(wavelength, priority="acquisition")
+
+                exposure_done = threading.Event()
+                future = readout.submit(self.capture_spectrum, outfile=outfile,
+                                        on_exposure_done=exposure_done.set, **kwargs)
+                futures.append(future)
+                # Don't queue the next move before this exposure has even started
+                while not exposure_done.wait(0.05):
+                    if future.done():
+                        break
+                if future.done() and future.exception() is not None:
+                    break
+            return [future.result() for future in futures]
+
+    def run_job_plan(self, plan, progress = None, priority = "acquisition"):
+        """
+        Run a `JobPlan` (or its `as_dict()` form) in one CLI process and
+        return its result manifest (see CLI.cpp), with the saved files
+        renamed to exactly the requested names (without the SDK suffix).
+        The result's "status" is "stopped" if the plan was stopped early.
+
+        Holds both devices for the whole plan. As for `capture_spectrum`,
+        the y range of each step's ROI always comes from the driver.
+        `progress` (a JobProgress) is updated as the plan runs.
+        Raises ValueError for an invalid plan (before touching the
+        hardware) and HoribaCLIError if a step fails; the files saved so
+        far are kept, and the manifest (if the plan names one) says which.
+        """
+        if not isinstance(plan, JobPlan):
+            plan = JobPlan.from_dict(plan)
+        plan = JobPlan([dict(step) for step in plan.steps], plan.manifest)
+        grating = self._mono["grating"]
+        for step in plan.steps:
+            if step["type"] == "ccd" and "roi" in step:
+                step["roi"] = step["roi"][:2] + [self.ystart, self.yend]
+            if step["type"] == "mono":
+                grating = step.get("grating", grating)
+                # JobPlan.move uses the nominal offset; use the calibrated one instead
+                if "wavelength" in step:
+                    step["wavelength"] = self.sdk_wavelength(step["wavelength"] + WAVELENGTH_OFFSET_NM, grating)
+        plan.validate()
+
+        job_dir = tempfile.mkdtemp(prefix="horiba_job_")
+        job_path = os.path.join(job_dir, "job.json")
+        manifest_path = plan.manifest or job_manifest_path(job_path)
+        plan.save(job_path)
+
+        if progress is None:
+            progress = JobProgress()
+        progress.num_steps = len(plan.steps)
+
+        try:
+            with self.devices.job(priority):
+                if any(step["type"] == "mono" for step in plan.steps):
+                    self._invalidate_info()
+                    # Where we'll be afterwards (re-read with get_spec_info if the plan fails)
+                    self._mono = {"grating": None, "sdk_wavelength": None}
+                self._run_cli("job", ["--job", job_path], on_record=progress.on_record,
+                              on_start=progress.on_start)
+                for step in plan.steps:
+                    if step["type"] == "mono":
+                        self._mono["grating"] = int(step.get("grating", self._mono["grating"] or 0)) or None
+                        self._mono["sdk_wavelength"] = step.get("wavelength", self._mono["sdk_wavelength"])
+            with open(manifest_path, "r") as f:
+                result = json.load(f)
+        finally:
+            # Rename whatever got saved, even if a step failed
+            for _, _, outfile in plan.outfiles():
+                if os.path.exists(jy_saved_path(outfile)):
+                    os.replace(jy_saved_path(outfile), outfile)
+            os.remove(job_path)
+            if plan.manifest is None and os.path.exists(manifest_path):
+                os.remove(manifest_path)
+            os.rmdir(job_dir)
+        return result
+
+    def _start_job(self, func, kwargs, executor = None):
+        # Captures are an acquisition session until shortly after they're done (or cancelled)
+        token = None
+        if executor is None:
+            token = self.devices.begin_session("a capture")
+            self.devices.renew_sessions()
+        with self._jobs_lock:
+            self._prune_jobs()
+            job = CaptureJob(next(self._job_ids), func, kwargs)
+            self._jobs[job.job_id] = job
+            job.future = (executor or self._job_executor).submit(self._run_job, job)
+        if token is not None:
+            job.future.add_done_callback(lambda _: self._end_job_session(token))
+        return job.job_id
+
+    def _prune_jobs(self):
+        """Forget finished jobs older than JOB_RESULT_TTL_S (call with _jobs_lock held)."""
+        cutoff = time.time() - JOB_RESULT_TTL_S
+        for job_id, job in list(self._jobs.items()):
+            if job.future.done() and (job.finished or job.submitted) < cutoff:
+                del self._jobs[job_id]
+
+    def _end_job_session(self, token):
+        self.devices.end_session(token, SESSION_LINGER_S)
+        self.devices.renew_sessions()
+
+    def begin_acquisition_session(self, name, lease_s = SESSION_LEASE_S):
+        """
+        Keep "gui" priority moves/live view off the spectrometer until
+        `end_acquisition_session(token)` (see ACQUISITION SESSIONS). `name`
+        (e.g. "xhair scan spectra0") shows up in the errors GUIs get.
+        Returns the token.
+        """
+        return self.devices.begin_session(name, lease_s)
+
+    def end_acquisition_session(self, token):
+        self.devices.end_session(token)
+
+    def acquisition_session(self):
+        """Name of the active acquisition session, None if there's none."""
+        return self.devices.active_session()
+
+    def start_capture(self, **kwargs):
+        """
+        Start `capture_spectrum(**kwargs)` on the capture worker thread and
+        return a job id right away. Jobs run one at a time in the order they
+        were started. Use `poll`, `wait` and `result` to follow the job.
+        """
+        return self._start_job(self.capture_spectrum, kwargs)
+
+    def start_capture_windows(self, **kwargs):
+        """Same as `start_capture`, but runs `capture_windows(**kwargs)`."""
+        return self._start_job(self.capture_windows, kwargs)
+
+    def start_job_plan(self, plan):
+        """
+        Start `run_job_plan(plan)` on the capture worker thread and return a
+        job id right away. `poll` includes the plan's progress (see
+        JobProgress.as_dict), `cancel` stops it after the current frame.
+        """
+        return self._start_job(self.run_job_plan, {"plan": plan})
+
+    def start_move(self, **kwargs):
+        """
+        Start `move_mono(**kwargs)` on the move worker thread and return a
+        job id right away (follow it with `poll`, `wait`, `result`, `cancel`).
+        A "gui" priority move raises AcquisitionActiveError right away during
+        an acquisition session.
+        """
+        self.devices.check_gui(kwargs.get("priority", "normal"), "move the monochromator")
+        return self._start_job(self.move_mono, kwargs, self._move_executor)
+
+    def _run_job(self, job):
+        job.started = time.time()
+        try:
+            if job.func == self.capture_spectrum:
+                job.kwargs["on_exposure_done"] = job.exposure_done.set
+            elif job.func == self.run_job_plan:
+                job.progress = job.kwargs["progress"] = JobProgress()
+            return job.func(**job.kwargs)
+        finally:
+            job.exposure_done.set()
+            job.finished = time.time()
+
+    def _get_job(self, job_id):
+        with self._jobs_lock:
+            try:
+                return self._jobs[job_id]
+            except KeyError:
+                raise KeyError(f"Unknown capture job {job_id}") from None
+
+    def poll(self, job_id):
+        """
+        Status of a capture job as a dict with the job's 'state' ("queued",
+        "running", "done", "error" or "cancelled"), 'elapsed_s' (time since
+        the acquisition started) and 'error' (message, if it failed).
+        Over RPyC, wrap the call in `obtain(...)` if you read more than one key.
+        """
+        job = self._get_job(job_id)
+        state = job.state()
+        elapsed_s = None
+        if job.started is not None:
+            elapsed_s = (job.finished or time.time()) - job.started
+        error = None
+        if state == "error":
+            error = str(job.future.exception())
+        return {"job_id": job_id, "state": state, "elapsed_s": elapsed_s, "error": error,
+                "exposure_done": job.exposure_done.is_set(),
+                "progress": None if job.progress is None else job.progress.as_dict()}
+
+    def wait(self, job_id, timeout=5):
+        """
+        Block for up to `timeout` s (keep it well below RPYC_SYNC_TIMEOUT)
+        until the job is finished. Returns True if it's finished.
+        """
+        job = self._get_job(job_id)
+        try:
+            job.future.exception(timeout=timeout)
+        except FutureTimeoutError:
+            return False
+        except Exception:
+            # cancelled
+            pass
+        return True
+
+    def result(self, job_id, timeout=5):
+        """
+        Return value of the finished capture (re-raises its exception if it
+        failed). The job is forgotten afterwards. Raises TimeoutError if it
+        isn't finished within `timeout` s.
+        """
+        job = self._get_job(job_id)
+        try:
+            value = job.future.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise TimeoutError(f"Capture job {job_id} is still {job.state()}") from None
+        finally:
+            if job.future.done():
+                with self._jobs_lock:
+                    self._jobs.pop(job_id, None)
+        return value
+
+    def cancel(self, job_id):
+        """
+        Cancel a job that hasn't started yet (a running acquisition can't be
+        stopped, see KNOWN ISSUES). Returns True if it was cancelled.
+        A running job plan is asked to stop after its current frame instead
+        (also returns True); collect what it did with `result`.
+        """
+        job = self._get_job(job_id)
+        cancelled = job.future.cancel()
+        if cancelled:
+            with self._jobs_lock:
+                self._jobs.pop(job_id, None)
+        elif job.progress is not None and not job.future.done():
+            job.progress.request_stop()
+            return True
+        return cancelled
+
+    def abandon(self, job_id):
+        """
+        Nobody is going to collect this job: forget it as soon as it's done
+        (its result or error is dropped). Unknown job ids are ignored.
+        """
+        with self._jobs_lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            job.future.add_done_callback(lambda _: self._forget_job(job_id))
+
+    def _forget_job(self, job_id):
+        with self._jobs_lock:
+            self._jobs.pop(job_id, None)
+
+    def start_live(self, exposure_s = 0.05, gain = "High Light", adc = "1.00 MHz HS",
+                   xstart = 1, xend = 2048, ystart = 1, yend = 512, xbin = 1, ybin = 512):
+        """
+        Start live view: acquire `exposure_s` spectra back to back (same
+        settings as `capture_spectrum`) until `stop_live` is called. Returns
+        right away; fetch frames with `get_live_frame`.
+        Raises RuntimeError if live view is already running, and
+        AcquisitionActiveError during an acquisition session.
+        """
+        if self._live_thread is not None and self._live_thread.is_alive():
+            raise RuntimeError("Live view is already running")
+        self.devices.check_gui("gui", "start live view")
+
+        # Get ROI vals from object init (same as capture_spectrum)
+        xstart, xend, ystart, yend = self.capture_roi(xstart, xend, ystart, yend)
+
+        outfile = os.path.join(tempfile.gettempdir(), f"horiba_live_{uuid.uuid4().hex}.txt")
+        args = ["--ccd", "--live", "--spectra", "--exptime", str(exposure_s), "--outfile", outfile]
+        if gain:
+            args += ["--gain", gain]
+        if adc:
+            args += ["--adc", adc]
+        if xstart and xend and ystart and yend:
+            args += ["--roi", str(xstart), str(xend), str(ystart), str(yend)]
+        if xbin and ybin:
+            args += ["--bin", str(xbin), str(ybin)]
+
+        self._live_stop.clear()
+        self._live_frames = LatestFrame()
+        self._live_error = None
+        self._live_thread = threading.Thread(target=self._run_live, args=(args, outfile),
+                                             name="horiba_live", daemon=True)
+        self._live_thread.start()
+
+    def _run_live(self, args, outfile):
+        frames = self._live_frames
+
+        def on_record(fields):
+            if fields[0] == "frame":
+                payload = claim_live_frame(live_frame_path(outfile, int(fields[2])))
+                if payload is not None:
+                    frames.put(payload)
+                else:
+                    frames.dropped += 1
+
+        def on_start(proc):
+            self._live_proc = proc
+            if self._live_stop.is_set():
+                self._request_live_stop()
+
+        try:
+            with self.devices.ccd("gui"):
+                # Frames are only for looking at, so don't hold up monochromator moves
+                self.devices.end_exposure()
+                if not self._live_stop.is_set():
+                    self._run_cli("live", args, on_record=on_record, on_start=on_start)
+        except Exception as e:
+            self._live_error = e
+        finally:
+            self._live_proc = None
+            frames.close()
+            # Frames nobody claimed (the outfile name is unique, so these are all ours)
+            prefix = os.path.basename(outfile)[:-len(".txt")] + "_live"
+            for name in os.listdir(os.path.dirname(outfile)):
+                if name.startswith(prefix):
+                    try:
+                        os.remove(os.path.join(os.path.dirname(outfile), name))
+                    except OSError:
+                        pass
+
+    def _request_live_stop(self):
+        proc = self._live_proc
+        if proc is None:
+            return
+        try:
+            proc.stdin.write("stop\n")
+            proc.stdin.flush()
+        except (OSError, ValueError):
+            # already exited
+            pass
+
+    def stop_live(self, timeout = 10):
+        """
+        Stop live view (aborting the current exposure) and wait up to
+        `timeout` s for the CLI to release the CCD. Returns `live_state()`.
+        """
+        self._live_stop.set()
+        self._request_live_stop()
+        thread = self._live_thread
+        if thread is not None:
+            thread.join(timeout)
+        return self.live_state()
+
+    def get_live_frame(self, after = 0, timeout = 0):
+        """
+        Newest live-view frame as (seq, (bytes, dtype, shape)) if there is
+        one newer than frame number `after`, waiting up to `timeout` s (keep
+        this short, it's meant to be polled from a GUI). Returns None
+        otherwise. Frames are numbered from 1.
+        """
+        return self._live_frames.get(after, timeout)
+
+    def live_state(self):
+        """Whether live view is running, frames so far, frames dropped, frame rate and error."""
+        frames = self._live_frames
+        return {
+            "running": self._live_thread is not None and self._live_thread.is_alive(),
+            "frames": frames.seq,
+            "dropped": frames.dropped,
+            "fps": frames.fps(),
+            "error": None if self._live_error is None else str(self._live_error),
+        }
+
+    def device_state(self):
+        """Which devices are currently in use (see DeviceScheduler)."""
+        return self.devices.state()
+
+    def list_jobs(self):
+        """
+        Status (see `poll`) of every job that hasn't been collected with
+        `result` yet (finished ones are kept for JOB_RESULT_TTL_S at most).
+        """
+        with self._jobs_lock:
+            job_ids = list(self._jobs)
+        return [self.poll(job_id) for job_id in job_ids]
+
+
+def _simulated_spectrum(center_nm, pixels, grating):
+    """(wavelengths, counts) of a made-up spectrum: one peak on a flat background."""
+    span_nm = 160 * 1200 / max(grating, 1)
+    wavelengths = [center_nm - span_nm / 2 + span_nm * i / max(pixels - 1, 1) for i in range(pixels)]
+    counts = [600 + round(5000 * math.exp(-((wl - center_nm) / 2) ** 2)) for wl in wavelengths]
+    return wavelengths, counts
+
+
+def simulate_job(job_path, time_scale = 1.0):
+    """
+    Stand-in for `Horiba_CLI.exe --job PATH` without any hardware, for
+    trying out job plans (and everything that follows their progress).
+    Checks the job file the same way, prints the same records, "acquires"
+    made-up spectra (each taking exptime * time_scale) and writes the same
+    result manifest. Stops after the current frame when a line arrives on
+    stdin (a closed stdin doesn't count, so it also runs from scripts/CI
+    with no stdin). Returns the exit code.
+    """
+    total_start = time.perf_counter()
+    try:
+        with open(job_path, "r") as f:
+            data = json.load(f)
+        check_job(data)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    stop = threading.Event()
+
+    def wait_for_stop():
+        # readline() returns '' right away at EOF, which isn't a stop request
+        if sys.stdin is not None and sys.stdin.readline():
+            stop.set()
+
+    threading.Thread(target=wait_for_stop, daemon=True).start()
+
+    def lap(phase, start):
+        print(f"@timing {phase} {time.perf_counter() - start}", flush=True)
+        return time.perf_counter()
+
+    manifest_path = data.get("manifest") or job_manifest_path(job_path)
+    wavelength, grating = 600.0 - WAVELENGTH_OFFSET_NM, 1200.0
+    results = []
+    stopped = False
+    for index, step in enumerate(data["steps"]):
+        if stop.is_set():
+            stopped = True
+            break
+        step_start = t = time.perf_counter()
+        result = {"index": index, "type": step["type"].lower(), "status": "running", "seconds": 0, "files": []}
+        results.append(result)
+        print(f"@step {index} begin {result['type']}", flush=True)
+        if result["type"] == "mono":
+            grating = step.get("grating", grating)
+            wavelength = step.get("wavelength", wavelength)
+            time.sleep(0.5 * time_scale)
+            t = lap("mono_move", t)
+        else:
+            xstart, xend = step.get("roi", [1, 2048])[:2]
+            pixels = (xend - xstart + 1) // step.get("bin", [1])[0]
+            frames = step.get("frames", 1)
+            t = lap("params", t)
+            for frame in range(1, frames + 1):
+                if frame > 1 and stop.is_set():
+                    stopped = True
+                    break
+                time.sleep(step["exptime"] * time_scale)
+                t = lap("acquisition", t)
+                outfile = job_frame_path(step["outfile"], frame, frames)
+                wavelengths, counts = _simulated_spectrum(wavelength + WAVELENGTH_OFFSET_NM, pixels, grating)
+                with open(jy_saved_path(outfile), "w") as f:
+                    f.writelines(f"{wl:.4f}\t{c}\n" for wl, c in zip(wavelengths, counts))
+                t = lap("save", t)
+                result["files"].append(outfile)
+                print(f"@saved {index} {frame}", flush=True)
+        result["seconds"] = time.perf_counter() - step_start
+        result["status"] = "stopped" if stopped else "ok"
+        print(f"@step {index} end {result['seconds']}", flush=True)
+        if stopped:
+            break
+
+    status = "stopped" if stopped else "ok"
+    with open(manifest_path, "w") as f:
+        json.dump({"version": JOB_VERSION, "status": status, "error": None,
+                   "total_s": time.perf_counter() - total_start, "steps": results}, f)
+    print(f"OK: job {'stopped' if stopped else 'done'}, results in {manifest_path}")
+    print(f"@status ok {time.perf_counter() - total_start}", flush=True)
+    return 0
 
-        return
-        
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["--simulate"]:
+        # python horiba_driver.py --simulate --job PATH (see simulate_job)
+        if sys.argv[2:3] != ["--job"] or len(sys.argv) != 4:
+            print("Usage: --simulate --job PATH", file=sys.stderr)
+            sys.exit(2)
+        sys.exit(simulate_job(sys.argv[3]))
+
     horiba = Horiba()
     info = horiba.get_spec_info()
-    print(info)
\ No newline at end of file
+    print(info)
+    print(horiba.stats())
\ No newline at end of file
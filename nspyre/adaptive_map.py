@@ -0,0 +1,192 @@
+"""
+Quadtree bookkeeping for adaptive maps (AdaptiveMapMeasurement): start
+with a coarse grid over a rectangle, then only subdivide the cells where
+something is going on, so the exposures go to the features instead of
+the empty substrate.
+
+	smap = SparseMap(bounds=(x0, x1, y0, y1), coarse_shape=(nx, ny))
+	keys = smap.coarse_keys()
+	while keys:
+		for key in keys:
+			...acquire a spectrum at smap.center(key)...
+			smap.add(key, *spectral_features(wavelengths, counts))
+		keys = refine(smap, max_new_points, threshold, max_depth)
+	image, extent = smap.rasterize()
+
+A cell is addressed by its key (depth, i, j): at depth d the rectangle is
+split into (nx * 2**d) x (ny * 2**d) cells, and a cell's 4 children are
+(d + 1, 2i + {0, 1}, 2j + {0, 1}). Each cell is measured once, at its
+center. The measured cells form the sparse index; the map at any point
+is the value of the finest measured cell covering it.
+
+A cell's score (0-1) is a mix of its signal (relative to the strongest
+one so far) and how different its spectrum is from its neighbours'
+(see `spectral_distance`). Each stage subdivides the highest-scoring
+leaf cells above `threshold`, as many as the point budget allows.
+
+A. Wellisz 2025-10
+"""
+
+import numpy as np
+
+# Number of bins spectra are reduced to for comparing them with their neighbours
+FEATURE_BINS = 64
+
+_NEIGHBOUR_OFFSETS = [(di, dj) for di in (-1, 0, 1) for dj in (-1, 0, 1) if (di, dj) != (0, 0)]
+
+
+def spectral_features(wavelengths, counts, bins: int = FEATURE_BINS):
+	"""
+	(signal, features) of a spectrum: signal is the integrated counts
+	above the median background, features the background-subtracted
+	spectrum averaged into `bins` bins (what neighbours are compared on).
+	"""
+	counts = np.asarray(counts, dtype=float)
+	above = np.clip(counts - np.median(counts), 0, None)
+	bins = min(bins, len(above))
+	features = np.array([chunk.mean() for chunk in np.array_split(above, bins)])
+	return float(above.sum()), features
+
+
+def spectral_distance(a, b) -> float:
+	"""
+	How different two feature vectors are, from 0 (same) to 1 (nothing in
+	common, e.g. a peak next to bare substrate). Sensitive to both the
+	intensity and the shape of the spectra.
+	"""
+	norm = np.linalg.norm(a) + np.linalg.norm(b)
+	if norm == 0:
+		return 0.0
+	return float(np.linalg.norm(np.asarray(a) - np.asarray(b)) / norm)
+
+
+class SparseMap:
+	"""Measured quadtree cells over a rectangle (see module docstring)."""
+
+	def __init__(self, bounds, coarse_shape):
+		self.bounds = tuple(float(b) for b in bounds)
+		self.coarse_shape = (int(coarse_shape[0]), int(coarse_shape[1]))
+		if min(self.coarse_shape) < 1:
+			raise ValueError('The coarse grid needs at least 1 x 1 cells')
+		# key -> {'signal', 'features', plus whatever else was added (label, path, ...)}
+		self.cells = {}
+		self._refined = set()
+
+	def coarse_keys(self) -> list:
+		"""Keys of the coarse grid, row by row."""
+		nx, ny = self.coarse_shape
+		return [(0, i, j) for j in range(ny) for i in range(nx)]
+
+	def cell_size(self, depth: int):
+		x0, x1, y0, y1 = self.bounds
+		nx, ny = self.coarse_shape
+		return (x1 - x0) / (nx * 2 ** depth), (y1 - y0) / (ny * 2 ** depth)
+
+	def center(self, key):
+		"""(x, y) of the center of the cell."""
+		depth, i, j = key
+		sx, sy = self.cell_size(depth)
+		return self.bounds[0] + (i + 0.5) * sx, self.bounds[2] + (j + 0.5) * sy
+
+	def _in_bounds(self, key) -> bool:
+		depth, i, j = key
+		nx, ny = self.coarse_shape
+		return 0 <= i < nx * 2 ** depth and 0 <= j < ny * 2 ** depth
+
+	@staticmethod
+	def children(key) -> list:
+		depth, i, j = key
+		return [(depth + 1, 2 * i + di, 2 * j + dj) for dj in (0, 1) for di in (0, 1)]
+
+	def add(self, key, signal: float, features, **info):
+		"""Record the measurement of a cell (`info` is kept with it, e.g. label=..., path=...)."""
+		self.cells[tuple(key)] = dict(info, signal=float(signal), features=np.asarray(features, dtype=float))
+		if key[0] > 0:
+			self._refined.add((key[0] - 1, key[1] // 2, key[2] // 2))
+
+	def __len__(self):
+		return len(self.cells)
+
+	def leaves(self) -> list:
+		"""Measured cells that haven't been subdivided (any of their children measured)."""
+		return [key for key in self.cells if key not in self._refined]
+
+	def covering(self, key):
+		"""The finest measured cell at or above `key` (None if there's none)."""
+		while key not in self.cells:
+			if key[0] == 0:
+				return None
+			key = (key[0] - 1, key[1] // 2, key[2] // 2)
+		return key
+
+	def neighbours(self, key) -> set:
+		"""Measured cells around `key` (same size or, where it hasn't been refined, bigger)."""
+		depth, i, j = key
+		found = set()
+		for di, dj in _NEIGHBOUR_OFFSETS:
+			other = (depth, i + di, j + dj)
+			if self._in_bounds(other):
+				other = self.covering(other)
+				if other is not None and other != key:
+					found.add(other)
+		return found
+
+	def scores(self, keys = None, change_weight: float = 0.5) -> dict:
+		"""
+		Score (0-1) of each cell in `keys` (default: the leaves):
+		(1 - change_weight) * signal / strongest signal
+		+ change_weight * largest spectral distance to a neighbour.
+		"""
+		keys = self.leaves() if keys is None else keys
+		max_signal = max((cell['signal'] for cell in self.cells.values()), default=0.0)
+		result = {}
+		for key in keys:
+			cell = self.cells[key]
+			signal = cell['signal'] / max_signal if max_signal > 0 else 0.0
+			change = max((spectral_distance(cell['features'], self.cells[other]['features'])
+						  for other in self.neighbours(key)), default=0.0)
+			result[key] = (1 - change_weight) * signal + change_weight * change
+		return result
+
+	def points(self, field: str = 'signal') -> np.ndarray:
+		"""(N x 3) array of (x, y, value) of every measured cell."""
+		rows = [(*self.center(key), cell.get(field, np.nan)) for key, cell in self.cells.items()]
+		return np.array(rows, dtype=float).reshape(-1, 3)
+
+	def rasterize(self, field: str = 'signal', depth: int = None):
+		"""
+		The map as an image (rows = y, columns = x) with cells of the size
+		at `depth` (default: the finest measured), each pixel showing the
+		finest measured cell covering it (NaN where nothing is measured yet).
+		Returns (image, (x0, x1, y0, y1)).
+		"""
+		if depth is None:
+			depth = max((key[0] for key in self.cells), default=0)
+		nx, ny = self.coarse_shape
+		image = np.full((ny * 2 ** depth, nx * 2 ** depth), np.nan)
+		# Coarse first, so finer cells paint over their parents
+		for key in sorted(self.cells, key=lambda k: k[0]):
+			d, i, j = key
+			if d > depth:
+				continue
+			scale = 2 ** (depth - d)
+			image[j * scale:(j + 1) * scale, i * scale:(i + 1) * scale] = self.cells[key].get(field, np.nan)
+		return image, self.bounds
+
+
+def refine(smap: SparseMap, max_points: int, threshold: float = 0.25, max_depth: int = 3,
+		   change_weight: float = 0.5) -> list:
+	"""
+	Keys of the cells to measure next: the children of the highest-scoring
+	leaves scoring at least `threshold` that are shallower than `max_depth`,
+	at most `max_points` of them (whole cells only, 4 children each).
+	Bigger cells go first when scores tie. Empty when nothing needs refining.
+	"""
+	candidates = [key for key in smap.leaves() if key[0] < max_depth]
+	scores = smap.scores(candidates, change_weight)
+	ranked = sorted((key for key in candidates if scores[key] >= threshold),
+					key=lambda key: (-scores[key], key[0]))
+	keys = []
+	for key in ranked[:max(0, int(max_points)) // 4]:
+		keys += [child for child in smap.children(key) if child not in smap.cells]
+	return keys
@@ -0,0 +1,315 @@
+"""
+Removes smooth baselines (fluorescence, stray light) from whole stacks
+of spectra (N_spectra x N_pixels) at once, instead of one asymmetric
+least squares solve per spectrum in a loop.
+
+	baseline = fit_baselines(folder.counts, lam=1e6)
+	corrected = folder.counts - baseline
+
+Both methods are Whittaker smoothers, i.e. the baseline z of a spectrum
+y minimizes
+	sum w_i (y_i - z_i)^2 + lam * sum (z_i - 2 z_{i+1} + z_{i+2})^2
+which is the pentadiagonal system (W + lam D'D) z = W y. lam sets the
+stiffness (~1e4-1e8 for 2048 pixels, it scales with the 4th power of
+the width of the features to ignore).
+	clip (default): W = 1 and the spectrum is clipped to the baseline
+		between iterations (y <- min(y, z)), so the matrix never changes:
+		it's factorized once per (length, lam), cached and reused for
+		every spectrum and iteration. For a few spectra at a time (e.g.
+		one per scan point) the cached inverse is used instead, which
+		is one matrix product per iteration.
+	asls: asymmetric least squares (Eilers & Boelens). The weights are p
+		below the baseline and 1 - p above it, re-solved until they stop
+		changing, so every iteration factorizes W + lam D'D again (one
+		batched LDL' for all spectra). Slower, exact AsLS.
+
+The substitutions run along the pixels with all spectra of a chunk as
+one vector per pixel (arrays are pixels x spectra), so the cost is
+~2 * N_pixels numpy operations per iteration whatever the number of
+spectra. Spectra that have converged drop out of the iterations.
+
+`python -m experiments.Spectra.baseline` prints the throughput (see
+`benchmark`).
+
+A. Wellisz 2025-10
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+
+METHODS = ('clip', 'asls')
+
+# Spectra solved together (bigger chunks have less per-pixel overhead but fall out of cache)
+CHUNK = 512
+
+# Below this many spectra a process pool costs more than it saves
+_MIN_SPECTRA_FOR_POOL = 512
+
+# Below this many spectra 'clip' multiplies by the cached inverse instead of substituting
+_DENSE_BELOW = 32
+
+
+@lru_cache(maxsize=16)
+def penalty_bands(n: int, lam: float):
+	"""
+	Bands of lam * D'D (D: second differences) for n pixels, as (diagonal,
+	first off-diagonal, second off-diagonal), with the off-diagonals
+	indexed by their lower row (element [k] is row k, column k-1 or k-2).
+	"""
+	if n < 3:
+		raise ValueError('Baseline removal needs at least 3 pixels')
+	diagonal = np.full(n, 6.0)
+	diagonal[[0, -1]] = 1
+	diagonal[[1, -2]] = 5
+	if n == 3:
+		diagonal[1] = 4
+	first = np.full(n, -4.0)
+	first[0] = 0
+	first[[1, -1]] = -2
+	second = np.ones(n)
+	second[:2] = 0
+	for band in (diagonal, first, second):
+		band *= lam
+		band.flags.writeable = False
+	return diagonal, first, second
+
+
+def _factorize(diagonal, first, second):
+	"""
+	LDL' of a symmetric pentadiagonal matrix, for many matrices at once
+	when `diagonal` is (n x N) (the off-diagonals are shared). Returns
+	(d, l1, l2) where l1[k] = L[k, k-1] and l2[k] = L[k, k-2].
+	"""
+	n = len(first)
+	d = np.empty(diagonal.shape)
+	l1 = np.zeros(diagonal.shape)
+	l2 = np.zeros(diagonal.shape)
+	d[0] = diagonal[0]
+	l1[1] = first[1] / d[0]
+	d[1] = diagonal[1] - l1[1] ** 2 * d[0]
+	for k in range(2, n):
+		l2[k] = second[k] / d[k - 2]
+		l1[k] = (first[k] - l2[k] * d[k - 2] * l1[k - 1]) / d[k - 1]
+		d[k] = diagonal[k] - l1[k] ** 2 * d[k - 1] - l2[k] ** 2 * d[k - 2]
+	return d, l1, l2
+
+
+def _substitute(factor, rhs):
+	"""Solve L D L' x = rhs (n x N) with a factor from _factorize. Overwrites rhs."""
+	d, l1, l2 = factor
+	x = rhs
+	n = len(x)
+	x[1] -= l1[1] * x[0]
+	for k in range(2, n):
+		x[k] -= l1[k] * x[k - 1] + l2[k] * x[k - 2]
+	x /= d
+	x[n - 2] -= l1[n - 1] * x[n - 1]
+	for k in range(n - 3, -1, -1):
+		x[k] -= l1[k + 1] * x[k + 1] + l2[k + 2] * x[k + 2]
+	return x
+
+
+@lru_cache(maxsize=16)
+def whittaker_factor(n: int, lam: float):
+	"""Cached LDL' of I + lam D'D (the fixed matrix of the 'clip' method); vectors of length n."""
+	diagonal, first, second = penalty_bands(n, lam)
+	factor = _factorize(1 + diagonal, first, second)
+	# Column vectors, so they broadcast against (n x N) right-hand sides
+	factor = tuple(f[:, None] for f in factor)
+	for f in factor:
+		f.flags.writeable = False
+	return factor
+
+
+@lru_cache(maxsize=2)
+def whittaker_inverse(n: int, lam: float) -> np.ndarray:
+	"""Cached (I + lam D'D)^-1 (n x n, so only kept for a couple of (n, lam))."""
+	inverse = _substitute(whittaker_factor(n, lam), np.eye(n))
+	inverse.flags.writeable = False
+	return inverse
+
+
+def _asls(y, valid, lam, p, max_iter):
+	"""Asymmetric least squares baselines of y (n x N, NaN-free)."""
+	n, m = y.shape
+	diagonal, first, second = penalty_bands(n, lam)
+	weights = valid.astype(float)
+	baseline = np.empty_like(y)
+	active = np.arange(m)
+	for _ in range(max_iter):
+		w, ya = weights[:, active], y[:, active]
+		factor = _factorize(w + diagonal[:, None], first, second)
+		z = _substitute(factor, w * ya)
+		baseline[:, active] = z
+		new = np.where(valid[:, active], np.where(ya > z, p, 1 - p), 0.0)
+		changed = np.any(new != w, axis=0)
+		weights[:, active] = new
+		active = active[changed]
+		if active.size == 0:
+			break
+	return baseline
+
+
+def _clip(y, valid, lam, max_iter, tol):
+	"""Clipped Whittaker baselines of y (n x N, NaN-free), with the cached factorization."""
+	n, m = y.shape
+	if m < _DENSE_BELOW:
+		inverse = whittaker_inverse(n, lam)
+		solve = lambda rhs: inverse @ rhs
+	else:
+		factor = whittaker_factor(n, lam)
+		solve = lambda rhs: _substitute(factor, rhs.copy())
+	# Gaps: start from the smoothed spectrum there instead of a made-up value
+	y = y.copy()
+	baseline = solve(y)
+	y[~valid] = baseline[~valid]
+	scale = np.maximum(np.max(np.abs(y), axis=0), 1e-300)
+	active = np.arange(m)
+	for _ in range(max_iter):
+		ya = np.minimum(y[:, active], baseline[:, active])
+		y[:, active] = ya
+		z = solve(ya)
+		change = np.max(np.abs(z - baseline[:, active]), axis=0) / scale[active]
+		baseline[:, active] = z
+		active = active[change > tol]
+		if active.size == 0:
+			break
+	return baseline
+
+
+def _fit_chunk(args):
+	# Runs in the worker processes (and for every chunk otherwise)
+	counts, method, lam, p, max_iter, tol = args
+	y = np.ascontiguousarray(counts.T)
+	valid = np.isfinite(y)
+	y = np.where(valid, y, 0.0)
+	if method == 'asls':
+		baseline = _asls(y, valid, lam, p, max_iter)
+	else:
+		baseline = _clip(y, valid, lam, max_iter, tol)
+	return baseline.T
+
+
+def fit_baselines(counts, method: str = 'clip', lam: float = 1e6, p: float = 0.01, max_iter: int = 30,
+				  tol: float = 1e-3, workers: int = 1, chunk: int = CHUNK) -> np.ndarray:
+	"""
+	Baseline of every row of `counts` (N x P, or a single spectrum (P,)),
+	same shape as `counts`. NaNs (e.g. padding from load_spectra_folder)
+	are ignored and get a baseline value anyway.
+
+	`method` is one of METHODS, `lam` the smoothness (see module
+	docstring), `p` the asymmetry of 'asls'. Iterations stop once a
+	spectrum's weights ('asls') or its baseline ('clip', relative change
+	`tol`) stop changing, or after `max_iter`.
+
+	`workers` > 1 splits the spectra across that many processes (0/None =
+	number of cores), which only pays off for large batches.
+	"""
+	if method not in METHODS:
+		raise ValueError(f'Unknown baseline method {method!r}, must be one of {METHODS}')
+	counts = np.asarray(counts, dtype=float)
+	single = counts.ndim == 1
+	counts = np.atleast_2d(counts)
+	lam = float(lam)
+
+	bounds = list(range(0, len(counts), chunk)) + [len(counts)]
+	chunks = [(counts[a:b], method, lam, p, max_iter, tol) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+	workers = workers or os.cpu_count() or 1
+	if workers > 1 and len(counts) >= _MIN_SPECTRA_FOR_POOL and len(chunks) > 1:
+		with ProcessPoolExecutor(max_workers=workers) as pool:
+			results = list(pool.map(_fit_chunk, chunks))
+	else:
+		results = [_fit_chunk(c) for c in chunks]
+	baseline = np.concatenate(results) if results else np.empty_like(counts)
+	return baseline[0] if single else baseline
+
+
+class BaselineRemover:
+	"""
+	Baseline removal with fixed settings, as a processing stage:
+		remover = BaselineRemover(lam=1e6)
+		corrected = remover(counts)  # (P,) or (N x P)
+	"""
+
+	def __init__(self, method: str = 'clip', lam: float = 1e6, p: float = 0.01, **kwargs):
+		if method not in METHODS:
+			raise ValueError(f'Unknown baseline method {method!r}, must be one of {METHODS}')
+		self.method = method
+		self.lam = lam
+		self.p = p
+		self.kwargs = kwargs
+
+	def baseline(self, counts) -> np.ndarray:
+		return fit_baselines(counts, self.method, self.lam, self.p, **self.kwargs)
+
+	def __call__(self, counts) -> np.ndarray:
+		counts = np.asarray(counts, dtype=float)
+		return counts - self.baseline(counts)
+
+
+def synthetic_spectra(n: int, pixels: int = 2048, seed: int = 0):
+	"""(N x P) test spectra: a broad curved background, two narrow peaks and noise. Returns (counts, baselines)."""
+	rng = np.random.default_rng(seed)
+	x = np.linspace(0, 1, pixels)
+	curvature = rng.uniform(200, 2000, (n, 1))
+	baselines = 500 + curvature * np.exp(-((x - rng.uniform(0.2, 0.8, (n, 1))) / 0.5) ** 2)
+	peaks = sum(rng.uniform(500, 5000, (n, 1)) * np.exp(-((x - c) / 0.004) ** 2) for c in (0.3, 0.62))
+	return baselines + peaks + rng.normal(0, 10, (n, pixels)), baselines
+
+
+def _reference_asls(y, lam, p, max_iter):
+	"""One spectrum at a time, dense solve (the slow way this module replaces), for the benchmark."""
+	n = len(y)
+	d = np.diff(np.eye(n), 2, axis=0)
+	penalty = lam * d.T @ d
+	w = np.ones(n)
+	for _ in range(max_iter):
+		z = np.linalg.solve(np.diag(w) + penalty, w * y)
+		new = np.where(y > z, p, 1 - p)
+		if np.array_equal(new, w):
+			break
+		w = new
+	return z
+
+
+def benchmark(n_spectra: int = 2000, pixels: int = 2048, lam: float = 1e6, workers: int = 1,
+			  reference_spectra: int = 3) -> dict:
+	"""
+	Spectra per second of each method on synthetic (n_spectra x pixels)
+	stacks, their RMS error against the true baselines, the same for one
+	spectrum at a time ('clip_single', as in a scan) and for a
+	per-spectrum dense AsLS loop on `reference_spectra` spectra.
+	"""
+	counts, truth = synthetic_spectra(n_spectra, pixels)
+	result = {}
+	# The caches are warm in any real use
+	whittaker_factor(pixels, float(lam))
+	whittaker_inverse(pixels, float(lam))
+	for method in METHODS:
+		start = time.perf_counter()
+		baseline = fit_baselines(counts, method, lam, workers=workers)
+		elapsed = time.perf_counter() - start
+		result[method] = {'spectra_per_s': n_spectra / elapsed,
+						  'rms_error': float(np.sqrt(np.mean((baseline - truth) ** 2)))}
+	singles = min(n_spectra, 50)
+	start = time.perf_counter()
+	for y in counts[:singles]:
+		fit_baselines(y, 'clip', lam)
+	result['clip_single'] = {'spectra_per_s': singles / (time.perf_counter() - start)}
+	if reference_spectra:
+		start = time.perf_counter()
+		for y in counts[:reference_spectra]:
+			_reference_asls(y, lam, 0.01, 30)
+		result['per_spectrum_dense'] = {'spectra_per_s': reference_spectra / (time.perf_counter() - start)}
+	return result
+
+
+if __name__ == '__main__':
+	for workers in (1, 0):
+		for method, stats in benchmark(workers=workers, reference_spectra=3 if workers == 1 else 0).items():
+			error = f", rms error {stats['rms_error']:.1f} counts" if 'rms_error' in stats else ''
+			print(f"{method:>20} (workers={workers or os.cpu_count()}): {stats['spectra_per_s']:8.1f} spectra/s{error}")
@@ -0,0 +1,114 @@
+"""
+Background thread that follows a dataserv dataset for a widget: the
+DataSink lives on its own QThread and is polled there, so connecting
+to it or waiting for pushes never blocks the Qt thread. The latest
+values of the keys the widget cares about (e.g. 'map', 'clusters')
+come back as a signal whenever a push arrives.
+
+A. Wellisz 2025-10
+"""
+
+import logging
+import time
+
+from pyqtgraph.Qt import QtCore
+
+from nspyre.data.sink import DataSink
+
+_logger = logging.getLogger(__name__)
+
+# How often (ms) the sink is checked for new pushes
+POLL_MS = 200
+
+# How long (s) to wait for the sink to connect
+CONNECT_TIMEOUT_S = 5
+
+# Max number of queued pushes merged into a single update
+MAX_POPS_PER_UPDATE = 50
+
+
+class DatasetWatcher(QtCore.QObject):
+	"""
+	Follows one dataset at a time on its own QThread. Call `watch` and
+	`stop` from the GUI thread; `updated` carries {key: latest value} of
+	`keys` (missing ones left out) after each batch of pushes.
+	"""
+
+	updated = QtCore.Signal(object)
+	failed = QtCore.Signal(str)
+
+	_watch_requested = QtCore.Signal(str)
+	_stop_requested = QtCore.Signal()
+
+	def __init__(self, keys):
+		super().__init__()
+		self.keys = tuple(keys)
+		self._sink = None
+		self._thread = QtCore.QThread()
+		# A child, so it moves to the worker thread with us
+		self._timer = QtCore.QTimer(self)
+		self._timer.timeout.connect(self._poll)
+		self.moveToThread(self._thread)
+		# Queued connections, since the slots live in the worker thread
+		self._watch_requested.connect(self._do_watch)
+		self._stop_requested.connect(self._do_close, QtCore.Qt.ConnectionType.BlockingQueuedConnection)
+		self._thread.start()
+
+	def watch(self, dataset: str):
+		"""Follow `dataset` instead of the current one ('' = none)."""
+		self._watch_requested.emit(dataset)
+
+	def stop(self):
+		"""Disconnect and shut the worker thread down (e.g. when the application quits)."""
+		if self._thread.isRunning():
+			self._stop_requested.emit()
+			self._thread.quit()
+			self._thread.wait(2000)
+
+	@QtCore.Slot(str)
+	def _do_watch(self, dataset):
+		self._do_close()
+		if not dataset:
+			return
+		try:
+			sink = DataSink(dataset)
+			sink.start()
+			start = time.monotonic()
+			while not sink.is_running and time.monotonic() - start < CONNECT_TIMEOUT_S:
+				time.sleep(0.1)
+			if not sink.is_running:
+				sink.stop()
+				self.failed.emit(f"Timeout connecting to dataset {dataset}")
+				return
+		except Exception as e:
+			self.failed.emit(f"Could not connect to dataset {dataset}: {e}")
+			return
+		self._sink = sink
+		self._timer.start(POLL_MS)
+
+	@QtCore.Slot()
+	def _do_close(self):
+		self._timer.stop()
+		if self._sink is not None:
+			try:
+				self._sink.stop()
+			except Exception as e:
+				_logger.error(f"Error stopping sink: {e}")
+			self._sink = None
+
+	@QtCore.Slot()
+	def _poll(self):
+		# Merge bursts of pushes into one update
+		popped = False
+		try:
+			for _ in range(MAX_POPS_PER_UPDATE):
+				self._sink.pop(timeout=0)
+				popped = True
+		except TimeoutError:
+			pass
+		except Exception as e:
+			self._do_close()
+			self.failed.emit(f"Lost the dataset: {e}")
+			return
+		if popped:
+			self.updated.emit({key: getattr(self._sink, key) for key in self.keys if hasattr(self._sink, key)})
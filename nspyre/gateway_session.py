@@ -0,0 +1,173 @@
+"""
+One shared, reconnecting InstrumentGateway connection per process, so
+button presses and scan steps don't each pay for a new RPyC connection
+(connect + handshake):
+
+	gw = shared_session().gateway()
+	gw.horiba.get_spec_info()
+
+`gateway()` checks that the connection is still alive (at most every
+HEALTH_CHECK_S) and reconnects if it isn't. Failed connection attempts
+back off exponentially, so a dead instrument server doesn't get hammered
+(or freeze a GUI) with connection attempts.
+
+`python -m experiments.Spectra.gateway_session` compares the per-call
+time of a new connection per call with the shared session.
+
+A. Wellisz 2025-10
+"""
+
+import logging
+import threading
+import time
+
+from nspyre import InstrumentGateway
+
+_logger = logging.getLogger(__name__)
+
+# Seconds between checks that the connection is still alive
+HEALTH_CHECK_S = 5
+
+# Reconnect backoff (s): first retry delay and maximum delay
+BACKOFF_INITIAL_S = 0.5
+BACKOFF_MAX_S = 30
+
+
+class GatewaySession:
+	"""
+	A managed InstrumentGateway connection (see module docstring).
+	`gateway_kwargs` are passed on to InstrumentGateway.
+	"""
+
+	def __init__(self, health_check_s: float = HEALTH_CHECK_S, backoff_initial_s: float = BACKOFF_INITIAL_S,
+				 backoff_max_s: float = BACKOFF_MAX_S, **gateway_kwargs):
+		self.health_check_s = health_check_s
+		self.backoff_initial_s = backoff_initial_s
+		self.backoff_max_s = backoff_max_s
+		self.gateway_kwargs = gateway_kwargs
+
+		self._lock = threading.RLock()
+		self._gw = None
+		self._last_check = 0.0
+		self._backoff_s = 0.0
+		self._next_attempt = 0.0
+		self.connects = 0
+
+	def gateway(self) -> InstrumentGateway:
+		"""
+		The connected gateway, (re)connecting if needed. Raises
+		ConnectionError if the instrument server can't be reached (or we're
+		still backing off from the last failed attempt).
+		"""
+		with self._lock:
+			now = time.monotonic()
+			if self._gw is not None and now - self._last_check >= self.health_check_s:
+				if not self._healthy():
+					_logger.warning('Instrument server connection lost, reconnecting.')
+					self._drop()
+				self._last_check = now
+
+			if self._gw is None:
+				self._connect(now)
+			return self._gw
+
+	def _healthy(self) -> bool:
+		try:
+			return self._gw.is_connected()
+		except Exception:
+			return False
+
+	def _connect(self, now: float):
+		if now < self._next_attempt:
+			raise ConnectionError(
+				f'Instrument server unreachable, retrying in {self._next_attempt - now:.1f} s')
+		gw = InstrumentGateway(**self.gateway_kwargs)
+		try:
+			gw.connect()
+		except Exception as e:
+			self._backoff_s = min(self.backoff_max_s, max(self.backoff_initial_s, 2 * self._backoff_s))
+			self._next_attempt = now + self._backoff_s
+			raise ConnectionError(f'Could not connect to the instrument server: {e}') from e
+		self._gw = gw
+		self._backoff_s = 0.0
+		self._next_attempt = 0.0
+		self._last_check = now
+		self.connects += 1
+
+	def _drop(self):
+		gw, self._gw = self._gw, None
+		try:
+			gw.disconnect()
+		except Exception:
+			pass
+
+	def call(self, func, retries: int = 1):
+		"""
+		`func(gateway)`, reconnecting and retrying up to `retries` times if
+		the connection turns out to be dead. Only use retries for calls that
+		are safe to repeat (e.g. queries, not starting a capture).
+		"""
+		for attempt in range(retries + 1):
+			try:
+				return func(self.gateway())
+			except (EOFError, ConnectionError) as e:
+				if attempt == retries:
+					raise
+				_logger.warning(f'Instrument server call failed ({e}), reconnecting.')
+				self.reset()
+
+	def reset(self):
+		"""
+		Drop the connection (e.g. after a call failed with a connection
+		error); the next `gateway()` reconnects right away.
+		"""
+		with self._lock:
+			if self._gw is not None:
+				self._drop()
+			self._next_attempt = 0.0
+
+	def close(self):
+		with self._lock:
+			if self._gw is not None:
+				self._drop()
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_session() -> GatewaySession:
+	"""The session shared by everything in this process."""
+	global _shared
+	with _shared_lock:
+		if _shared is None:
+			_shared = GatewaySession()
+		return _shared
+
+
+def benchmark(call = lambda gw: gw.horiba.device_state(), n: int = 20) -> dict:
+	"""
+	Mean time (s) per `call(gw)` with a new connection per call vs. with
+	a GatewaySession.
+	"""
+	start = time.perf_counter()
+	for _ in range(n):
+		with InstrumentGateway() as gw:
+			call(gw)
+	per_call_new = (time.perf_counter() - start) / n
+
+	session = GatewaySession()
+	session.gateway()  # connect once, like a long-running GUI would have
+	start = time.perf_counter()
+	for _ in range(n):
+		call(session.gateway())
+	per_call_session = (time.perf_counter() - start) / n
+	session.close()
+
+	return {'new_connection_s': per_call_new, 'session_s': per_call_session}
+
+
+if __name__ == '__main__':
+	result = benchmark()
+	print(f"new connection per call: {1e3 * result['new_connection_s']:.1f} ms/call")
+	print(f"shared session:          {1e3 * result['session_s']:.1f} ms/call")
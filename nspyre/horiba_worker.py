@@ -0,0 +1,220 @@
+"""
+Background thread for the spectrometer GUIs' hardware calls (info
+refresh, wavelength/grating moves, live view), so that neither starting
+nspyre, a grating change nor a live view frame ever blocks the Qt thread.
+Moves are refused while a scan is running (see ACQUISITION SESSIONS in
+horiba_driver.py).
+
+Calls go through the process-wide gateway session (gateway_session.py),
+so they don't pay for a new connection each. Results come back as Qt
+signals. The last known spectrometer info is also kept in QSettings, so
+a widget can show it immediately at startup and refresh it in the
+background.
+
+A. Wellisz 2025-10
+"""
+
+import json
+import logging
+import threading
+import time
+
+from pyqtgraph.Qt import QtCore
+from rpyc.utils.classic import obtain
+
+from experiments.Spectra.gateway_session import shared_session
+from experiments.Spectra.spectra_files import unpack_array
+
+_logger = logging.getLogger(__name__)
+
+# How old (s) cached spectrometer info can be before a refresh asks the hardware
+INFO_MAX_AGE_S = 5
+
+# How often (s) a running move is polled for progress/cancellation
+MOVE_POLL_S = 0.25
+
+# How often (in polls) the live view frame rate is checked
+LIVE_STATS_EVERY = 30
+
+
+def _settings():
+	return QtCore.QSettings('nspyre', 'horiba')
+
+
+def last_known_info() -> dict:
+	"""Spectrometer info from the last successful refresh (any widget, any session), or None."""
+	try:
+		return json.loads(_settings().value('last_info', ''))
+	except (TypeError, ValueError):
+		return None
+
+
+class HoribaWorker(QtCore.QObject):
+	"""
+	Runs hardware calls on its own QThread, one at a time. Call `refresh`,
+	`move`, `cancel`, `start_live` and `stop_live` from the GUI thread;
+	connect to the signals for the results.
+	"""
+
+	info_ready = QtCore.Signal(object)  # info dict, as from Horiba.get_spec_info
+	move_progress = QtCore.Signal(str)  # status text while a move is running
+	move_finished = QtCore.Signal(str)  # status text once a move is done or cancelled
+	failed = QtCore.Signal(str)  # error message
+	live_frame = QtCore.Signal(object, object)  # wavelengths, counts of the newest live view frame
+	live_status = QtCore.Signal(str)  # frame rate text while live view is running
+	live_stopped = QtCore.Signal(str)  # status text once live view is stopped (or failed to start)
+
+	_refresh_requested = QtCore.Signal()
+	_move_requested = QtCore.Signal(object, object)
+	_live_start_requested = QtCore.Signal(int, object)
+	_live_stop_requested = QtCore.Signal()
+
+	def __init__(self):
+		super().__init__()
+		self._cancel = threading.Event()
+		self._thread = QtCore.QThread()
+		# Polls live view frames; a child, so it moves to the worker thread with us
+		self._live_timer = QtCore.QTimer(self)
+		self._live_timer.timeout.connect(self._poll_live)
+		self._live_seq = 0
+		self._live_polls = 0
+		self.moveToThread(self._thread)
+		# Queued connections, since the slots live in the worker thread
+		self._refresh_requested.connect(self._do_refresh)
+		self._move_requested.connect(self._do_move)
+		self._live_start_requested.connect(self._do_start_live)
+		self._live_stop_requested.connect(self._do_stop_live)
+		self._thread.start()
+
+	def refresh(self):
+		"""Fetch the spectrometer info (answered from the driver's cache if it's recent)."""
+		self._refresh_requested.emit()
+
+	def move(self, wavelength = None, grating = None):
+		"""Set the grating and/or center wavelength, then refresh the info."""
+		self._cancel.clear()
+		self._move_requested.emit(wavelength, grating)
+
+	def cancel(self):
+		"""
+		Cancel the current move. A move that hasn't reached the hardware yet
+		is dropped; one that's already running can't be interrupted, so we
+		just stop waiting for it.
+		"""
+		self._cancel.set()
+
+	def start_live(self, poll_ms: int, **live_kwargs):
+		"""
+		Start live view (`live_kwargs` as for Horiba.start_live) and poll for
+		new frames every `poll_ms` ms; they arrive through `live_frame`.
+		"""
+		self._live_start_requested.emit(poll_ms, live_kwargs)
+
+	def stop_live(self):
+		self._live_stop_requested.emit()
+
+	def stop(self):
+		"""Shut the worker thread down (e.g. when the application quits)."""
+		self._cancel.set()
+		self._thread.quit()
+		self._thread.wait(2000)
+
+	@QtCore.Slot()
+	def _do_refresh(self):
+		try:
+			info = shared_session().call(
+				lambda gw: obtain(gw.horiba.get_spec_info(max_age_s=INFO_MAX_AGE_S, priority="gui")))
+		except Exception as e:
+			self.failed.emit(f"Failed to get info: {e}")
+			return
+		_settings().setValue('last_info', json.dumps(info))
+		self.info_ready.emit(info)
+
+	@QtCore.Slot(object, object)
+	def _do_move(self, wavelength, grating):
+		session = shared_session()
+		try:
+			horiba = session.gateway().horiba
+			# The driver refuses GUI moves during a scan anyway; this just gives a readable message
+			scan = horiba.acquisition_session()
+			if scan is not None:
+				self.failed.emit(f"Move not done: {scan} is running. Try again once it's over.")
+				return
+			job_id = horiba.start_move(wavelength=wavelength, grating=grating, priority="gui")
+			start = time.monotonic()
+			while not horiba.wait(job_id, timeout=MOVE_POLL_S):
+				# Live view doesn't hold up moves, so keep showing its frames
+				if self._live_timer.isActive():
+					self._poll_live()
+				if self._cancel.is_set():
+					if horiba.cancel(job_id):
+						self.move_finished.emit("Move cancelled.")
+					else:
+						# Nobody will collect it, so let the driver forget it once it's done
+						horiba.abandon(job_id)
+						self.move_finished.emit("Stopped waiting for the move (it will still finish).")
+					return
+				self.move_progress.emit(f"Moving... ({time.monotonic() - start:.1f} s)")
+			horiba.result(job_id)
+		except Exception as e:
+			if isinstance(e, (EOFError, ConnectionError)):
+				session.reset()
+			self.failed.emit(f"Move failed: {e}")
+			return
+
+		if grating is not None:
+			self.move_finished.emit(f"Grating set to {grating} g/mm.")
+		else:
+			self.move_finished.emit(f"Wavelength set to {wavelength:.3f} nm.")
+		self._do_refresh()
+
+	@QtCore.Slot(int, object)
+	def _do_start_live(self, poll_ms, live_kwargs):
+		if self._live_timer.isActive():
+			return
+		try:
+			shared_session().gateway().horiba.start_live(**live_kwargs)
+		except Exception as e:
+			self.live_stopped.emit(f"Failed to start live view: {e}")
+			return
+		self._live_seq = 0
+		self._live_polls = 0
+		self._live_timer.start(poll_ms)
+
+	@QtCore.Slot()
+	def _do_stop_live(self):
+		if not self._live_timer.isActive():
+			return
+		self._live_timer.stop()
+		try:
+			# Don't wait for the CLI to exit, the driver takes care of that
+			state = shared_session().gateway().horiba.stop_live(timeout=0)
+		except Exception as e:
+			self.live_stopped.emit(f"Failed to stop live view: {e}")
+			return
+		self.live_stopped.emit(f"Live view stopped after {state['frames']} frames.")
+
+	@QtCore.Slot()
+	def _poll_live(self):
+		try:
+			horiba = shared_session().gateway().horiba
+			# Only ever fetches the newest frame, so a slow GUI just skips frames
+			frame = horiba.get_live_frame(after=self._live_seq)
+			if frame is not None:
+				self._live_seq, payload = frame
+				data = unpack_array(payload)
+				self.live_frame.emit(data[:,0], data[:,1])
+
+			self._live_polls += 1
+			if self._live_polls % LIVE_STATS_EVERY == 0:
+				state = horiba.live_state()
+				if not state['running']:
+					self._live_timer.stop()
+					error = state['error']
+					self.live_stopped.emit(f"Live view failed: {error}" if error else "Live view stopped.")
+					return
+				fps = state['fps']
+				self.live_status.emit(f"{fps:.1f} fps, {state['dropped']} skipped" if fps else "")
+		except Exception as e:
+			self._live_timer.stop()
+			self.live_stopped.emit(f"Live view error: {e}")
@@ -0,0 +1,252 @@
+"""
+Fits one emission peak (+ constant offset) to every spectrum of a
+(N_spectra x N_pixels) array at once, instead of calling
+scipy.optimize.curve_fit in a loop.
+
+	folder = load_spectra_folder(...)
+	fit = fit_peaks(folder.wavelengths, folder.counts, model='lorentzian', window=(735, 745))
+	fit.center, fit.center_err, fit.fwhm, ...  # one value per spectrum
+
+Initial guesses come from vectorized peak detection (maximum above the
+median background, FWHM from the half-maximum crossings). All spectra
+are then refined together with a batched Levenberg-Marquardt fit, with
+analytic Jacobians, solving one small (k x k) system per spectrum per
+iteration. Spectra that have converged drop out of the iterations.
+
+Models (params: amplitude, center, fwhm, offset [, eta]):
+	lorentzian: amplitude / (1 + 4 t^2) + offset,             t = (x - center) / fwhm
+	gaussian:   amplitude * exp(-4 ln2 t^2) + offset
+	voigt:      pseudo-Voigt, eta * lorentzian + (1 - eta) * gaussian (0 <= eta <= 1)
+
+A. Wellisz 2025-10
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+MODELS = ('lorentzian', 'gaussian', 'voigt')
+
+_LN2_4 = 4 * np.log(2)
+
+# Below this many spectra a process pool costs more than it saves
+_MIN_SPECTRA_FOR_POOL = 256
+
+
+class PeakFit:
+	"""
+	Result of fit_peaks. Every attribute is an array with one value per
+	spectrum; the *_err are 1 sigma uncertainties (NaN where the fit failed).
+	"""
+
+	def __init__(self, model, params, errors, chi2, converged):
+		self.model = model
+		self.amplitude, self.center, self.fwhm, self.offset = params[:, :4].T
+		self.amplitude_err, self.center_err, self.fwhm_err, self.offset_err = errors[:, :4].T
+		# Lorentzian fraction (voigt only)
+		self.eta = params[:, 4] if model == 'voigt' else None
+		self.eta_err = errors[:, 4] if model == 'voigt' else None
+		# Reduced chi^2 (assuming unit weights, i.e. the residual variance)
+		self.chi2 = chi2
+		self.converged = converged
+
+	def __len__(self):
+		return len(self.center)
+
+	def as_dict(self, i: int) -> dict:
+		"""Fit results of the i-th spectrum as plain floats."""
+		names = ['amplitude', 'center', 'fwhm', 'offset'] + (['eta'] if self.model == 'voigt' else [])
+		result = {}
+		for name in names:
+			result[name] = float(getattr(self, name)[i])
+			result[f'{name}_err'] = float(getattr(self, f'{name}_err')[i])
+		result['chi2'] = float(self.chi2[i])
+		result['converged'] = bool(self.converged[i])
+		return result
+
+
+def _shape_and_jacobian(model, x, params, jacobian=True):
+	"""
+	Model values f (N x P) and df/dparams (N x k x P) for each spectrum
+	(None if not `jacobian`). `x` is (N x P), `params` (N x k).
+	"""
+	amplitude, center, fwhm, offset = (params[:, i, None] for i in range(4))
+	t = (x - center) / fwhm
+	lor = 1 / (1 + 4 * t**2) if model in ('lorentzian', 'voigt') else None
+	gauss = np.exp(-_LN2_4 * t**2) if model in ('gaussian', 'voigt') else None
+
+	if model == 'lorentzian':
+		shape = lor
+	elif model == 'gaussian':
+		shape = gauss
+	else:
+		eta = params[:, 4, None]
+		shape = eta * lor + (1 - eta) * gauss
+	if not jacobian:
+		return amplitude * shape + offset, None
+
+	# d(shape)/dt, of the unit-height shape
+	if model == 'lorentzian':
+		shape_dt = -8 * lor**2 * t
+	elif model == 'gaussian':
+		shape_dt = -2 * _LN2_4 * gauss * t
+	else:
+		shape_dt = eta * (-8 * lor**2 * t) + (1 - eta) * (-2 * _LN2_4 * gauss * t)
+
+	# dt/dcenter = -1/fwhm, dt/dfwhm = -t/fwhm
+	columns = [shape, -amplitude * shape_dt / fwhm, -amplitude * shape_dt * t / fwhm, np.ones_like(shape)]
+	if model == 'voigt':
+		columns.append(amplitude * (lor - gauss))
+	return amplitude * shape + offset, np.stack(columns, axis=1)
+
+
+def initial_guess(x: np.ndarray, counts: np.ndarray, weights: np.ndarray = None) -> np.ndarray:
+	"""
+	Vectorized peak detection: (amplitude, center, fwhm, offset) of the
+	highest point of each spectrum, as an (N x 4) array. `x` and `counts`
+	are (N x P); pixels with weight 0 are ignored.
+	"""
+	n, p = counts.shape
+	rows = np.arange(n)
+	valid = np.isfinite(counts) if weights is None else (weights > 0) & np.isfinite(counts)
+	masked = np.where(valid, counts, np.nan)
+
+	offset = np.nanmedian(masked, axis=1)
+	peak = np.nanargmax(np.where(valid, counts, -np.inf), axis=1)
+	amplitude = counts[rows, peak] - offset
+
+	# Outermost pixels around the maximum that are still above half maximum
+	below = ~(masked - offset[:, None] >= amplitude[:, None] / 2)
+	idx = np.broadcast_to(np.arange(p), (n, p))
+	left = np.maximum.accumulate(np.where(below, idx, -1), axis=1)[rows, peak] + 1
+	right = np.minimum.accumulate(np.where(below, idx, p)[:, ::-1], axis=1)[:, ::-1][rows, peak] - 1
+	# (+ one pixel, since the crossings are somewhere between those and their neighbours)
+	spacing = np.abs(x[rows, np.minimum(peak + 1, p - 1)] - x[rows, np.maximum(peak - 1, 0)]) / 2
+	fwhm = np.abs(x[rows, right] - x[rows, left]) + spacing
+
+	return np.column_stack([amplitude, x[rows, peak], fwhm, offset])
+
+
+def _levenberg_marquardt(model, x, counts, weights, params, max_iter, tol):
+	"""Batched LM on (N x P) arrays. Returns (params, errors, chi2, converged)."""
+	n, k = params.shape
+	damping = np.full(n, 1e-3)
+	converged = np.zeros(n, dtype=bool)
+	eye = np.eye(k)
+
+	def cost_of(x, counts, weights, params):
+		f, _ = _shape_and_jacobian(model, x, params, jacobian=False)
+		return np.sum(weights * (counts - f)**2, axis=1)
+
+	cost = cost_of(x, counts, weights, params)
+	active = np.flatnonzero(np.isfinite(cost))
+
+	for _ in range(max_iter):
+		if active.size == 0:
+			break
+		xa, ya, wa, pa = x[active], counts[active], weights[active], params[active]
+
+		f, jac = _shape_and_jacobian(model, xa, pa)
+		residual = wa * (ya - f)
+		jtj = np.matmul(jac * wa[:, None, :], jac.transpose(0, 2, 1))
+		gradient = np.matmul(jac, residual[..., None])[..., 0]
+
+		# Marquardt scaling of the damping by the diagonal of J^T J
+		diag = np.einsum('nkk->nk', jtj)
+		system = jtj + damping[active, None, None] * diag[:, :, None] * eye + 1e-12 * eye
+		try:
+			step = np.linalg.solve(system, gradient[..., None])[..., 0]
+		except np.linalg.LinAlgError:
+			step = np.stack([np.linalg.lstsq(s, g, rcond=None)[0] for s, g in zip(system, gradient)])
+
+		trial = pa + step
+		trial[:, 2] = np.abs(trial[:, 2])
+		if model == 'voigt':
+			trial[:, 4] = np.clip(trial[:, 4], 0, 1)
+		trial_cost = cost_of(xa, ya, wa, trial)
+
+		better = np.isfinite(trial_cost) & (trial_cost <= cost[active])
+		improvement = cost[active] - trial_cost
+		params[active[better]] = trial[better]
+		damping[active] = np.where(better, damping[active] / 10, np.minimum(damping[active] * 10, 1e10))
+
+		# Converged once a step (accepted or not) barely changes the cost
+		small = np.abs(improvement) <= tol * np.maximum(cost[active], 1e-300)
+		converged[active[small]] = True
+		# Damping maxed out means no step helps anymore
+		done = small | (damping[active] >= 1e10)
+		cost[active] = np.where(better, trial_cost, cost[active])
+		active = active[~done]
+
+	# Uncertainties from the covariance at the solution, scaled by the residual variance
+	dof = np.maximum(np.sum(weights > 0, axis=1) - k, 1)
+	chi2 = cost / dof
+	_, jac = _shape_and_jacobian(model, x, params)
+	jtj = np.matmul(jac * weights[:, None, :], jac.transpose(0, 2, 1))
+	errors = np.full_like(params, np.nan)
+	invertible = np.isfinite(jtj).all(axis=(1, 2)) & (np.linalg.matrix_rank(jtj) == k)
+	if invertible.any():
+		cov = np.linalg.inv(jtj[invertible]) * chi2[invertible, None, None]
+		errors[invertible] = np.sqrt(np.abs(np.einsum('nkk->nk', cov)))
+	return params, errors, chi2, converged
+
+
+def _fit_chunk(args):
+	# Runs in the worker processes
+	return _levenberg_marquardt(*args)
+
+
+def fit_peaks(x, counts, model: str = 'lorentzian', window = None, guess = None,
+			  max_iter: int = 100, tol: float = 1e-10, workers: int = 1) -> PeakFit:
+	"""
+	Fit one peak of `model` (see MODELS) to every row of `counts`.
+
+	`x` is either one wavelength axis (P,) shared by all spectra or one
+	per spectrum (N x P); `counts` is (N x P) (a single spectrum (P,) is
+	fine too). NaNs (e.g. padding from load_spectra_folder) are ignored.
+
+	`window` = (min, max) restricts the fit (and the peak search) to that
+	range of `x`. `guess` is an optional (N x k) array of starting params
+	(amplitude, center, fwhm, offset [, eta]), otherwise they're detected.
+
+	`workers` > 1 splits the spectra across that many processes (0/None =
+	number of cores), which only pays off for large batches.
+	"""
+	if model not in MODELS:
+		raise ValueError(f'Unknown peak model {model!r}, must be one of {MODELS}')
+
+	counts = np.atleast_2d(np.asarray(counts, dtype=float))
+	x = np.broadcast_to(np.asarray(x, dtype=float), counts.shape)
+	weights = np.isfinite(counts) & np.isfinite(x)
+	if window is not None:
+		weights &= (x >= min(window)) & (x <= max(window))
+	# Pixels outside the window (or NaN in every spectrum) don't need to be computed at all
+	keep = weights.any(axis=0)
+	if not keep.all():
+		x, counts, weights = x[:, keep], counts[:, keep], weights[:, keep]
+	weights = weights.astype(float)
+	# Keep NaNs out of the arithmetic (their weight is 0 anyway)
+	counts = np.where(weights > 0, counts, 0.0)
+	x = np.where(weights > 0, x, 0.0)
+
+	if guess is None:
+		params = initial_guess(x, counts, weights)
+		if model == 'voigt':
+			params = np.column_stack([params, np.full(len(params), 0.5)])
+	else:
+		params = np.array(guess, dtype=float, ndmin=2)
+
+	workers = workers or os.cpu_count() or 1
+	if workers > 1 and len(counts) >= _MIN_SPECTRA_FOR_POOL:
+		bounds = np.linspace(0, len(counts), workers + 1).astype(int)
+		chunks = [(model, x[a:b], counts[a:b], weights[a:b], params[a:b], max_iter, tol)
+				  for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+		with ProcessPoolExecutor(max_workers=workers) as pool:
+			results = list(pool.map(_fit_chunk, chunks))
+		params, errors, chi2, converged = (np.concatenate(r) for r in zip(*results))
+	else:
+		params, errors, chi2, converged = _levenberg_marquardt(
+			model, x, counts, weights, params, max_iter, tol)
+
+	return PeakFit(model, params, errors, chi2, converged)
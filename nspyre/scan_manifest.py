@@ -0,0 +1,126 @@
+"""
+Checkpoint file for scans that take one spectrum per point, so a scan
+that was stopped or died halfway can be resumed instead of restarted.
+
+The manifest is a small JSON file next to the data that records the
+scan settings, the points (e.g. crosshair coordinates) as they were at
+the start, the spectrometer state and every completed point with its
+file. It's rewritten atomically after every point, so it's never more
+than one point behind.
+
+	manifest = ScanManifest.create(path, settings, points, hardware)
+	# or, to resume:
+	manifest = ScanManifest.load(path)
+	manifest.validate(settings, hardware)
+	...
+	if not manifest.is_done(label):
+		...
+		manifest.mark_done(label, path=full_path)
+
+A. Wellisz 2025-10
+"""
+
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+_logger = logging.getLogger(__name__)
+
+VERSION = 1
+
+# Hardware state that has to match for a scan to be resumed
+HARDWARE_KEYS = ('current_grating',)
+
+
+class ScanManifest:
+	"""See module docstring."""
+
+	def __init__(self, path, data: dict):
+		self.path = Path(path)
+		self.data = data
+
+	@classmethod
+	def create(cls, path, settings: dict, points: dict, hardware: dict = None) -> 'ScanManifest':
+		"""Start a new manifest (overwriting any old one at `path`)."""
+		manifest = cls(path, {
+			'version': VERSION,
+			'created': time.time(),
+			'updated': time.time(),
+			'finished': False,
+			'settings': settings,
+			'points': points,
+			'hardware': hardware or {},
+			'completed': {},
+			'failures': [],
+		})
+		manifest.save()
+		return manifest
+
+	@classmethod
+	def load(cls, path) -> 'ScanManifest':
+		with open(path, 'r') as f:
+			data = json.load(f)
+		if data.get('version') != VERSION:
+			raise ValueError(f'Unsupported scan manifest version {data.get("version")} in {path}')
+		return cls(path, data)
+
+	def save(self):
+		"""Write the manifest atomically (a crash mid-write leaves the previous version)."""
+		self.data['updated'] = time.time()
+		tmp_path = self.path.with_name(self.path.name + '.tmp')
+		with open(tmp_path, 'w') as f:
+			json.dump(self.data, f, indent=1)
+		os.replace(tmp_path, self.path)
+
+	@property
+	def settings(self) -> dict:
+		return self.data['settings']
+
+	@property
+	def points(self) -> dict:
+		return self.data['points']
+
+	@property
+	def completed(self) -> dict:
+		return self.data['completed']
+
+	def validate(self, settings: dict, hardware: dict = None):
+		"""
+		Raise ValueError if `settings` (or the spectrometer state) differ
+		from the ones the scan was started with. Parts of the spectrometer
+		state that aren't known (e.g. the instrument server didn't answer)
+		aren't checked, so a scan can still be resumed after a fault.
+		"""
+		problems = []
+		for key in sorted(set(settings) | set(self.settings)):
+			if settings.get(key) != self.settings.get(key):
+				problems.append(f'{key}: {self.settings.get(key)!r} -> {settings.get(key)!r}')
+		for key in HARDWARE_KEYS:
+			if key not in self.data['hardware']:
+				continue
+			if hardware is None or hardware.get(key) is None:
+				_logger.warning(f'Spectrometer {key} unknown, resuming without checking it '
+								f'(the scan was started with {self.data["hardware"][key]!r})')
+			elif hardware[key] != self.data['hardware'][key]:
+				problems.append(f'{key} (hardware): {self.data["hardware"][key]!r} -> {hardware[key]!r}')
+		if problems:
+			raise ValueError('Scan settings changed since the scan was started: ' + '; '.join(problems))
+
+	def is_done(self, label: str) -> bool:
+		return label in self.completed
+
+	def mark_done(self, label: str, **info):
+		"""Record a completed point (e.g. path=..., fsm=...) and save."""
+		self.completed[label] = dict(info, timestamp=time.time())
+		self.save()
+
+	def record_failure(self, label: str, error: str):
+		"""Record a failed attempt at a point (kept for the record, doesn't affect resuming)."""
+		self.data['failures'].append({'label': label, 'error': error, 'timestamp': time.time()})
+		self.save()
+
+	def finish(self):
+		self.data['finished'] = True
+		self.save()
@@ -0,0 +1,157 @@
+"""
+Throughput/ETA bookkeeping for scans that take one spectrum per point
+(e.g. SpectraPerXhairMeasurement).
+
+Each point's time is split into
+	move:     moving the FSM
+	exposure: the nominal integration time
+	overhead: everything else in the acquisition (CLI startup, device
+	          init, readout, saving/reading the file, ...)
+	push:     pushing the data to dataserv
+
+A. Wellisz 2025-10
+"""
+
+import time
+
+# Number of most recent points the ETA model is fitted to
+ETA_WINDOW = 20
+
+
+class PointTiming:
+	"""Time (s) spent on each part of one scan point."""
+
+	def __init__(self, move_s, exposure_s, overhead_s, push_s):
+		self.move_s = move_s
+		self.exposure_s = exposure_s
+		self.overhead_s = overhead_s
+		self.push_s = push_s
+
+	@property
+	def total_s(self):
+		return self.move_s + self.exposure_s + self.overhead_s + self.push_s
+
+	def as_list(self):
+		return [self.move_s, self.exposure_s, self.overhead_s, self.push_s]
+
+
+class ScanMonitor:
+	"""
+	Keeps track of per-point timings during a scan and predicts how long
+	the rest of it will take.
+
+	Usage:
+		monitor = ScanMonitor(num_points, exposure_s)
+		for ...:
+			monitor.start_point()
+			...move...
+			monitor.moved()
+			...acquire + read...
+			monitor.acquired()
+			...push...
+			timing = monitor.pushed()
+	"""
+
+	def __init__(self, num_points: int, exposure_s: float, per_point_estimate_s: float = None):
+		self.num_points = num_points
+		self.exposure_s = exposure_s
+		# Prior guess for the time per point (e.g. from past scans), used until we have data
+		self.per_point_estimate_s = per_point_estimate_s
+		self.points = []
+		# (points done, elapsed s) after each point, for the ETA fit
+		self.history = []
+		self.start_time = None
+		self._t = {}
+
+	def start_point(self):
+		now = time.perf_counter()
+		if self.start_time is None:
+			self.start_time = now
+		self._t = {'start': now}
+
+	def moved(self):
+		self._t['moved'] = time.perf_counter()
+
+	def acquired(self):
+		self._t['acquired'] = time.perf_counter()
+
+	def pushed(self) -> PointTiming:
+		"""Finish the current point and return its timing."""
+		now = time.perf_counter()
+		t = self._t
+		move_s = t['moved'] - t['start']
+		acquire_s = t['acquired'] - t['moved']
+		push_s = now - t['acquired']
+		# Exposure can't take longer than the acquisition itself
+		exposure_s = min(self.exposure_s, acquire_s)
+		timing = PointTiming(move_s, exposure_s, acquire_s - exposure_s, push_s)
+		self.points.append(timing)
+		self.history.append((len(self.points), now - self.start_time))
+		return timing
+
+	@property
+	def num_done(self) -> int:
+		return len(self.points)
+
+	def throughput_per_min(self) -> float:
+		"""Spectra per minute over the recent points (None if unknown)."""
+		seconds_per_point = self.seconds_per_point()
+		if not seconds_per_point:
+			return None
+		return 60 / seconds_per_point
+
+	def overhead_ratio(self) -> float:
+		"""(time not spent exposing) / (time spent exposing), over all points so far."""
+		exposure = sum(p.exposure_s for p in self.points)
+		if exposure <= 0:
+			return None
+		total = sum(p.total_s for p in self.points)
+		return (total - exposure) / exposure
+
+	def seconds_per_point(self) -> float:
+		"""
+		Time per point from a least-squares line through (points done,
+		elapsed time) over the last ETA_WINDOW points. Falls back to the
+		prior estimate if there isn't enough data yet.
+		"""
+		recent = self.history[-ETA_WINDOW:]
+		if len(recent) < 2:
+			if recent:
+				return recent[0][1] / recent[0][0]
+			return self.per_point_estimate_s
+
+		n = len(recent)
+		mean_x = sum(x for x, _ in recent) / n
+		mean_y = sum(y for _, y in recent) / n
+		sxx = sum((x - mean_x) ** 2 for x, _ in recent)
+		sxy = sum((x - mean_x) * (y - mean_y) for x, y in recent)
+		return sxy / sxx
+
+	def eta_s(self) -> float:
+		"""Predicted time (s) until the scan is finished (None if unknown)."""
+		seconds_per_point = self.seconds_per_point()
+		if seconds_per_point is None:
+			return None
+		return max(0.0, seconds_per_point * (self.num_points - self.num_done))
+
+	def status(self) -> str:
+		"""One-line summary for the experiment widget's status label."""
+		parts = [f"{self.num_done}/{self.num_points}"]
+		throughput = self.throughput_per_min()
+		if throughput is not None:
+			parts.append(f"{throughput:.2f} spectra/min")
+		overhead = self.overhead_ratio()
+		if overhead is not None:
+			parts.append(f"overhead {100 * overhead:.0f}% of exposure")
+		eta = self.eta_s()
+		if eta is not None:
+			parts.append(f"ETA {format_duration(eta)}")
+		return " | ".join(parts)
+
+
+def format_duration(seconds: float) -> str:
+	"""e.g. 5025 -> '1:23:45'"""
+	seconds = int(round(seconds))
+	hours, rest = divmod(seconds, 3600)
+	minutes, seconds = divmod(rest, 60)
+	return f"{hours}:{minutes:02d}:{seconds:02d}"
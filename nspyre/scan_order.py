@@ -0,0 +1,203 @@
+"""
+Visiting order for scan points (e.g. crosshairs), so the FSM doesn't
+zig-zag across the field between points. Label order is whatever order
+the crosshairs were placed in; this finds a short path through them
+instead:
+
+	order = travel_order(coords)  # coords is (N x 2); order is a permutation of range(N)
+	for i in order:
+		...
+
+Nearest-neighbour tour, then improved with 2-opt (only trying to connect
+each point to its K nearest neighbours, which is what keeps it fast for
+thousands of points). The path is open (no return to the start) and
+starts at the point closest to `start` (e.g. where the FSM is now), or
+the first point.
+
+By default a move costs its distance. If the time per move isn't
+proportional to the distance (e.g. a settle time that grows with the
+step size), pass a MoveCost fitted to measured move times, so the tour
+minimizes the time instead:
+
+	cost = MoveCost.from_measurements(catalog.move_times())
+	order = travel_order(coords, cost=cost)
+
+A. Wellisz 2025-10
+"""
+
+import time
+
+import numpy as np
+
+# Number of nearest neighbours 2-opt tries to connect each point to
+NEIGHBOURS = 10
+
+# Rows of the distance matrix computed at once when finding neighbours
+_CHUNK = 1024
+
+
+class MoveCost:
+	"""
+	Cost (s) of a move as a function of its distance: interpolated from
+	(distance, time) points, linearly extrapolated past the last one.
+	"""
+
+	def __init__(self, distances, times):
+		self.distances = np.asarray(distances, dtype=float)
+		self.times = np.asarray(times, dtype=float)
+		if len(self.distances) < 2:
+			raise ValueError('MoveCost needs at least 2 (distance, time) points')
+		self.slope = (self.times[-1] - self.times[-2]) / max(self.distances[-1] - self.distances[-2], 1e-12)
+
+	@classmethod
+	def from_measurements(cls, measurements, bins: int = 10) -> 'MoveCost':
+		"""
+		Fit to measured (distance, move_s) pairs (e.g. from
+		SpectraCatalog.move_times): median time per distance bin (equal
+		counts per bin), made non-decreasing. Returns None if there are too
+		few measurements to go on.
+		"""
+		measurements = np.asarray(measurements, dtype=float).reshape(-1, 2)
+		measurements = measurements[np.all(np.isfinite(measurements), axis=1)]
+		if len(measurements) < 2 * bins:
+			return None
+		measurements = measurements[np.argsort(measurements[:, 0])]
+		groups = np.array_split(measurements, bins)
+		distances = np.array([np.median(g[:, 0]) for g in groups])
+		times = np.maximum.accumulate([np.median(g[:, 1]) for g in groups])
+		distances, keep = np.unique(distances, return_index=True)
+		if len(distances) < 2:
+			return None
+		# A move of 0 costs nothing (no move at all)
+		return cls(np.concatenate([[0], distances]), np.concatenate([[0], times[keep]]))
+
+	def __call__(self, distance) -> np.ndarray:
+		distance = np.asarray(distance, dtype=float)
+		cost = np.interp(distance, self.distances, self.times)
+		beyond = distance > self.distances[-1]
+		return np.where(beyond, self.times[-1] + self.slope * (distance - self.distances[-1]), cost)
+
+
+def _pair_cost(coords, cost, i, j):
+	d = np.hypot(*(coords[i] - coords[j]).T)
+	return d if cost is None else cost(d)
+
+
+def nearest_neighbours(coords, k: int = NEIGHBOURS) -> np.ndarray:
+	"""(N x k) indices of each point's k nearest other points, closest first."""
+	n = len(coords)
+	k = min(k, n - 1)
+	neighbours = np.empty((n, k), dtype=int)
+	sq = np.sum(coords ** 2, axis=1)
+	for start in range(0, n, _CHUNK):
+		rows = slice(start, min(start + _CHUNK, n))
+		d2 = sq[rows, None] + sq[None, :] - 2 * coords[rows] @ coords.T
+		d2[np.arange(d2.shape[0]), np.arange(rows.start, rows.stop)] = np.inf
+		nearest = np.argpartition(d2, k - 1, axis=1)[:, :k]
+		order = np.argsort(np.take_along_axis(d2, nearest, axis=1), axis=1)
+		neighbours[rows] = np.take_along_axis(nearest, order, axis=1)
+	return neighbours
+
+
+def nearest_neighbour_tour(coords, first: int = 0) -> np.ndarray:
+	"""Greedy path: always move to the closest point not visited yet."""
+	n = len(coords)
+	order = np.empty(n, dtype=int)
+	visited = np.zeros(n, dtype=bool)
+	current = first
+	for step in range(n):
+		order[step] = current
+		visited[current] = True
+		if step == n - 1:
+			break
+		d2 = np.sum((coords - coords[current]) ** 2, axis=1)
+		d2[visited] = np.inf
+		current = int(np.argmin(d2))
+	return order
+
+
+def two_opt(coords, order, cost: MoveCost = None, neighbours = None, time_limit_s: float = None) -> np.ndarray:
+	"""
+	Improve an open path by reversing segments of it while that makes it
+	cheaper. The first point stays first. Only moves that connect a point
+	to one of its `neighbours` are tried.
+	"""
+	order = np.array(order, dtype=int)
+	n = len(order)
+	if n < 4:
+		return order
+	if neighbours is None:
+		neighbours = nearest_neighbours(coords)
+	pos = np.empty(n, dtype=int)
+	pos[order] = np.arange(n)
+
+	def c(a, b):
+		return float(_pair_cost(coords, cost, a, b))
+
+	deadline = None if time_limit_s is None else time.monotonic() + time_limit_s
+	improved = True
+	while improved:
+		improved = False
+		for i in range(n - 1):
+			a, b = order[i], order[i + 1]
+			ab = c(a, b)
+			for x in neighbours[a]:
+				j = pos[x]
+				if j <= i + 1:
+					continue
+				# Reverse order[i+1..j]: edges (a, b), (x, y) -> (a, x), (b, y)
+				old, new = ab, c(a, x)
+				if new >= old:
+					break  # neighbours are sorted, so no closer x left
+				if j + 1 < n:
+					y = order[j + 1]
+					old += c(x, y)
+					new += c(b, y)
+				if new < old - 1e-12:
+					order[i + 1:j + 1] = order[i + 1:j + 1][::-1].copy()
+					pos[order[i + 1:j + 1]] = np.arange(i + 1, j + 1)
+					improved = True
+					a, b = order[i], order[i + 1]
+					ab = c(a, b)
+			for x in neighbours[b]:
+				j = pos[x]
+				if j < 2 or j > i:
+					continue
+				# Reverse order[j..i]: edges (w, x), (a, b) -> (w, a), (x, b)
+				w = order[j - 1]
+				old, new = ab, c(x, b)
+				if new >= old:
+					break
+				old += c(w, x)
+				new += c(w, a)
+				if new < old - 1e-12:
+					order[j:i + 1] = order[j:i + 1][::-1].copy()
+					pos[order[j:i + 1]] = np.arange(j, i + 1)
+					improved = True
+					a, b = order[i], order[i + 1]
+					ab = c(a, b)
+			if deadline is not None and time.monotonic() > deadline:
+				return order
+	return order
+
+
+def path_cost(coords, order, cost: MoveCost = None) -> float:
+	"""Total cost of visiting `coords` in `order` (distance, or time with a MoveCost)."""
+	coords = np.asarray(coords, dtype=float)
+	order = np.asarray(order, dtype=int)
+	return float(np.sum(_pair_cost(coords, cost, order[:-1], order[1:])))
+
+
+def travel_order(coords, start = None, cost: MoveCost = None, time_limit_s: float = 10) -> np.ndarray:
+	"""
+	Short visiting order for the points `coords` (N x 2), as a permutation
+	of range(N) (see module docstring). 2-opt stops improving after
+	`time_limit_s`.
+	"""
+	coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+	n = len(coords)
+	if n < 3:
+		return np.arange(n)
+	first = 0 if start is None else int(np.argmin(np.sum((coords - np.asarray(start, dtype=float)) ** 2, axis=1)))
+	order = nearest_neighbour_tour(coords, first)
+	return two_opt(coords, order, cost, time_limit_s=time_limit_s)
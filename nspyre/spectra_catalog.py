@@ -0,0 +1,296 @@
+"""
+SQLite catalog of acquired spectra.
+
+Every spectrum taken by SingleSpectraMeasurement or
+SpectraPerXhairMeasurement gets one row here (file location, time,
+spectrometer/CCD settings, crosshair + FSM position, and some summary
+stats), so finding e.g. "all 1200 g/mm spectra around 700 nm at
+crosshair 12 from last week" is an indexed query instead of a
+directory walk:
+
+	catalog = SpectraCatalog()
+	spectra = catalog.query(grating=1200, wavelength=(690, 710), xhair='cross012',
+							since=datetime.now() - timedelta(days=7))
+	for row, data in spectra:
+		...  # data is the 2xN (wavelengths, counts) array, loaded on demand
+
+Scans also log how long each point took (table scan_points), which is
+used to estimate how long a scan with given settings will take before
+starting it (SpectraCatalog.estimate_point_time), and how far the FSM
+moved, which gives the move time vs. distance for ordering scan points
+(SpectraCatalog.move_times, see scan_order.py).
+
+A. Wellisz 2025-10
+"""
+
+import logging
+import sqlite3
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+from experiments.Spectra.spectra_files import read_spectrum_file
+
+_HERE = Path(__file__).parent
+_logger = logging.getLogger(__name__)
+
+DEFAULT_CATALOG_PATH = _HERE / '../../Data/spectra_catalog.sqlite'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS spectra (
+	id INTEGER PRIMARY KEY,
+	path TEXT NOT NULL,
+	timestamp REAL NOT NULL,
+	experiment TEXT,
+	dataset TEXT,
+	grating INTEGER,
+	wavelength REAL,
+	exposure_s REAL,
+	gain TEXT,
+	adc TEXT,
+	xstart INTEGER, xend INTEGER, ystart INTEGER, yend INTEGER,
+	xbin INTEGER, ybin INTEGER,
+	xhair TEXT,
+	fsm_x REAL, fsm_y REAL,
+	max_counts REAL,
+	integrated_counts REAL
+);
+CREATE INDEX IF NOT EXISTS idx_spectra_grating_wavelength ON spectra (grating, wavelength);
+CREATE INDEX IF NOT EXISTS idx_spectra_xhair ON spectra (xhair, timestamp);
+CREATE INDEX IF NOT EXISTS idx_spectra_timestamp ON spectra (timestamp);
+CREATE INDEX IF NOT EXISTS idx_spectra_dataset ON spectra (dataset);
+
+CREATE TABLE IF NOT EXISTS scan_points (
+	id INTEGER PRIMARY KEY,
+	timestamp REAL NOT NULL,
+	experiment TEXT,
+	exposure_s REAL,
+	gain TEXT,
+	adc TEXT,
+	xstart INTEGER, xend INTEGER, ystart INTEGER, yend INTEGER,
+	xbin INTEGER, ybin INTEGER,
+	move_s REAL,
+	overhead_s REAL,
+	push_s REAL,
+	total_s REAL,
+	move_distance REAL
+);
+CREATE INDEX IF NOT EXISTS idx_scan_points_settings ON scan_points (experiment, exposure_s, adc, timestamp);
+"""
+
+# Acquisition settings that determine how long a scan point takes
+TIMING_SETTINGS = ('experiment', 'exposure_s', 'gain', 'adc', 'xstart', 'xend', 'ystart', 'yend', 'xbin', 'ybin')
+
+# Columns set by SpectraCatalog.add (everything but id)
+COLUMNS = (
+	'path', 'timestamp', 'experiment', 'dataset', 'grating', 'wavelength', 'exposure_s',
+	'gain', 'adc', 'xstart', 'xend', 'ystart', 'yend', 'xbin', 'ybin',
+	'xhair', 'fsm_x', 'fsm_y', 'max_counts', 'integrated_counts',
+)
+
+
+def _to_timestamp(t) -> float:
+	"""Accept either a unix timestamp or a datetime."""
+	if isinstance(t, datetime):
+		return t.timestamp()
+	return float(t)
+
+
+class CatalogSpectra:
+	"""
+	Result of SpectraCatalog.query. The matching rows are available
+	immediately (`rows`, a list of dicts); the spectra themselves are only
+	read from disk when indexed/iterated.
+	"""
+
+	def __init__(self, rows: list):
+		self.rows = rows
+		self._load = lru_cache(maxsize=256)(read_spectrum_file)
+
+	def __len__(self):
+		return len(self.rows)
+
+	def __getitem__(self, i: int) -> np.ndarray:
+		"""2xN (wavelengths, counts) array of the i-th matching spectrum."""
+		return self._load(self.rows[i]['path'])
+
+	def __iter__(self):
+		"""Yields (row, data) pairs, reading one file at a time."""
+		for i, row in enumerate(self.rows):
+			yield row, self[i]
+
+	def stack(self) -> np.ndarray:
+		"""All counts as an (N x N_pixels) array (reads every file)."""
+		return np.vstack([self[i][1] for i in range(len(self))])
+
+
+class SpectraCatalog:
+	"""Index of acquired spectra stored in a local SQLite database."""
+
+	def __init__(self, path = DEFAULT_CATALOG_PATH):
+		self.path = Path(path)
+		self.path.parent.mkdir(parents=True, exist_ok=True)
+		with self._connect() as con:
+			con.executescript(_SCHEMA)
+			# Catalogs created before move_distance was logged
+			if 'move_distance' not in [r['name'] for r in con.execute('PRAGMA table_info(scan_points)')]:
+				con.execute('ALTER TABLE scan_points ADD COLUMN move_distance REAL')
+
+	@contextmanager
+	def _connect(self):
+		# One short-lived connection per call, so it's safe to use from any thread/process
+		con = sqlite3.connect(self.path, timeout=10)
+		con.row_factory = sqlite3.Row
+		try:
+			# WAL lets the viewer query while an experiment is writing
+			con.execute('PRAGMA journal_mode=WAL')
+			with con:
+				yield con
+		finally:
+			con.close()
+
+	def add(self, path: str, counts = None, timestamp = None, **fields) -> int:
+		"""
+		Record one acquired spectrum. `fields` are any of the columns in
+		COLUMNS (grating, wavelength, exposure_s, gain, adc, xstart, ...,
+		xhair, fsm_x, fsm_y, experiment, dataset).
+		If `counts` is given, max_counts/integrated_counts are computed from it.
+		Returns the row id.
+		"""
+		unknown = set(fields).difference(COLUMNS)
+		if unknown:
+			raise ValueError(f'Unknown catalog columns: {sorted(unknown)}')
+
+		row = dict.fromkeys(COLUMNS)
+		row.update(fields)
+		row['path'] = str(path)
+		row['timestamp'] = time.time() if timestamp is None else _to_timestamp(timestamp)
+		if counts is not None:
+			counts = np.asarray(counts)
+			row['max_counts'] = float(np.max(counts))
+			row['integrated_counts'] = float(np.sum(counts))
+
+		placeholders = ', '.join('?' for _ in COLUMNS)
+		with self._connect() as con:
+			cur = con.execute(
+				f'INSERT INTO spectra ({", ".join(COLUMNS)}) VALUES ({placeholders})',
+				[row[c] for c in COLUMNS],
+			)
+			return cur.lastrowid
+
+	def query(self, grating = None, wavelength = None, exposure_s = None, xhair = None,
+			  dataset = None, experiment = None, since = None, until = None,
+			  limit: int = None) -> CatalogSpectra:
+		"""
+		Find spectra matching all of the given conditions.
+
+		`grating`, `exposure_s`, `xhair`, `dataset`, `experiment` must match exactly.
+		`wavelength` is either a value (exact match) or a (min, max) range in nm.
+		`since`/`until` are datetimes or unix timestamps.
+
+		Results are ordered by time of acquisition.
+		"""
+		conditions = []
+		values = []
+		for column, value in (('grating', grating), ('exposure_s', exposure_s), ('xhair', xhair),
+							  ('dataset', dataset), ('experiment', experiment)):
+			if value is not None:
+				conditions.append(f'{column} = ?')
+				values.append(value)
+		if wavelength is not None:
+			if isinstance(wavelength, (tuple, list)):
+				conditions.append('wavelength BETWEEN ? AND ?')
+				values += [float(wavelength[0]), float(wavelength[1])]
+			else:
+				conditions.append('wavelength = ?')
+				values.append(float(wavelength))
+		if since is not None:
+			conditions.append('timestamp >= ?')
+			values.append(_to_timestamp(since))
+		if until is not None:
+			conditions.append('timestamp <= ?')
+			values.append(_to_timestamp(until))
+
+		sql = 'SELECT * FROM spectra'
+		if conditions:
+			sql += ' WHERE ' + ' AND '.join(conditions)
+		sql += ' ORDER BY timestamp'
+		if limit is not None:
+			sql += ' LIMIT ?'
+			values.append(int(limit))
+
+		with self._connect() as con:
+			rows = [dict(r) for r in con.execute(sql, values)]
+		return CatalogSpectra(rows)
+
+	def add_point_timing(self, move_s, overhead_s, push_s, total_s, move_distance = None, **settings) -> int:
+		"""
+		Record how long one scan point took. `move_distance` is how far the
+		FSM moved to get there (if known). `settings` are any of
+		TIMING_SETTINGS (experiment, exposure_s, gain, adc, roi, binning).
+		"""
+		unknown = set(settings).difference(TIMING_SETTINGS)
+		if unknown:
+			raise ValueError(f'Unknown timing settings: {sorted(unknown)}')
+
+		row = dict.fromkeys(TIMING_SETTINGS)
+		row.update(settings)
+		row.update(timestamp=time.time(), move_s=move_s, overhead_s=overhead_s, push_s=push_s, total_s=total_s,
+				   move_distance=move_distance)
+
+		columns = list(row)
+		with self._connect() as con:
+			cur = con.execute(
+				f'INSERT INTO scan_points ({", ".join(columns)}) VALUES ({", ".join("?" for _ in columns)})',
+				[row[c] for c in columns],
+			)
+			return cur.lastrowid
+
+	def estimate_point_time(self, recent: int = 200, **settings) -> float:
+		"""
+		Median time (s) per scan point over the last `recent` points taken
+		with exactly these settings (see TIMING_SETTINGS). If there are
+		none, falls back to the exposure time plus the median overhead of
+		any past point with the same ADC (readout speed dominates the
+		overhead). Returns None if there's nothing to go on.
+		"""
+		unknown = set(settings).difference(TIMING_SETTINGS)
+		if unknown:
+			raise ValueError(f'Unknown timing settings: {sorted(unknown)}')
+
+		columns = [c for c in TIMING_SETTINGS if settings.get(c) is not None]
+		where = ' AND '.join(f'{c} = ?' for c in columns) or '1'
+		with self._connect() as con:
+			totals = [r[0] for r in con.execute(
+				f'SELECT total_s FROM scan_points WHERE {where} ORDER BY timestamp DESC LIMIT ?',
+				[settings[c] for c in columns] + [int(recent)],
+			)]
+			if totals:
+				return statistics.median(totals)
+
+			exposure_s = settings.get('exposure_s')
+			if exposure_s is None:
+				return None
+			where, values = ('adc = ?', [settings['adc']]) if settings.get('adc') is not None else ('1', [])
+			rows = con.execute(
+				f'SELECT move_s + overhead_s + push_s FROM scan_points WHERE {where} ORDER BY timestamp DESC LIMIT ?',
+				values + [int(recent)],
+			).fetchall()
+			if not rows:
+				return None
+			return exposure_s + statistics.median(r[0] for r in rows)
+
+	def move_times(self, recent: int = 1000) -> list:
+		"""
+		(move_distance, move_s) of the last `recent` scan points that logged
+		their move distance, e.g. for scan_order.MoveCost.from_measurements.
+		"""
+		with self._connect() as con:
+			return [tuple(r) for r in con.execute(
+				'SELECT move_distance, move_s FROM scan_points WHERE move_distance IS NOT NULL '
+				'ORDER BY timestamp DESC LIMIT ?', [int(recent)])]
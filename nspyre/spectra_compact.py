@@ -0,0 +1,281 @@
+"""
+Compact binary spectrum format (.spz), as an alternative to the JY
+tab-delimited text files (~20-30 bytes per pixel, wavelengths repeated
+in every file).
+
+Layout:
+	b'SPZ1'
+	uint32 (little-endian) length of the header
+	header (UTF-8 JSON): params, number of pixels, how the counts are
+	    stored (dtype, delta, compression) and the wavelength axis
+	wavelength block (only if the axis isn't stored as a polynomial)
+	counts block
+
+Counts are stored as the smallest integer type that holds them exactly
+(uint16, uint32, int32; float64 if they aren't integers), optionally
+delta-encoded (neighbouring pixels are similar, so the differences
+compress much better) and compressed with zlib or zstd (zstd needs the
+`zstandard` package). The wavelength axis is stored as polynomial
+coefficients (in pixel index) if that reproduces it to within
+`wavelength_tol`, otherwise as a float64 array.
+
+	write_compact('spec.spz', wavelengths, counts, params={'grating': 1200})
+	data, params = read_compact('spec.spz')  # data is 2xN like read_spectrum_file
+
+Delta encoding only pays off for smooth spectra (check with `benchmark`),
+so it's off by default. The default `wavelength_tol` (1e-4 nm) is below
+the precision of the JY text files; use 0 to store the axis exactly.
+
+Convert existing files with `text_to_compact`/`compact_to_text`, or
+from the command line:
+	python -m experiments.Spectra.spectra_compact convert FILE_OR_FOLDER [...]
+	python -m experiments.Spectra.spectra_compact benchmark FILE_OR_FOLDER [...]
+
+A. Wellisz 2025-10
+"""
+
+import json
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+from experiments.Spectra.spectra_files import read_spectrum_file
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+MAGIC = b'SPZ1'
+EXTENSION = '.spz'
+
+COMPRESSIONS = ('none', 'zlib', 'zstd')
+
+# Max polynomial degree tried for the wavelength axis
+_MAX_POLY_DEGREE = 5
+
+
+def _compress(raw: bytes, compression: str, level: int) -> bytes:
+	if compression == 'none':
+		return raw
+	if compression == 'zlib':
+		return zlib.compress(raw, level)
+	if compression == 'zstd':
+		if zstandard is None:
+			raise ValueError("zstd compression needs the 'zstandard' package")
+		return zstandard.ZstdCompressor(level=level).compress(raw)
+	raise ValueError(f'Unknown compression {compression!r}, must be one of {COMPRESSIONS}')
+
+
+def _decompress(data: bytes, compression: str) -> bytes:
+	if compression == 'none':
+		return data
+	if compression == 'zlib':
+		return zlib.decompress(data)
+	if compression == 'zstd':
+		if zstandard is None:
+			raise ValueError("Reading zstd compressed spectra needs the 'zstandard' package")
+		return zstandard.ZstdDecompressor().decompress(data)
+	raise ValueError(f'Unknown compression {compression!r}')
+
+
+def counts_dtype(counts: np.ndarray) -> np.dtype:
+	"""Smallest little-endian dtype that stores `counts` exactly."""
+	if counts.size == 0 or not np.all(np.isfinite(counts)) or not np.all(counts == np.round(counts)):
+		return np.dtype('<f8')
+	lo, hi = counts.min(), counts.max()
+	if lo >= 0 and hi <= np.iinfo(np.uint16).max:
+		return np.dtype('<u2')
+	if lo >= 0 and hi <= np.iinfo(np.uint32).max:
+		return np.dtype('<u4')
+	if lo >= np.iinfo(np.int32).min and hi <= np.iinfo(np.int32).max:
+		return np.dtype('<i4')
+	return np.dtype('<f8')
+
+
+def wavelength_polynomial(wavelengths: np.ndarray, tol: float) -> list:
+	"""
+	Lowest-degree polynomial coefficients (in pixel index, increasing
+	degree) reproducing `wavelengths` to within `tol`, or None.
+	"""
+	pixels = np.arange(len(wavelengths), dtype=float)
+	if len(wavelengths) < 2 or not np.all(np.isfinite(wavelengths)):
+		return None
+	for degree in range(1, min(_MAX_POLY_DEGREE, len(wavelengths) - 1) + 1):
+		coeffs = np.polynomial.polynomial.polyfit(pixels, wavelengths, degree)
+		if np.max(np.abs(np.polynomial.polynomial.polyval(pixels, coeffs) - wavelengths)) <= tol:
+			return coeffs.tolist()
+	return None
+
+
+def encode(wavelengths, counts, params: dict = None, compression: str = 'zlib', delta: bool = False,
+		   level: int = 6, wavelength_tol: float = 1e-4) -> bytes:
+	"""Encode one spectrum into the .spz format (see module docstring)."""
+	wavelengths = np.asarray(wavelengths, dtype=float)
+	counts = np.asarray(counts)
+	if wavelengths.shape != counts.shape or counts.ndim != 1:
+		raise ValueError('wavelengths and counts must be 1D arrays of the same length')
+
+	dtype = counts_dtype(counts)
+	stored = counts.astype(dtype)
+	use_delta = delta and dtype.kind in 'ui'
+	if use_delta:
+		# Wraps around for unsigned types, which the cumsum in decode undoes
+		stored = np.diff(stored, prepend=stored.dtype.type(0))
+	counts_block = _compress(stored.tobytes(), compression, level)
+
+	poly = wavelength_polynomial(wavelengths, wavelength_tol)
+	wavelength_block = b'' if poly is not None else _compress(
+		wavelengths.astype('<f8').tobytes(), compression, level)
+
+	header = {
+		'n_pixels': len(counts),
+		'dtype': dtype.str,
+		'delta': use_delta,
+		'compression': compression,
+		'wavelength_poly': poly,
+		'wavelength_bytes': len(wavelength_block),
+		'counts_bytes': len(counts_block),
+		'params': params or {},
+	}
+	header_bytes = json.dumps(header).encode()
+	return MAGIC + struct.pack('<I', len(header_bytes)) + header_bytes + wavelength_block + counts_block
+
+
+def _split(data: bytes):
+	if data[:4] != MAGIC:
+		raise ValueError('Not a .spz spectrum (bad magic)')
+	(header_len,) = struct.unpack_from('<I', data, 4)
+	start = 8 + header_len
+	return json.loads(data[8:start].decode()), start
+
+
+def decode(data: bytes):
+	"""Inverse of `encode`: returns (2xN (wavelengths, counts) array, params)."""
+	header, start = _split(data)
+	n = header['n_pixels']
+
+	wavelength_end = start + header['wavelength_bytes']
+	if header['wavelength_poly'] is not None:
+		wavelengths = np.polynomial.polynomial.polyval(np.arange(n, dtype=float), header['wavelength_poly'])
+	else:
+		wavelengths = np.frombuffer(_decompress(data[start:wavelength_end], header['compression']), dtype='<f8')
+
+	counts_end = wavelength_end + header['counts_bytes']
+	counts = np.frombuffer(_decompress(data[wavelength_end:counts_end], header['compression']),
+						   dtype=header['dtype'])
+	if header['delta']:
+		counts = np.cumsum(counts, dtype=counts.dtype)
+
+	return np.vstack([wavelengths, counts.astype(float)]), header['params']
+
+
+def write_compact(path, wavelengths, counts, params: dict = None, **kwargs):
+	"""Write one spectrum to `path` (kwargs as in `encode`)."""
+	Path(path).write_bytes(encode(wavelengths, counts, params, **kwargs))
+
+
+def read_compact(path):
+	"""Read a .spz file. Returns (2xN (wavelengths, counts) array, params)."""
+	return decode(Path(path).read_bytes())
+
+
+def read_compact_header(path) -> dict:
+	"""Just the header (params, storage details) of a .spz file."""
+	with open(path, 'rb') as f:
+		start = f.read(8)
+		(header_len,) = struct.unpack_from('<I', start, 4)
+		header, _ = _split(start + f.read(header_len))
+	return header
+
+
+def text_to_compact(txt_path, out_path = None, params: dict = None, **kwargs) -> Path:
+	"""Convert a JY text spectrum to .spz (next to it by default). Returns the new path."""
+	txt_path = Path(txt_path)
+	out_path = Path(out_path) if out_path is not None else txt_path.with_name(txt_path.name[:-len('.txt')] + EXTENSION)
+	data = read_spectrum_file(txt_path)
+	write_compact(out_path, data[0], data[1], params, **kwargs)
+	return out_path
+
+
+def compact_to_text(spz_path, out_path = None) -> Path:
+	"""Convert a .spz file back to a tab-delimited text file like the JY SDK writes."""
+	spz_path = Path(spz_path)
+	out_path = Path(out_path) if out_path is not None else spz_path.with_name(spz_path.name[:-len(EXTENSION)] + '.txt')
+	data, _ = read_compact(spz_path)
+	np.savetxt(out_path, data.T, fmt='%.10g', delimiter='\t')
+	return out_path
+
+
+def _collect(paths, suffix: str) -> list:
+	files = []
+	for path in map(Path, paths):
+		files += sorted(path.glob(f'*{suffix}')) if path.is_dir() else [path]
+	return files
+
+
+def benchmark(paths, compressions = None, repeat: int = 3) -> dict:
+	"""
+	Compare the text files in `paths` with their .spz encodings (in
+	memory). Returns {format: {'bytes_per_pixel', 'ratio', 'write_s', 'read_s'}}
+	where the times are per file (best of `repeat`).
+	"""
+	if compressions is None:
+		compressions = ['none', 'zlib'] + (['zstd'] if zstandard is not None else [])
+	files = _collect(paths, '.txt')
+	if not files:
+		raise ValueError('No spectrum files to benchmark')
+	spectra = [read_spectrum_file(f) for f in files]
+	n_pixels = sum(s.shape[1] for s in spectra)
+
+	def best_time(func):
+		times = []
+		for _ in range(repeat):
+			start = time.perf_counter()
+			func()
+			times.append(time.perf_counter() - start)
+		return min(times) / len(files)
+
+	text_bytes = sum(f.stat().st_size for f in files)
+	# Text writes go to a scratch folder, never next to the data (which may be read-only)
+	with tempfile.TemporaryDirectory() as scratch:
+		scratch_paths = [Path(scratch) / f'{i}.txt' for i in range(len(files))]
+		results = {'text': {
+			'bytes_per_pixel': text_bytes / n_pixels,
+			'ratio': 1.0,
+			'write_s': best_time(lambda: [np.savetxt(path, s.T, fmt='%.10g', delimiter='\t')
+										  for path, s in zip(scratch_paths, spectra)]),
+			'read_s': best_time(lambda: [read_spectrum_file(f) for f in files]),
+		}}
+
+	for compression in compressions:
+		for delta in (False, True):
+			encoded = [encode(s[0], s[1], compression=compression, delta=delta) for s in spectra]
+			size = sum(len(e) for e in encoded)
+			results[f"{compression}{'+delta' if delta else ''}"] = {
+				'bytes_per_pixel': size / n_pixels,
+				'ratio': text_bytes / size,
+				'write_s': best_time(lambda: [encode(s[0], s[1], compression=compression, delta=delta)
+											  for s in spectra]),
+				'read_s': best_time(lambda: [decode(e) for e in encoded]),
+			}
+	return results
+
+
+if __name__ == '__main__':
+	if len(sys.argv) < 3 or sys.argv[1] not in ('convert', 'benchmark'):
+		print(__doc__)
+		sys.exit(2)
+
+	if sys.argv[1] == 'convert':
+		for f in _collect(sys.argv[2:], '.txt'):
+			print(f'{f} -> {text_to_compact(f)}')
+	else:
+		for name, r in benchmark(sys.argv[2:]).items():
+			print(f"{name:>12}: {r['bytes_per_pixel']:6.2f} B/pixel ({r['ratio']:5.1f}x), "
+				  f"write {1e3 * r['write_s']:.3f} ms, read {1e3 * r['read_s']:.3f} ms per file")
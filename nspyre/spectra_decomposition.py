@@ -0,0 +1,227 @@
+"""
+Low-rank decomposition of spectra as they come in, one spectrum at a
+time, for classifying materials across a scan live instead of running
+PCA in a notebook at the end:
+
+	decomposition = SpectraDecomposition('pca', n_components=3, n_clusters=4)
+	for each new spectrum:
+		decomposition.update(counts)  # -> {'score1': .., 'score2': .., 'score3': .., 'cluster': 2}
+	decomposition.save(path)  # components etc. as .npz
+
+	pca: incremental PCA (Ross et al.): the mean and the top k components
+		(scaled by their singular values) plus the new spectrum form a
+		(k + 1) x P matrix whose SVD gives the updated components.
+	nmf: online NMF (Mairal et al.): the weights of the new spectrum are
+		solved with the components fixed (non-negative coordinate
+		descent), then the components get one block coordinate descent
+		pass on running averages of h h' and x h'.
+
+Clusters are assigned with online k-means on the decomposition's
+reconstruction of each spectrum (so the noise the components don't
+capture doesn't count): a spectrum further than CLUSTER_DISTANCE from
+every centroid starts a new cluster while there are fewer than
+n_clusters, otherwise it joins the nearest one and moves it.
+
+Memory (k x P components, n_clusters x P centroids) and time per update
+(O(P k^2)) don't depend on how many spectra have been seen. The
+scores/cluster of a spectrum are those at the time it came in; the
+components keep changing as more spectra arrive (least early in the
+scan of course).
+
+A. Wellisz 2025-10
+"""
+
+import numpy as np
+
+METHODS = ('pca', 'nmf')
+
+# Relative distance (see _relative_distance) at which a spectrum starts a new cluster
+CLUSTER_DISTANCE = 0.15
+
+# Coordinate descent passes for the NMF weights of each new spectrum
+NMF_WEIGHT_PASSES = 30
+
+
+def _relative_distance(a, b) -> np.ndarray:
+	"""||a - b|| / (||a|| + ||b||), 0 (same) to 1; `b` may be a stack of rows."""
+	norm = np.linalg.norm(a) + np.linalg.norm(b, axis=-1)
+	return np.linalg.norm(a - b, axis=-1) / np.maximum(norm, 1e-300)
+
+
+class IncrementalPCA:
+	"""Top `n_components` principal components, updated one spectrum at a time."""
+
+	def __init__(self, n_components: int):
+		self.n_components = n_components
+		self.n_seen = 0
+		self.mean = None
+		self.components = None  # (r x P), r <= n_components
+		self.singular_values = None
+		# Sum of squared deviations from the mean (Welford), for the explained variance ratio
+		self._m2 = 0.0
+
+	def update(self, x: np.ndarray) -> np.ndarray:
+		"""Add a spectrum (P,) and return its scores (NaN for components that don't exist yet)."""
+		x = np.asarray(x, dtype=float)
+		if self.n_seen == 0:
+			self.mean = x.copy()
+			self.components = np.empty((0, len(x)))
+			self.singular_values = np.empty(0)
+			self.n_seen = 1
+			return np.full(self.n_components, np.nan)
+
+		n = self.n_seen
+		deviation = x - self.mean
+		new_mean = self.mean + deviation / (n + 1)
+		self._m2 += float(deviation @ (x - new_mean))
+		# The old scatter (as s * V) plus the new spectrum's contribution, including the mean shift
+		stacked = np.vstack([self.singular_values[:, None] * self.components,
+							 np.sqrt(n / (n + 1)) * deviation])
+		_, s, vt = np.linalg.svd(stacked, full_matrices=False)
+		# Deterministic signs (largest element of each component positive), so scores don't flip
+		signs = np.sign(vt[np.arange(len(vt)), np.argmax(np.abs(vt), axis=1)])
+		vt *= np.where(signs == 0, 1, signs)[:, None]
+		keep = min(self.n_components, int(np.sum(s > 1e-12 * max(s[0], 1e-300))))
+		self.components, self.singular_values = vt[:keep], s[:keep]
+		self.mean = new_mean
+		self.n_seen += 1
+		return self.transform(x)
+
+	def transform(self, x: np.ndarray) -> np.ndarray:
+		scores = np.full(self.n_components, np.nan)
+		if self.components is not None and len(self.components):
+			scores[:len(self.components)] = self.components @ (np.asarray(x, dtype=float) - self.mean)
+		return scores
+
+	def reconstruct(self, scores: np.ndarray) -> np.ndarray:
+		r = len(self.components)
+		return self.mean + np.nan_to_num(scores[:r]) @ self.components
+
+	def explained_variance_ratio(self) -> np.ndarray:
+		if self.n_seen < 2 or self._m2 <= 0:
+			return np.zeros(len(self.singular_values) if self.singular_values is not None else 0)
+		return self.singular_values ** 2 / self._m2
+
+
+class OnlineNMF:
+	"""Non-negative factorization x ~ W h with `n_components` columns of W, updated one spectrum at a time."""
+
+	def __init__(self, n_components: int):
+		self.n_components = n_components
+		self.n_seen = 0
+		self.components = None  # W as (k x P), rows of unit norm at most
+		self._hh = None  # running average of h h' (k x k)
+		self._xh = None  # running average of x h' (k x P, transposed)
+		# Components start at 0 and are seeded by the first spectra they don't explain
+
+	def _weights(self, x: np.ndarray) -> np.ndarray:
+		"""Non-negative least squares weights of x with the components fixed (coordinate descent)."""
+		w = self.components
+		gram = w @ w.T
+		projection = w @ x
+		h = np.maximum(projection, 0) / np.maximum(np.diag(gram), 1e-300)
+		for _ in range(NMF_WEIGHT_PASSES):
+			for j in range(len(h)):
+				if gram[j, j] > 0:
+					h[j] = max(0.0, h[j] + (projection[j] - gram[j] @ h) / gram[j, j])
+		return h
+
+	def update(self, x: np.ndarray) -> np.ndarray:
+		"""Add a spectrum (P,) (negative counts are clipped to 0) and return its weights."""
+		x = np.clip(np.asarray(x, dtype=float), 0, None)
+		k = self.n_components
+		if self.components is None:
+			self.components = np.zeros((k, len(x)))
+			self._hh = np.zeros((k, k))
+			self._xh = np.zeros((k, len(x)))
+		h = self._weights(x)
+		# Spectra the components don't explain yet seed the unused ones
+		unused = np.flatnonzero(~self.components.any(axis=1))
+		if len(unused) and np.linalg.norm(x) > 0 and \
+				_relative_distance(x, self.reconstruct(h)) > CLUSTER_DISTANCE:
+			self.components[unused[0]] = x / np.linalg.norm(x)
+			h = self._weights(x)
+		n = self.n_seen
+		self._hh = (n * self._hh + np.outer(h, h)) / (n + 1)
+		self._xh = (n * self._xh + np.outer(h, x)) / (n + 1)
+		for j in range(k):
+			if self._hh[j, j] > 1e-300:
+				column = self.components[j] + (self._xh[j] - self._hh[j] @ self.components) / self._hh[j, j]
+				column = np.maximum(column, 0)
+				self.components[j] = column / max(1.0, np.linalg.norm(column))
+		self.n_seen += 1
+		return h
+
+	def transform(self, x: np.ndarray) -> np.ndarray:
+		return self._weights(np.clip(np.asarray(x, dtype=float), 0, None))
+
+	def reconstruct(self, weights: np.ndarray) -> np.ndarray:
+		return weights @ self.components
+
+
+class SpectraDecomposition:
+	"""Decomposition + clustering stage for scans (see module docstring)."""
+
+	def __init__(self, method: str = 'pca', n_components: int = 3, n_clusters: int = 4, normalize: bool = True):
+		"""
+		`normalize` scales each spectrum to unit norm first, so spectra are
+		classified by their shape rather than their brightness.
+		"""
+		method = method.lower()
+		if method not in METHODS:
+			raise ValueError(f'Unknown decomposition {method!r}, must be one of {METHODS}')
+		self.method = method
+		self.normalize = normalize
+		self.model = IncrementalPCA(n_components) if method == 'pca' else OnlineNMF(n_components)
+		self.n_clusters = n_clusters
+		self.centroids = []
+		self.cluster_counts = []
+
+	def _prepare(self, counts) -> np.ndarray:
+		x = np.nan_to_num(np.asarray(counts, dtype=float))
+		if self.normalize:
+			x = x / max(np.linalg.norm(x), 1e-300)
+		return x
+
+	def _assign(self, x: np.ndarray) -> int:
+		"""Online k-means step; returns the cluster of x."""
+		if self.centroids:
+			distances = _relative_distance(x, np.array(self.centroids))
+			nearest = int(np.argmin(distances))
+			if distances[nearest] <= CLUSTER_DISTANCE or len(self.centroids) >= self.n_clusters:
+				self.cluster_counts[nearest] += 1
+				self.centroids[nearest] += (x - self.centroids[nearest]) / self.cluster_counts[nearest]
+				return nearest
+		self.centroids.append(x.copy())
+		self.cluster_counts.append(1)
+		return len(self.centroids) - 1
+
+	def update(self, counts) -> dict:
+		"""
+		Add a spectrum (P,) and return {'score1', ..., 'scoreK', 'cluster'}
+		for it (scores are NaN until there are enough spectra for them).
+		"""
+		x = self._prepare(counts)
+		scores = self.model.update(x)
+		result = {f'score{i + 1}': float(value) for i, value in enumerate(scores)}
+		if self.n_clusters > 0:
+			result['cluster'] = self._assign(self.model.reconstruct(scores))
+		return result
+
+	@property
+	def n_seen(self) -> int:
+		return self.model.n_seen
+
+	def save(self, path):
+		"""The current state (components, mean, centroids, ...) as an .npz file."""
+		arrays = {
+			'method': self.method,
+			'n_seen': self.n_seen,
+			'components': self.model.components,
+			'centroids': np.array(self.centroids),
+			'cluster_counts': np.array(self.cluster_counts),
+		}
+		if self.method == 'pca':
+			arrays.update(mean=self.model.mean, singular_values=self.model.singular_values,
+						  explained_variance_ratio=self.model.explained_variance_ratio())
+		np.savez(path, **arrays)
@@ -0,0 +1,273 @@
+"""
+Helpers for spectrum files written by the spectra experiments.
+
+Filenames are built from a template where
+	%g -> grating (g/mm)
+	%t -> exposure time (s)
+	%w -> center wavelength (nm)
+	%n -> spectrum/crosshair number
+e.g. "%gg_%ts_%wnm_cross%n" -> "1200g_1.0s_700.0nm_cross12"
+
+`load_spectra_folder` loads a whole folder of these files at once
+(in parallel across cores), parses the filenames back into params and
+caches the result next to the data so reopening a folder is instant.
+
+A. Wellisz 2025-10
+"""
+
+import hashlib
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+_logger = logging.getLogger(__name__)
+
+# placeholder -> (field name, regex, type)
+FILENAME_FIELDS = {
+	'%g': ('grating', r'[-+]?\d+(?:\.\d*)?', lambda v: int(float(v))),
+	'%t': ('exposure_s', r'[-+]?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?', float),
+	'%w': ('wavelength', r'[-+]?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?', float),
+	'%n': ('n', r'\d+', int),
+}
+
+# The JY SDK always appends this to the filename we ask for
+JY_SUFFIX = '_0001_AREA1_1'
+
+# Name of the cache file written into loaded folders
+CACHE_FILENAME = '.spectra_cache.npz'
+
+# Below this many files a process pool costs more than it saves
+_MIN_FILES_FOR_POOL = 64
+
+# In-memory cache: folder -> (signature, SpectraFolder)
+_folder_cache = {}
+
+
+def format_filename(template: str, grating=None, exposure_s=None, wavelength=None, n=None) -> str:
+	"""
+	Fill in the %g/%t/%w/%n placeholders of a filename template
+	(without extension).
+	"""
+	return (template
+			.replace('%g', str(grating))
+			.replace('%t', str(exposure_s))
+			.replace('%n', str(n))
+			.replace('%w', str(wavelength)))
+
+
+def filename_regex(template: str) -> re.Pattern:
+	"""
+	Compile a regex matching filenames (stem only) produced by `template`.
+	Also matches names that still have the JY "_0001_AREA1_1" suffix.
+	"""
+	pattern = ''
+	seen = set()
+	for part in re.split(r'(%[gtwn])', template):
+		if part in FILENAME_FIELDS:
+			name, regex, _ = FILENAME_FIELDS[part]
+			if name in seen:
+				pattern += f'(?P={name})'
+			else:
+				pattern += f'(?P<{name}>{regex})'
+				seen.add(name)
+		else:
+			pattern += re.escape(part)
+	return re.compile(f'^{pattern}(?:{re.escape(JY_SUFFIX)})?$')
+
+
+def parse_filename(template: str, filename: str) -> dict:
+	"""
+	Parse a filename produced by `template` back into its params, e.g.
+		parse_filename('%gg_%ts_%wnm_cross%n', '1200g_1.0s_700.0nm_cross12.txt')
+		-> {'grating': 1200, 'exposure_s': 1.0, 'wavelength': 700.0, 'n': 12}
+	Returns None if the filename doesn't match the template.
+	"""
+	# Not Path.stem, since the params themselves contain dots
+	name = Path(filename).name
+	if name.endswith('.txt'):
+		name = name[:-len('.txt')]
+	match = filename_regex(template).match(name)
+	if match is None:
+		return None
+	return _convert_fields(match.groupdict())
+
+
+def _convert_fields(groups: dict) -> dict:
+	types = {name: typ for name, _, typ in FILENAME_FIELDS.values()}
+	return {name: types[name](value) for name, value in groups.items()}
+
+
+def read_spectrum_file(path) -> np.ndarray:
+	"""
+	Read one tab-delimited JY spectrum file into a 2xN array
+	(wavelengths, counts). Much faster than np.loadtxt for these files.
+	"""
+	with open(path, 'r') as f:
+		values = np.array(f.read().split(), dtype=float)
+	return values.reshape(-1, 2).T
+
+
+def unpack_array(payload) -> np.ndarray:
+	"""
+	Rebuild the array returned by Horiba.capture_spectrum(..., return_data=True)
+	from its (bytes, dtype, shape) payload (no copy).
+	"""
+	data, dtype, shape = payload
+	return np.frombuffer(data, dtype=dtype).reshape(shape)
+
+
+def _read_chunk(paths: list) -> list:
+	# Runs in the worker processes; one chunk per task keeps pickling overhead low
+	return [read_spectrum_file(path) for path in paths]
+
+
+class SpectraFolder:
+	"""
+	All of the spectra in one folder, consolidated into arrays.
+
+	`wavelengths` and `counts` are (N_files x N_pixels) arrays (rows are
+	NaN-padded if the files have different lengths).
+	`metadata` is a structured array with one row per file and the fields
+	filename, grating, exposure_s, wavelength, n (NaN/-1 if the filename
+	doesn't provide them).
+	"""
+
+	def __init__(self, folder, wavelengths, counts, metadata):
+		self.folder = Path(folder)
+		self.wavelengths = wavelengths
+		self.counts = counts
+		self.metadata = metadata
+
+	def __len__(self):
+		return len(self.metadata)
+
+	def spectrum(self, i: int) -> np.ndarray:
+		"""2xN (wavelengths, counts) array for the i-th file, same as the experiments push."""
+		return np.vstack([self.wavelengths[i], self.counts[i]])
+
+
+METADATA_DTYPE = np.dtype([
+	('filename', 'U256'),
+	('grating', 'i4'),
+	('exposure_s', 'f8'),
+	('wavelength', 'f8'),
+	('n', 'i4'),
+])
+
+
+def _folder_signature(template: str, files: list) -> str:
+	"""Hash of the template and (name, size, mtime) of every file."""
+	h = hashlib.sha1(template.encode())
+	for path in files:
+		st = path.stat()
+		h.update(f'{path.name}\0{st.st_size}\0{st.st_mtime_ns}\n'.encode())
+	return h.hexdigest()
+
+
+def _scan_folder(folder: Path, template: str):
+	"""Find spectrum files in `folder`, sorted by (n, filename) if the template has %n."""
+	regex = filename_regex(template)
+	files = []
+	for entry in os.scandir(folder):
+		if not entry.is_file() or not entry.name.endswith('.txt'):
+			continue
+		match = regex.match(entry.name[:-len('.txt')])
+		params = _convert_fields(match.groupdict()) if match else {}
+		files.append((params, Path(entry.path)))
+	files.sort(key=lambda f: (f[0].get('n', -1), f[1].name))
+	return files
+
+
+def _load_cache(cache_path: Path, signature: str):
+	try:
+		with np.load(cache_path, allow_pickle=False) as cache:
+			if str(cache['signature']) != signature:
+				return None
+			return cache['wavelengths'], cache['counts'], cache['metadata']
+	except (OSError, KeyError, ValueError) as e:
+		_logger.debug(f'Ignoring spectra cache {cache_path}: {e}')
+		return None
+
+
+def load_spectra_folder(folder, template: str = '%gg_%ts_%wnm_cross%n', workers: int = None,
+						use_cache: bool = True, only_matching: bool = True) -> SpectraFolder:
+	"""
+	Load every spectrum (.txt) file in `folder` into one SpectraFolder.
+
+	`template` is the filename template the files were saved with (same
+	syntax as the experiments' filename parameter). Params are parsed back
+	out of the filenames into `metadata`.
+
+	`workers` is the number of processes used to read the files (defaults
+	to the number of cores, 1 = no process pool).
+
+	If `use_cache` is True, the result is cached in memory and in
+	`folder/.spectra_cache.npz`; the cache is reused as long as the
+	template and every file's name, size and mtime are unchanged.
+
+	If `only_matching` is True, files that don't match `template` are skipped.
+	"""
+	folder = Path(folder)
+	files = _scan_folder(folder, template)
+	if only_matching:
+		files = [f for f in files if f[0]]
+	paths = [path for _, path in files]
+
+	signature = _folder_signature(template, paths)
+	cache_key = (str(folder.resolve()), template, only_matching)
+	cache_path = folder / CACHE_FILENAME
+
+	if use_cache:
+		cached = _folder_cache.get(cache_key)
+		if cached is not None and cached[0] == signature:
+			return cached[1]
+		from_disk = _load_cache(cache_path, signature)
+		if from_disk is not None:
+			result = SpectraFolder(folder, *from_disk)
+			_folder_cache[cache_key] = (signature, result)
+			return result
+
+	# Read all of the files
+	workers = workers or os.cpu_count() or 1
+	if workers > 1 and len(paths) >= _MIN_FILES_FOR_POOL:
+		chunk_size = max(1, len(paths) // (workers * 4))
+		chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+		with ProcessPoolExecutor(max_workers=workers) as pool:
+			arrays = [arr for chunk in pool.map(_read_chunk, chunks) for arr in chunk]
+	else:
+		arrays = _read_chunk(paths)
+
+	# Consolidate into (N x N_pixels) arrays
+	num_pixels = max((arr.shape[1] for arr in arrays), default=0)
+	wavelengths = np.full((len(arrays), num_pixels), np.nan)
+	counts = np.full((len(arrays), num_pixels), np.nan)
+	for i, arr in enumerate(arrays):
+		wavelengths[i, :arr.shape[1]] = arr[0]
+		counts[i, :arr.shape[1]] = arr[1]
+
+	metadata = np.zeros(len(files), dtype=METADATA_DTYPE)
+	for i, (params, path) in enumerate(files):
+		metadata[i] = (
+			path.name,
+			params.get('grating', -1),
+			params.get('exposure_s', np.nan),
+			params.get('wavelength', np.nan),
+			params.get('n', -1),
+		)
+
+	result = SpectraFolder(folder, wavelengths, counts, metadata)
+
+	if use_cache:
+		_folder_cache[cache_key] = (signature, result)
+		try:
+			np.savez(cache_path, signature=signature, wavelengths=wavelengths,
+					 counts=counts, metadata=metadata)
+		except OSError as e:
+			# e.g. read-only folder; the in-memory cache still works
+			_logger.warning(f'Could not write spectra cache to {cache_path}: {e}')
+
+	return result
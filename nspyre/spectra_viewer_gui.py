@@ -2,30 +2,185 @@
 Widget for viewing the spectra produced by SpectraPerXhairWidget
 (currently hardcoded to find datasets (within the given sink)
  starting with "spec_")
+
+Spectra can be viewed either as overlaid lines or as a waterfall
+(one image with one row per crosshair, crosshair # vs. wavelength).
+The clusters view shows the FSM position of every point coloured by
+the cluster its spectrum was put in (the 'clusters' array pushed by
+scans with a decomposition, see spectra_decomposition.py).
 """
 
 import logging
+import re
 import time
+from collections import Counter
 
 import numpy as np
+import pyqtgraph as pg
 from pyqtgraph.Qt import QtCore, QtGui, QtWidgets
 
 from nspyre.data.sink import DataSink
 from nspyre.gui.widgets.line_plot import LinePlotWidget
 
+from experiments.Spectra.spectra_files import load_spectra_folder
+
 _logger = logging.getLogger(__name__)
 
+class WaterfallBuffer:
+    """
+    Preallocated (rows x pixels) array holding one spectrum per row, used
+    for the waterfall view. The capacity doubles whenever a row past the end
+    is written, so filling N rows only costs O(N) copies overall.
+    Unfilled rows are NaN (drawn transparent).
+    """
+
+    def __init__(self, initial_rows: int = 64):
+        self.initial_rows = initial_rows
+        self.clear()
+
+    def clear(self):
+        """Drop all rows."""
+        self.counts = None
+        # Copy of counts with each row divided by its max
+        self.normalized = None
+        # Wavelength axis shared by every row (taken from the first spectrum)
+        self.x = None
+        # 1 + highest row written so far
+        self.num_rows = 0
+
+    def _ensure_capacity(self, row: int, num_pixels: int):
+        """Allocate/grow the buffers so that `row` fits."""
+        if self.counts is None or self.counts.shape[1] != num_pixels:
+            # First spectrum, or the number of pixels changed: start over
+            self.clear()
+            capacity = max(self.initial_rows, row + 1)
+            self.counts = np.full((capacity, num_pixels), np.nan)
+            self.normalized = np.full((capacity, num_pixels), np.nan)
+            return
+
+        capacity = self.counts.shape[0]
+        if row < capacity:
+            return
+        while capacity <= row:
+            capacity *= 2
+        for attr in ('counts', 'normalized'):
+            old = getattr(self, attr)
+            new = np.full((capacity, num_pixels), np.nan)
+            new[:old.shape[0]] = old
+            setattr(self, attr, new)
+
+    def set_row(self, row: int, x: np.ndarray, y: np.ndarray):
+        """Write one spectrum into the given row."""
+        self._ensure_capacity(row, len(y))
+        if self.x is None:
+            self.x = np.asarray(x, dtype=float)
+        self.counts[row] = y
+        peak = np.nanmax(y) if len(y) else 0
+        self.normalized[row] = y / peak if peak > 0 else y
+        self.num_rows = max(self.num_rows, row + 1)
+
+    def clear_row(self, row: int):
+        """Blank out one row (e.g. if its spectrum disappeared)."""
+        if self.counts is not None and row < self.num_rows:
+            self.counts[row] = np.nan
+            self.normalized[row] = np.nan
+
+    def image(self, normalize: bool = False) -> np.ndarray:
+        """View of the rows in use (no copy)."""
+        if self.counts is None:
+            return None
+        buffer = self.normalized if normalize else self.counts
+        return buffer[:self.num_rows]
+
+
+def folder_spectrum_names(metadata) -> list:
+    """
+    Name of each spectrum of a loaded folder: the same as
+    SpectraPerXhairMeasurement would push (spec_cross001, ...), plus the
+    center wavelength when several files share a number (e.g. the same
+    crosshairs at several wavelengths), plus the grating/exposure when
+    even that isn't enough, so no spectrum hides another.
+    """
+    names = [f"spec_cross{meta['n']:03d}" if meta['n'] >= 0 else f"spec_{meta['filename'][:-len('.txt')]}"
+             for meta in metadata]
+    for suffix in ("_{wavelength:g}nm", "_{grating}g_{exposure_s:g}s"):
+        counts = Counter(names)
+        names = [name + suffix.format(wavelength=meta['wavelength'], grating=meta['grating'],
+                                      exposure_s=meta['exposure_s']) if counts[name] > 1 else name
+                 for name, meta in zip(names, metadata)]
+    return names
+
+
+class FolderLoader(QtCore.QObject):
+    """
+    Loads folders of saved spectra on its own QThread, so reading (and
+    caching) a big folder never freezes the viewer. Results come back as
+    signals.
+    """
+
+    loaded = QtCore.Signal(str, object, int)  # folder, {spectrum name: [2xN array]}, number of files
+    failed = QtCore.Signal(str, str)  # folder, error message
+
+    _load_requested = QtCore.Signal(str, str)
+
+    def __init__(self):
+        super().__init__()
+        self._thread = QtCore.QThread()
+        self.moveToThread(self._thread)
+        # Queued connection, since the slot lives in the worker thread
+        self._load_requested.connect(self._do_load)
+        self._thread.start()
+
+    def load(self, folder: str, template: str):
+        self._load_requested.emit(folder, template)
+
+    def stop(self):
+        self._thread.quit()
+        self._thread.wait(2000)
+
+    @QtCore.Slot(str, str)
+    def _do_load(self, folder, template):
+        try:
+            loaded = load_spectra_folder(folder, template=template)
+        except Exception as e:
+            _logger.error(f"Error loading spectra from {folder}: {e}")
+            self.failed.emit(folder, str(e))
+            return
+        names = folder_spectrum_names(loaded.metadata)
+        datasets = {name: [loaded.spectrum(i)] for i, name in enumerate(names)}
+        self.loaded.emit(folder, datasets, len(loaded))
+
+
 class SpectraViewerWidget(QtWidgets.QWidget):
     """Qt widget for visualizing multiple spectra"""
 
+    # Max number of queued sink updates merged into a single redraw
+    MAX_POPS_PER_UPDATE = 50
+
     def __init__(self):
         super().__init__()
 
         self.sink = None
         self.sink_mutex = QtCore.QMutex()
         self.current_dataset = None
+        # Full-resolution data (the plot only ever draws a decimated view of it)
         self.spectra_data = {}
-        self.visible_spectra = []
+        # (xmin, xmax, ymin, ymax) of each spectrum, used to cull curves outside the view
+        self.spectra_bounds = {}
+        # Checked spectra, and the subset of them that actually has a curve on the plot
+        self.visible_spectra = set()
+        self.rendered_spectra = set()
+        # List items indexed by spectrum name so we never rescan the QListWidget
+        self.list_items = {}
+        # Spectra whose data changed since the last redraw
+        self.dirty_spectra = set()
+        # Last (title, xlabel, ylabel) applied to the plot
+        self.plot_labels = (None, None, None)
+        # Folder being loaded in the background (None = none, or superseded by a connect)
+        self.loading_folder = None
+        self.folder_loader = FolderLoader()
+        self.folder_loader.loaded.connect(self._folder_loaded)
+        self.folder_loader.failed.connect(self._folder_failed)
 
         # main layout
         main_layout = QtWidgets.QHBoxLayout()
@@ -38,7 +193,41 @@ class SpectraViewerWidget(QtWidgets.QWidget):
             ylabel='Counts',
             legend=True
         )
-        main_layout.addWidget(self.plot_widget, 4)  # Plot takes 4/5 of space
+
+        # waterfall view: every spectrum as one row of a single image item
+        self.waterfall = WaterfallBuffer()
+        # spectrum name -> waterfall row
+        self.waterfall_rows = {}
+        self.waterfall_dirty = False
+        self.waterfall_widget = pg.PlotWidget(title='Spectra per crosshair')
+        self.waterfall_widget.setLabel('bottom', 'Wavelength (nm)')
+        self.waterfall_widget.setLabel('left', 'Crosshair #')
+        # row-major so that image[row] is one spectrum
+        self.waterfall_image = pg.ImageItem(axisOrder='row-major')
+        self.waterfall_image.setLookupTable(pg.colormap.get('viridis').getLookupTable(nPts=256))
+        self.waterfall_widget.addItem(self.waterfall_image)
+
+        # clusters view: (fsm x, fsm y, cluster) rows, one brush per cluster
+        self.clusters = None
+        self.clusters_widget = pg.PlotWidget(title='Clusters')
+        self.clusters_widget.setLabel('bottom', 'FSM x')
+        self.clusters_widget.setLabel('left', 'FSM y')
+        self.clusters_widget.setAspectLocked(True)
+        self.clusters_scatter = pg.ScatterPlotItem(size=10, pen=None)
+        self.clusters_widget.addItem(self.clusters_scatter)
+
+        self.plot_stack = QtWidgets.QStackedWidget()
+        self.plot_stack.addWidget(self.plot_widget)
+        self.plot_stack.addWidget(self.waterfall_widget)
+        self.plot_stack.addWidget(self.clusters_widget)
+        main_layout.addWidget(self.plot_stack, 4)  # Plot takes 4/5 of space
+
+        # Level of detail: pyqtgraph draws min/max per screen pixel of the visible
+        # x range only, and recomputes this whenever the view changes
+        self.plot_item = self.plot_widget.plot_widget.getPlotItem()
+        self.plot_item.setDownsampling(auto=True, mode='peak')
+        self.plot_item.setClipToView(True)
+        self.plot_item.getViewBox().sigRangeChanged.connect(self._cull_curves)
 
         # control panel
         control_panel = QtWidgets.QWidget()
@@ -58,6 +247,15 @@ class SpectraViewerWidget(QtWidgets.QWidget):
         dataset_layout.addWidget(self.connect_btn)
         control_layout.addLayout(dataset_layout)
 
+        # Offline loading of a folder of saved spectra
+        folder_layout = QtWidgets.QHBoxLayout()
+        self.template_edit = QtWidgets.QLineEdit('%gg_%ts_%wnm_cross%n')
+        self.load_folder_btn = QtWidgets.QPushButton('Load Folder...')
+        self.load_folder_btn.clicked.connect(self._load_folder)
+        folder_layout.addWidget(self.template_edit)
+        folder_layout.addWidget(self.load_folder_btn)
+        control_layout.addLayout(folder_layout)
+
         # Control buttons
         btn_layout = QtWidgets.QHBoxLayout()
         self.show_all_btn = QtWidgets.QPushButton('Show All')
@@ -79,6 +277,35 @@ class SpectraViewerWidget(QtWidgets.QWidget):
         btn_layout2.addWidget(self.hide_selected_btn)
         control_layout.addLayout(btn_layout2)
 
+        # Display options
+        lod_layout = QtWidgets.QHBoxLayout()
+        self.decimate_checkbox = QtWidgets.QCheckBox('Decimate')
+        self.decimate_checkbox.setChecked(True)
+        self.decimate_checkbox.toggled.connect(self._set_decimation)
+        lod_layout.addWidget(self.decimate_checkbox)
+
+        lod_layout.addWidget(QtWidgets.QLabel('Max curves:'))
+        # 0 = no limit
+        self.max_curves_spin = QtWidgets.QSpinBox()
+        self.max_curves_spin.setRange(0, 100_000)
+        self.max_curves_spin.setValue(0)
+        self.max_curves_spin.setSpecialValueText('No limit')
+        self.max_curves_spin.valueChanged.connect(lambda _: self._sync_rendered())
+        lod_layout.addWidget(self.max_curves_spin)
+        control_layout.addLayout(lod_layout)
+
+        view_layout = QtWidgets.QHBoxLayout()
+        view_layout.addWidget(QtWidgets.QLabel('View:'))
+        self.view_combo = QtWidgets.QComboBox()
+        self.view_combo.addItems(['Lines', 'Waterfall', 'Clusters'])
+        self.view_combo.currentIndexChanged.connect(self._set_view)
+        view_layout.addWidget(self.view_combo)
+        self.normalize_combo = QtWidgets.QComboBox()
+        self.normalize_combo.addItems(['Raw counts', 'Normalized'])
+        self.normalize_combo.currentIndexChanged.connect(lambda _: self._render_waterfall())
+        view_layout.addWidget(self.normalize_combo)
+        control_layout.addLayout(view_layout)
+
         # Spectra list
         spectra_label = QtWidgets.QLabel('Available Spectra:')
         control_layout.addWidget(spectra_label)
@@ -91,6 +318,8 @@ class SpectraViewerWidget(QtWidgets.QWidget):
         # Status label
         self.status_label = QtWidgets.QLabel('Not connected')
         control_layout.addWidget(self.status_label)
+        self.curves_label = QtWidgets.QLabel('')
+        control_layout.addWidget(self.curves_label)
 
         control_layout.addStretch()  # Push everything to the top
 
@@ -109,6 +338,10 @@ class SpectraViewerWidget(QtWidgets.QWidget):
         if not dataset_name:
             return
 
+        # Whatever folder is still loading shouldn't replace the dataset
+        self.loading_folder = None
+        self.load_folder_btn.setEnabled(True)
+
         with QtCore.QMutexLocker(self.sink_mutex):
             # Clean up existing sink
             if self.sink is not None:
@@ -136,6 +369,7 @@ class SpectraViewerWidget(QtWidgets.QWidget):
                     return
                     
                 self.current_dataset = dataset_name
+                self._update_clusters(None)
                 self.status_label.setText(f'Connected to {dataset_name}')
                 _logger.info(f"Connected to dataset: {dataset_name}")
                 
@@ -145,90 +379,113 @@ class SpectraViewerWidget(QtWidgets.QWidget):
                 self.current_dataset = None
                 self.status_label.setText(f'Connection failed: {e}')
 
-    def _update_spectra_list(self, datasets: dict):
-        """Update the list of available spectra."""
-        # Find all spectrometer datasets (starting with "spec_")
-        spec_datasets = [name for name in datasets.keys() if name.startswith('spec_')]
-        spec_datasets.sort()
-
-        current_items = {
-            self.spectra_list.item(i).text() 
-            for i in range(self.spectra_list.count())
-        }
-
-        # Add new items
-        for spec_name in spec_datasets:
-            if spec_name not in current_items:
-                item = QtWidgets.QListWidgetItem(spec_name)
-                item.setFlags(item.flags() | QtCore.Qt.ItemFlag.ItemIsUserCheckable)
-                item.setCheckState(QtCore.Qt.CheckState.Unchecked)
-                self.spectra_list.addItem(item)
+    def _load_folder(self):
+        """Disconnect from dataserv and show the spectra saved in a folder instead (loaded in the background)."""
+        folder = QtWidgets.QFileDialog.getExistingDirectory(self, 'Spectra folder')
+        if not folder:
+            return
+
+        with QtCore.QMutexLocker(self.sink_mutex):
+            if self.sink is not None:
+                try:
+                    self.sink.stop()
+                except Exception as e:
+                    _logger.error(f"Error stopping sink: {e}")
+                self.sink = None
+                self.current_dataset = None
+
+        self.loading_folder = folder
+        self.load_folder_btn.setEnabled(False)
+        self.status_label.setText(f'Loading {folder}...')
+        self.folder_loader.load(folder, self.template_edit.text().strip())
+
+    def _folder_failed(self, folder: str, error: str):
+        if folder != self.loading_folder:
+            return
+        self.loading_folder = None
+        self.load_folder_btn.setEnabled(True)
+        self.status_label.setText(f'Loading failed: {error}')
+
+    def _folder_loaded(self, folder: str, datasets: dict, num_files: int):
+        """Show the spectra of a folder once the loader is done with it."""
+        if folder != self.loading_folder:
+            return
+        self.loading_folder = None
+        self.load_folder_btn.setEnabled(True)
+
+        with QtCore.QMutexLocker(self.sink_mutex):
+            # Drop whatever was shown before
+            self._update_spectra_list(set())
+            self.waterfall.clear()
+            self.waterfall_rows = {}
+            self._update_clusters(None)
+
+            spec_names = set(datasets)
+            self._update_spectra_list(spec_names)
+            self._update_spectra_data(datasets, spec_names)
+            self._redraw_dirty()
+            self.status_label.setText(f'Loaded {num_files} spectra from {folder}')
+
+    def _update_spectra_list(self, spec_names: set):
+        """Add/remove list items so the list matches the available spectra."""
+        # Add new items (in sorted order, like cross001, cross002, ...)
+        for spec_name in sorted(spec_names.difference(self.list_items)):
+            item = QtWidgets.QListWidgetItem(spec_name)
+            item.setFlags(item.flags() | QtCore.Qt.ItemFlag.ItemIsUserCheckable)
+            item.setCheckState(QtCore.Qt.CheckState.Unchecked)
+            self.spectra_list.addItem(item)
+            self.list_items[spec_name] = item
 
         # Remove items that no longer exist
-        for i in range(self.spectra_list.count() - 1, -1, -1):
-            item = self.spectra_list.item(i)
-            if item.text() not in spec_datasets:
-                # Remove plot if it exists
-                if item.text() in self.visible_spectra:
-                    self.plot_widget.remove_plot(item.text())
-                    self.visible_spectra.remove(item.text())
-                self.spectra_list.takeItem(i)
+        removed = set(self.list_items).difference(spec_names)
+        for spec_name in removed:
+            item = self.list_items.pop(spec_name)
+            self.visible_spectra.discard(spec_name)
+            self.spectra_data.pop(spec_name, None)
+            self.spectra_bounds.pop(spec_name, None)
+            self.dirty_spectra.discard(spec_name)
+            if spec_name in self.waterfall_rows:
+                self.waterfall.clear_row(self.waterfall_rows.pop(spec_name))
+                self.waterfall_dirty = True
+            self.spectra_list.takeItem(self.spectra_list.row(item))
+
+        # Remove plots if they exist
+        if removed:
+            self._sync_rendered()
 
     def _spectrum_checkbox_changed(self, item):
         """Handle checkbox state changes in the spectra list."""
         spectrum_name = item.text()
         is_checked = item.checkState() == QtCore.Qt.CheckState.Checked
 
-        #print(f"DEBUG: _spectrum_checkbox_changed for {spectrum_name}")
-
         try:
-            if is_checked and spectrum_name not in self.visible_spectra:
-                # Show spectrum
-                #print("DEBUG: Spec checked")
-                if spectrum_name in self.spectra_data:
-                    x_data = self.spectra_data[spectrum_name][0]
-                    y_data = self.spectra_data[spectrum_name][1]
-                    self.plot_widget.add_plot(spectrum_name)
-                    self.plot_widget.set_data(spectrum_name, x_data, y_data, blocking = False)
-                    self.visible_spectra.append(spectrum_name)
-
-            elif not is_checked and spectrum_name in self.visible_spectra:
-                # Hide spectrum
-                #print("DEBUG: Spec UNchecked")
-
-                self.plot_widget.remove_plot(spectrum_name)
-                self.visible_spectra.remove(spectrum_name)
+            if is_checked:
+                self.visible_spectra.add(spectrum_name)
+            else:
+                self.visible_spectra.discard(spectrum_name)
+            self._sync_rendered()
         except Exception as e:
-                    _logger.debug(f"Error with checkbox: {e}")
-        
+            _logger.debug(f"Error with checkbox: {e}")
 
     def _show_all(self):
         """Show all spectra."""
         self.spectra_list.blockSignals(True)
-        for i in range(self.spectra_list.count()):
-            item = self.spectra_list.item(i)
+        for item in self.list_items.values():
             item.setCheckState(QtCore.Qt.CheckState.Checked)
         self.spectra_list.blockSignals(False)
-        
-        # Update all plots
-        for spectrum_name, data in self.spectra_data.items():
-            if spectrum_name not in self.visible_spectra:
-                self.plot_widget.add_plot(spectrum_name)
-                self.plot_widget.set_data(spectrum_name, data[0], data[1], blocking = False)
-                self.visible_spectra.append(spectrum_name)
+
+        self.visible_spectra = set(self.list_items)
+        self._sync_rendered()
 
     def _hide_all(self):
         """Hide all spectra."""
         self.spectra_list.blockSignals(True)
-        for i in range(self.spectra_list.count()):
-            item = self.spectra_list.item(i)
+        for item in self.list_items.values():
             item.setCheckState(QtCore.Qt.CheckState.Unchecked)
         self.spectra_list.blockSignals(False)
-        
-        # Remove all plots
-        for spectrum_name in self.visible_spectra[:]:
-            self.plot_widget.remove_plot(spectrum_name)
-            self.visible_spectra.remove(spectrum_name)
+
+        self.visible_spectra = set()
+        self._sync_rendered()
 
     def _show_selected(self):
         """Show only the selected spectra."""
@@ -239,17 +496,17 @@ class SpectraViewerWidget(QtWidgets.QWidget):
         self.spectra_list.blockSignals(True)
         # First uncheck all
         # TODO: MAYBE DONT DO THIS AND JUST SHOW SELECTED IN ADDITION
-        for i in range(self.spectra_list.count()):
-            item = self.spectra_list.item(i)
+        for item in self.list_items.values():
             item.setCheckState(QtCore.Qt.CheckState.Unchecked)
         
         # Then check selected
         for item in selected_items:
             item.setCheckState(QtCore.Qt.CheckState.Checked)
-            # Have to call this manually for some reason
-            self._spectrum_checkbox_changed(item)
         self.spectra_list.blockSignals(False)
 
+        self.visible_spectra = {item.text() for item in selected_items}
+        self._sync_rendered()
+
     def _hide_selected(self):
         """Hide the selected spectra."""
         selected_items = self.spectra_list.selectedItems()
@@ -259,9 +516,210 @@ class SpectraViewerWidget(QtWidgets.QWidget):
         self.spectra_list.blockSignals(True)
         for item in selected_items:
             item.setCheckState(QtCore.Qt.CheckState.Unchecked)
-            self._spectrum_checkbox_changed(item)
+            self.visible_spectra.discard(item.text())
         self.spectra_list.blockSignals(False)
 
+        self._sync_rendered()
+
+    def _sync_rendered(self):
+        """
+        Add/remove curves so the plot shows the checked spectra, capped at
+        the "Max curves" setting (0 = no limit). Checked spectra that haven't
+        received any data yet get drawn once their data arrives.
+        """
+        wanted = sorted(name for name in self.visible_spectra if name in self.spectra_data)
+        max_curves = self.max_curves_spin.value()
+        if max_curves > 0:
+            wanted = wanted[:max_curves]
+        wanted_set = set(wanted)
+
+        for spec_name in self.rendered_spectra - wanted_set:
+            self.plot_widget.remove_plot(spec_name)
+
+        for spec_name in wanted:
+            if spec_name in self.rendered_spectra:
+                continue
+            data = self.spectra_data[spec_name]
+            self.plot_widget.add_plot(spec_name)
+            self.plot_widget.set_data(spec_name, data[0], data[1], blocking = False)
+
+        self.rendered_spectra = wanted_set
+        self.curves_label.setText(f'Drawing {len(wanted_set)} of {len(self.visible_spectra)} checked spectra')
+        self._cull_curves()
+
+    def _set_decimation(self, enabled: bool):
+        """Turn min/max-per-pixel decimation and clipping to the view on/off."""
+        self.plot_item.setDownsampling(auto=enabled, mode='peak')
+        self.plot_item.setClipToView(enabled)
+
+    def _cull_curves(self, *args):
+        """
+        Hide curves that lie entirely outside the current view so they aren't
+        painted at all. Axes that are auto-ranging are never culled on, since
+        autorange only looks at visible curves.
+        """
+        view_box = self.plot_item.getViewBox()
+        auto_x, auto_y = view_box.autoRangeEnabled()
+        (x0, x1), (y0, y1) = view_box.viewRange()
+
+        for curve in self.plot_item.listDataItems():
+            bounds = self.spectra_bounds.get(curve.name())
+            if bounds is None:
+                continue
+            xmin, xmax, ymin, ymax = bounds
+            in_x = bool(auto_x) or (xmax >= x0 and xmin <= x1)
+            in_y = bool(auto_y) or (ymax >= y0 and ymin <= y1)
+            curve.setVisible(in_x and in_y)
+
+    def _set_view(self, index: int):
+        """Switch between the line plot (0), the waterfall (1) and the clusters (2)."""
+        self.plot_stack.setCurrentIndex(index)
+        if index == 1:
+            self._render_waterfall()
+        elif index == 2:
+            self._render_clusters()
+
+    def _waterfall_row(self, spec_name: str) -> int:
+        """
+        Row of the waterfall for a spectrum: crosshair number - 1 for names
+        like spec_cross012, otherwise the next free row.
+        """
+        row = self.waterfall_rows.get(spec_name)
+        if row is not None:
+            return row
+
+        match = re.search(r'(\d+)$', spec_name)
+        if match and int(match.group(1)) > 0:
+            row = int(match.group(1)) - 1
+        else:
+            row = max(self.waterfall_rows.values(), default=-1) + 1
+        self.waterfall_rows[spec_name] = row
+        return row
+
+    def _render_waterfall(self):
+        """Push the waterfall buffer to the image item (only if it's showing)."""
+        if self.plot_stack.currentIndex() != 1:
+            return
+        normalize = self.normalize_combo.currentText() == 'Normalized'
+        image = self.waterfall.image(normalize)
+        if image is None or not np.isfinite(image).any():
+            return
+
+        # Levels/colormap are applied on the CPU raster path by ImageItem
+        levels = (0.0, 1.0) if normalize else (np.nanmin(image), np.nanmax(image))
+        self.waterfall_image.setImage(image, autoLevels=False, levels=levels)
+
+        # Shared wavelength axis along x; row n is centered on crosshair n+1
+        x = self.waterfall.x
+        self.waterfall_image.setRect(QtCore.QRectF(x[0], 0.5, x[-1] - x[0], image.shape[0]))
+        self.waterfall_dirty = False
+
+    def _update_clusters(self, clusters):
+        """Keep the latest 'clusters' array (None = none) and redraw it if it changed."""
+        if clusters is self.clusters:
+            return
+        self.clusters = clusters
+        self._render_clusters()
+
+    def _render_clusters(self):
+        """Scatter of the points coloured by cluster (only if it's showing); NaN clusters are grey."""
+        if self.plot_stack.currentIndex() != 2:
+            return
+        if self.clusters is None or len(self.clusters) == 0:
+            self.clusters_scatter.clear()
+            self.clusters_widget.setTitle('Clusters')
+            return
+
+        points = np.asarray(self.clusters, dtype=float).reshape(-1, 3)
+        labels = points[:, 2]
+        assigned = np.isfinite(labels)
+        num_clusters = int(np.max(labels[assigned])) + 1 if assigned.any() else 0
+        palette = [pg.mkBrush(pg.intColor(i, hues=max(num_clusters, 1))) for i in range(num_clusters)]
+        unassigned = pg.mkBrush(150, 150, 150)
+        brushes = [palette[int(label)] if np.isfinite(label) else unassigned for label in labels]
+
+        self.clusters_scatter.setData(x=points[:, 0], y=points[:, 1], brush=brushes)
+        self.clusters_widget.setTitle(f'Clusters ({len(points)} points, {num_clusters} clusters)')
+
+    def _pop_pending(self) -> bool:
+        """
+        Pop every update waiting in the sink so that bursts of pushes
+        (faster than the timer) get merged into one redraw.
+        Returns False if nothing new arrived.
+        """
+        try:
+            self.sink.pop(timeout=0.01)
+        except TimeoutError:
+            return False
+
+        for _ in range(self.MAX_POPS_PER_UPDATE - 1):
+            try:
+                self.sink.pop(timeout=0)
+            except TimeoutError:
+                break
+        return True
+
+    def _update_plot_labels(self):
+        """Update the plot title/labels, but only if they changed."""
+        labels = (
+            getattr(self.sink, 'title', None),
+            getattr(self.sink, 'xlabel', None),
+            getattr(self.sink, 'ylabel', None),
+        )
+        if labels == self.plot_labels:
+            return
+        self.plot_labels = labels
+
+        title, xlabel, ylabel = labels
+        if title:
+            self.plot_widget.set_title(title)
+        if xlabel:
+            self.plot_widget.xaxis.setLabel(text=xlabel)
+        if ylabel:
+            self.plot_widget.yaxis.setLabel(text=ylabel)
+
+    def _update_spectra_data(self, datasets: dict, spec_names: set):
+        """Store the latest array of each spectrum and mark the ones that changed."""
+        for spec_name in spec_names:
+            data_list = datasets[spec_name]
+            if not data_list:
+                continue
+            # Take the most recent data array
+            latest_data = data_list[-1]
+            # Items that weren't touched by the last push keep their identity
+            if latest_data is self.spectra_data.get(spec_name):
+                continue
+            if isinstance(latest_data, np.ndarray) and latest_data.shape[0] == 2:
+                self.spectra_data[spec_name] = latest_data
+                self.spectra_bounds[spec_name] = (
+                    np.nanmin(latest_data[0]), np.nanmax(latest_data[0]),
+                    np.nanmin(latest_data[1]), np.nanmax(latest_data[1]),
+                )
+                self.dirty_spectra.add(spec_name)
+                # Keep the waterfall filled even while it's not showing
+                self.waterfall.set_row(self._waterfall_row(spec_name), latest_data[0], latest_data[1])
+                self.waterfall_dirty = True
+
+    def _redraw_dirty(self):
+        """Redraw only the drawn spectra that changed since the last redraw."""
+        # Checked spectra that just got their first data need a curve
+        new_curves = set()
+        if self.dirty_spectra & (self.visible_spectra - self.rendered_spectra):
+            already_rendered = set(self.rendered_spectra)
+            self._sync_rendered()
+            new_curves = self.rendered_spectra - already_rendered
+
+        # Hidden spectra get drawn from spectra_data when they're checked
+        for spec_name in (self.dirty_spectra & self.rendered_spectra) - new_curves:
+            data = self.spectra_data[spec_name]
+            self.plot_widget.set_data(spec_name, data[0], data[1], blocking = False)
+        self.dirty_spectra.clear()
+        self._cull_curves()
+
+        # One image update covers all of the new rows
+        if self.waterfall_dirty:
+            self._render_waterfall()
+
     def update_gui(self):
         """Update the spectra data and plots."""
         with QtCore.QMutexLocker(self.sink_mutex):
@@ -269,8 +727,9 @@ class SpectraViewerWidget(QtWidgets.QWidget):
                 return
 
             try:
-                # Check for new data
-                self.sink.pop(timeout=0.01)
+                # Check for new data (no new data -> nothing to redraw)
+                if not self._pop_pending():
+                    return
                 
                 # Get datasets
                 datasets = getattr(self.sink, 'datasets', {})
@@ -279,40 +738,19 @@ class SpectraViewerWidget(QtWidgets.QWidget):
 
                 # update titles/labels
                 try:
-                    title = getattr(self.sink, 'title', None)
-                    xlabel = getattr(self.sink, 'xlabel', None)
-                    ylabel = getattr(self.sink, 'ylabel', None)
-                    
-                    if title:
-                        self.plot_widget.set_title(title)
-                    if xlabel:
-                        self.plot_widget.xaxis.setLabel(text=xlabel)
-                    if ylabel:
-                        self.plot_widget.yaxis.setLabel(text=ylabel)
+                    self._update_plot_labels()
                 except Exception as e:
                     _logger.debug(f"Error updating plot labels: {e}")
 
-                # Update spectra list
-                self._update_spectra_list(datasets)
-
-                # Update spectra data (datasets produced by SpectraPerXhairMeasurement
-                #  all start with 'spec_' (e.g. spec_cross001))
-                for spec_name in [name for name in datasets.keys() if name.startswith('spec_')]:
-                    data_list = datasets[spec_name]
-                    if data_list and len(data_list) > 0:
-                        # Take the most recent data array
-                        latest_data = data_list[-1]
-                        if isinstance(latest_data, np.ndarray) and latest_data.shape[0] == 2:
-                            self.spectra_data[spec_name] = latest_data
-                            
-                            # Update plot if this spectrum is visible
-                            if spec_name in self.visible_spectra:
-                                x_data = latest_data[0]
-                                y_data = latest_data[1]
-                                self.plot_widget.set_data(spec_name, x_data, y_data, blocking = False)
+                # Datasets produced by SpectraPerXhairMeasurement
+                #  all start with 'spec_' (e.g. spec_cross001)
+                spec_names = {name for name in datasets.keys() if name.startswith('spec_')}
+
+                self._update_spectra_list(spec_names)
+                self._update_spectra_data(datasets, spec_names)
+                self._redraw_dirty()
+                self._update_clusters(getattr(self.sink, 'clusters', None))
 
-            except TimeoutError:
-                pass  # No new data available
             except Exception as e:
                 _logger.error(f"Error updating spectra: {e}")
 
@@ -327,4 +765,5 @@ class SpectraViewerWidget(QtWidgets.QWidget):
                 self.sink = None
         
         if self.update_timer.isActive():
-            self.update_timer.stop()
\ No newline at end of file
+            self.update_timer.stop()
+        self.folder_loader.stop()
\ No newline at end of file
@@ -0,0 +1,311 @@
+"""
+Adaptive hyperspectral map: one spectrum per point over a rectangle of
+FSM positions, but instead of a uniform grid it takes a coarse grid
+first and then only subdivides the cells where there's signal or where
+the spectrum changes between neighbours (quadtree, see adaptive_map.py),
+until the point or time budget runs out or nothing is left to refine.
+Each stage is visited in travel order (see scan_order.py).
+
+Pushed to the dataserver, besides the spectra/summaries per point
+(same as SpectraPerXhairMeasurement, with point0001, point0002, ... in
+place of the xhair labels):
+	'points': (N x 3) array of (fsm x, fsm y, signal) of every point so far
+	'clusters': (N x 3) array of (fsm x, fsm y, cluster) of every point so far
+		(NaN clusters without a decomposition, see spectra_decomposition.py;
+		shown by the clusters view of the spectra viewer)
+	'map': {'image', 'extent', 'field'} rasterized map (see SparseMap.rasterize),
+		updated after each stage
+Every point is recorded in <folder>/<dataset>_scan.json with its cell.
+
+A. Wellisz 2025-10
+
+Limitations:
+	- No resume (the manifest is only a record of the scan).
+	- The coarse grid is always measured in full, whatever the budget.
+	- Uses hardcoded fsm1, like SpectraPerXhairMeasurement.
+"""
+
+from nspyre import DataSource
+from nspyre import experiment_widget_process_queue, nspyre_init_logger
+
+import os
+import time
+import logging
+from pathlib import Path
+import numpy as np
+
+from experiments.Spectra.spectra_files import format_filename
+from experiments.Spectra.scan_monitor import ScanMonitor
+from experiments.Spectra.gateway_session import shared_session
+from experiments.Spectra.scan_manifest import ScanManifest
+from experiments.Spectra.scan_order import MoveCost, travel_order
+from experiments.Spectra.spectra_reduction import SpectrumReducer, parse_windows
+from experiments.Spectra.baseline import BaselineRemover
+from experiments.Spectra.spectra_decomposition import SpectraDecomposition
+from experiments.Spectra.adaptive_map import SparseMap, refine, spectral_features
+from experiments.Spectra.take_xhair_spectra import SpectraPerXhairMeasurement
+
+_HERE = Path(__file__).parent
+_logger = logging.getLogger(__name__)
+
+
+class AdaptiveMapMeasurement(SpectraPerXhairMeasurement):
+	"""Reuses the acquisition/retry and per-point data handling of SpectraPerXhairMeasurement."""
+
+	def __enter__(self):
+		nspyre_init_logger(
+			log_level = logging.INFO,
+			log_path = _HERE / '../../Logs',
+			log_path_level = logging.DEBUG,
+			prefix=Path(__file__).stem,
+			file_size=10_000_000,
+			)
+		_logger.info('Created AdaptiveMapMeasurement instance.')
+
+	def take_adaptive_map(self,
+		dataset: str,
+		folder: str,
+		filename: str,
+		x_min: float, x_max: float,
+		y_min: float, y_max: float,
+		coarse_nx: int, coarse_ny: int,
+		max_depth: int,
+		max_points: int,
+		time_budget_s: float,
+		threshold: float,
+		change_weight: float,
+		exposure_s: float,
+		gain: str,
+		adc: str,
+		xstart: int, xend: int,
+		ystart: int, yend: int,
+		xbin: int, ybin: int,
+		fit_model: str = 'None',
+		summary_windows: str = '',
+		push_spectra: bool = True,
+		baseline_lambda: float = 0,
+		decomposition: str = 'None',
+		n_components: int = 3,
+		n_clusters: int = 4,
+		**kwargs):
+		"""
+		Adaptive map over x_min-x_max, y_min-y_max (FSM coordinates).
+
+		coarse_nx, coarse_ny: size of the first, uniform grid
+		max_depth: how many times a coarse cell can be halved (so the finest cells are
+			1/2**max_depth of a coarse one in each direction)
+		max_points: total number of spectra at most
+		time_budget_s: total time for the map; each stage only refines as many cells as
+			fit in the time left (going by the time per point so far). 0 for no limit
+		threshold: cells scoring below this (0-1) aren't refined (see adaptive_map.py)
+		change_weight: 0 = refine where the signal is strongest, 1 = refine where the
+			spectrum changes most between neighbours
+		baseline_lambda: if > 0, cells are scored (and summarized/fitted) after removing
+			a smooth baseline with this stiffness (see baseline.py)
+		decomposition, n_components, n_clusters: streaming PCA/NMF + clustering of the
+			spectra, as for take_spectra_per_xhair (the scores/cluster are also kept with
+			each cell, so e.g. smap.rasterize('cluster') works)
+		The remaining arguments are the same as for take_spectra_per_xhair; `filename`'s
+		%n is the point number. kwargs should include wavelength + grating info for filename
+		"""
+
+		w = kwargs.get('wavelength')
+		g = kwargs.get('grating')
+
+		os.makedirs(folder, exist_ok=True)
+
+		catalog = self.open_catalog()
+		session = shared_session()
+		xstart, xend, ystart, yend = self.get_capture_roi(session, xstart, xend, ystart, yend)
+
+		timing_settings = {
+			'experiment': 'AdaptiveMapMeasurement', 'exposure_s': exposure_s, 'gain': gain, 'adc': adc,
+			'xstart': xstart, 'xend': xend, 'ystart': ystart, 'yend': yend, 'xbin': xbin, 'ybin': ybin,
+		}
+
+		smap = SparseMap((x_min, x_max, y_min, y_max), (coarse_nx, coarse_ny))
+
+		# Record of the scan; points are added as the stages decide on them
+		manifest_path = os.path.join(folder, f'{dataset}_scan.json')
+		scan_settings = dict(timing_settings, dataset=dataset, filename=filename, wavelength=w, grating=g,
+							 bounds=list(smap.bounds), coarse_shape=list(smap.coarse_shape), max_depth=max_depth,
+							 max_points=max_points, time_budget_s=time_budget_s, threshold=threshold,
+							 change_weight=change_weight)
+		manifest = ScanManifest.create(manifest_path, scan_settings, {}, self.get_hardware_state(session))
+
+		per_point_estimate_s = None
+		if catalog is not None:
+			try:
+				per_point_estimate_s = catalog.estimate_point_time(**timing_settings)
+			except Exception as e:
+				_logger.warning(f"Could not estimate time per point from the catalog: {e}")
+		keys = smap.coarse_keys()
+		monitor = ScanMonitor(len(keys), exposure_s, per_point_estimate_s)
+
+		cost = None
+		if catalog is not None:
+			try:
+				cost = MoveCost.from_measurements(catalog.move_times())
+			except Exception as e:
+				_logger.warning(f"Could not get FSM move times from the catalog: {e}")
+
+		reducer = None
+		if summary_windows.strip() or not push_spectra:
+			reducer = SpectrumReducer(parse_windows(summary_windows))
+		baseline = BaselineRemover(lam=baseline_lambda) if baseline_lambda > 0 else None
+		decomposer = None
+		if decomposition != 'None':
+			decomposer = SpectraDecomposition(decomposition, n_components, n_clusters)
+
+		params = {
+			'exposure_s': exposure_s,
+			'gain': gain,
+			'adc': adc,
+			'roi': (xstart, xend, ystart, yend),
+			'bin': (xbin, ybin),
+			'wavelength': w,
+			'grating': g,
+			'bounds': smap.bounds,
+			'coarse_shape': smap.coarse_shape,
+		}
+
+		with DataSource(dataset) as spec_data, self.acquisition_session(session, f"the adaptive map '{dataset}'"):
+
+			datasets = {}
+			points = smap.points()
+			image, extent = smap.rasterize()
+			spec_data.push({
+				'params': params,
+				'title': 'Adaptive map',
+				'xlabel': 'Wavelength (nm)',
+				'ylabel': 'Counts',
+				'datasets': datasets,
+				'points': points,
+				'clusters': smap.points('cluster'),
+				'map': {'image': image, 'extent': extent, 'field': 'signal'},
+			})
+
+			stage = 0
+			position = None
+			start = time.monotonic()
+			while keys:
+				centers = [smap.center(key) for key in keys]
+				order = travel_order(centers, start=position, cost=cost)
+
+				for index in order:
+					key = keys[index]
+					n = len(smap) + 1
+					label = f'point{n:04d}'
+
+					if experiment_widget_process_queue(self.queue_to_exp) == 'stop':
+						self.queue_from_exp.put_nowait(f"Stopped in stage {stage} after {len(smap)} points.")
+						self.save_decomposition(decomposer, folder, dataset)
+						return
+
+					self.queue_from_exp.put_nowait(f"Stage {stage}: acquiring {label}... {monitor.status()}")
+					x, y = centers[index]
+					manifest.points[label] = {'cord': [x, y], 'cell': list(key)}
+
+					monitor.start_point()
+					session.gateway().fsm1.move((x, y))
+					monitor.moved()
+					move_distance = None if position is None else float(np.hypot(x - position[0], y - position[1]))
+					position = (x, y)
+
+					filename_with_params = format_filename(filename, grating=g, exposure_s=exposure_s, wavelength=w, n=n)
+					full_path = folder + '\\' + filename_with_params + '.txt'
+
+					try:
+						data_from_file = self.acquire(
+							session, manifest, label,
+							exposure_s=exposure_s,
+							outfile=full_path,
+							spectra=True,
+							gain=gain,
+							adc=adc,
+							xstart=xstart, xend=xend,
+							ystart=ystart, yend=yend,
+							xbin=xbin, ybin=ybin,
+							return_data=True,
+						)
+					except Exception as e:
+						self.queue_from_exp.put_nowait(f"Acquisition failed at {label} ({e}).")
+						raise
+					wavelengths = data_from_file[:,0]
+					counts = data_from_file[:,1]
+					data_arr = np.vstack([wavelengths, counts])
+
+					if catalog is not None:
+						try:
+							catalog.add(
+								full_path, counts=counts,
+								experiment='AdaptiveMapMeasurement', dataset=dataset,
+								grating=g, wavelength=w, exposure_s=exposure_s, gain=gain, adc=adc,
+								xstart=xstart, xend=xend, ystart=ystart, yend=yend, xbin=xbin, ybin=ybin,
+								xhair=label, fsm_x=float(x), fsm_y=float(y),
+							)
+						except Exception as e:
+							_logger.warning(f"Could not add {full_path} to the spectra catalog: {e}")
+
+					monitor.acquired()
+
+					corrected, summary, analysis = self.add_point_data(datasets, n, label, data_arr, push_spectra,
+																		reducer, fit_model, baseline, decomposer)
+					signal, features = spectral_features(wavelengths, corrected)
+					smap.add(key, signal, features, label=label, path=full_path, **summary, **analysis)
+
+					spec_data.push({
+						'params': params,
+						'title': 'Adaptive map',
+						'xlabel': 'Wavelength (nm)',
+						'ylabel': 'Counts',
+						'datasets': datasets,
+						'points': smap.points(),
+						'clusters': smap.points('cluster'),
+					})
+
+					timing = monitor.pushed()
+					if catalog is not None:
+						try:
+							catalog.add_point_timing(timing.move_s, timing.overhead_s, timing.push_s, timing.total_s,
+													 move_distance=move_distance, **timing_settings)
+						except Exception as e:
+							_logger.warning(f"Could not log point timing to the spectra catalog: {e}")
+
+					manifest.mark_done(label, path=full_path, fsm=[float(x), float(y)], cell=list(key), signal=signal)
+
+				# Rasterize on demand: once per stage is plenty for looking at
+				image, extent = smap.rasterize()
+				spec_data.push({
+					'params': params,
+					'title': 'Adaptive map',
+					'xlabel': 'Wavelength (nm)',
+					'ylabel': 'Counts',
+					'datasets': datasets,
+					'points': smap.points(),
+					'clusters': smap.points('cluster'),
+					'map': {'image': image, 'extent': extent, 'field': 'signal'},
+				})
+
+				stage += 1
+				budget = self.remaining_budget(len(smap), max_points, time_budget_s,
+											   time.monotonic() - start, monitor.seconds_per_point())
+				keys = refine(smap, budget, threshold, max_depth, change_weight)
+				monitor.num_points += len(keys)
+				_logger.info(f"Stage {stage}: refining {len(keys) // 4} cells ({len(keys)} points, budget {budget})")
+
+		manifest.finish()
+		self.save_decomposition(decomposer, folder, dataset)
+		uniform = coarse_nx * coarse_ny * 4 ** max(key[0] for key in smap.cells)
+		self.queue_from_exp.put_nowait(
+			f"Adaptive map complete: {len(smap)} points in {stage} stages "
+			f"(a uniform grid at the same resolution would take {uniform}). {monitor.status()}")
+		return
+
+	def remaining_budget(self, num_done: int, max_points: int, time_budget_s: float, elapsed_s: float,
+						 seconds_per_point: float) -> int:
+		"""How many more points the point and time budgets allow."""
+		budget = max_points - num_done
+		if time_budget_s and seconds_per_point:
+			budget = min(budget, int((time_budget_s - elapsed_s) / seconds_per_point))
+		return max(0, budget)
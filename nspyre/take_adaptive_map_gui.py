@@ -0,0 +1,269 @@
+"""
+GUI element for running AdaptiveMapMeasurement.
+
+Same capture settings as SpectraPerXhairWidget, plus the map area and
+the refinement budget. Wavelength/grating are set with the other
+spectrometer widgets; this one just reads them (for the filenames).
+The map of the dataset being saved to ('map' as pushed after each
+stage) is shown as an image.
+
+A. Wellisz 2025-10
+"""
+
+from nspyre import ExperimentWidget, experiment_widget_process_queue
+import pyqtgraph as pg
+from pyqtgraph import SpinBox
+from pyqtgraph.Qt import QtWidgets, QtCore
+import logging
+import numpy as np
+
+import experiments.Spectra.take_adaptive_map
+from experiments.Spectra.dataset_watcher import DatasetWatcher
+from experiments.Spectra.horiba_worker import HoribaWorker, last_known_info
+
+_logger = logging.getLogger(__name__)
+
+
+class AdaptiveMapWidget(ExperimentWidget):
+	def __init__(self):
+
+		top_layout = QtWidgets.QVBoxLayout()
+		self.spec_lbl = QtWidgets.QLabel("Spectrometer: --")
+		top_layout.addWidget(self.spec_lbl)
+		self.status_lbl = QtWidgets.QLabel("Status: --")
+		self.status_lbl.setWordWrap(True)
+		top_layout.addWidget(self.status_lbl)
+
+		# rasterized map, rows = y (see SparseMap.rasterize)
+		self.map_widget = pg.PlotWidget(title="Map")
+		self.map_widget.setLabel('bottom', 'FSM x')
+		self.map_widget.setLabel('left', 'FSM y')
+		self.map_widget.setAspectLocked(True)
+		self.map_image = pg.ImageItem(axisOrder='row-major')
+		self.map_image.setLookupTable(pg.colormap.get('viridis').getLookupTable(nPts=256))
+		self.map_widget.addItem(self.map_image)
+		top_layout.addWidget(self.map_widget)
+
+		gain_combo = QtWidgets.QComboBox()
+		gain_combo.addItems(["High Light", "Best Dynamic", "High Sens.", "Ultimate Sens."])
+		gain_combo.setCurrentText("Ultimate Sens.")
+
+		adc_combo = QtWidgets.QComboBox()
+		# NB: the leading space in " 50 kHz HS" is intentional
+		adc_combo.addItems([" 50 kHz HS", "1.00 MHz HS", "3.00 MHz HS"])
+		adc_combo.setCurrentText(" 50 kHz HS")
+
+		fit_combo = QtWidgets.QComboBox()
+		fit_combo.addItems(["None", "Lorentzian", "Gaussian", "Voigt"])
+
+		decomposition_combo = QtWidgets.QComboBox()
+		decomposition_combo.addItems(["None", "PCA", "NMF"])
+
+		push_spectra_checkbox = QtWidgets.QCheckBox()
+		push_spectra_checkbox.setChecked(True)
+
+		dataset_edit = QtWidgets.QLineEdit("adaptive_map0")
+
+		params_config = {
+			"dataset": {
+				"display_text": "Save dataset",
+				"widget": dataset_edit,
+			},
+			"folder": {
+				"display_text": "Save Folder",
+				"widget": QtWidgets.QLineEdit("C:\\Data\\scratch"),
+			},
+			"filename": {
+				"display_text": "Filename",
+				"widget": QtWidgets.QLineEdit("%gg_%ts_%wnm_point%n")
+			},
+			# map area (FSM coordinates)
+			"x_min": {
+				"display_text": "X min",
+				"widget": SpinBox(value=-1.0, dec=True),
+			},
+			"x_max": {
+				"display_text": "X max",
+				"widget": SpinBox(value=1.0, dec=True),
+			},
+			"y_min": {
+				"display_text": "Y min",
+				"widget": SpinBox(value=-1.0, dec=True),
+			},
+			"y_max": {
+				"display_text": "Y max",
+				"widget": SpinBox(value=1.0, dec=True),
+			},
+			# refinement (see adaptive_map.py)
+			"coarse_nx": {
+				"display_text": "Coarse grid X",
+				"widget": SpinBox(value=8, int=True, bounds=(1, 1000), dec=True),
+			},
+			"coarse_ny": {
+				"display_text": "Coarse grid Y",
+				"widget": SpinBox(value=8, int=True, bounds=(1, 1000), dec=True),
+			},
+			"max_depth": {
+				"display_text": "Max. refinements",
+				"widget": SpinBox(value=3, int=True, bounds=(0, 10)),
+			},
+			"max_points": {
+				"display_text": "Max. points",
+				"widget": SpinBox(value=500, int=True, bounds=(1, 1_000_000), dec=True),
+			},
+			"time_budget_s": {
+				"display_text": "Time budget (0 = none)",
+				"widget": SpinBox(value=0, suffix="s", siPrefix=True, bounds=(0, None), dec=True),
+			},
+			"threshold": {
+				"display_text": "Refine threshold",
+				"widget": SpinBox(value=0.25, bounds=(0, 1), step=0.05),
+			},
+			"change_weight": {
+				"display_text": "Weight of spectral change",
+				"widget": SpinBox(value=0.5, bounds=(0, 1), step=0.1),
+			},
+			# capture settings
+			"exposure_s": {
+				"display_text": "Exp. Time",
+				"widget": SpinBox(value=1.0, suffix="s", siPrefix=True, bounds=(0.0, 3600), dec=True),
+			},
+			"gain": {
+				"display_text": "Gain",
+				"widget": gain_combo,
+			},
+			"adc": {
+				"display_text": "ADC",
+				"widget": adc_combo,
+			},
+			# ROI (SynapsePlus sensor: x=1–2048, y=1–512)
+			"xstart": {
+				"display_text": "X start (px)",
+				"widget": SpinBox(value=1, int=True, bounds=(1, 2048), dec=True),
+			},
+			"xend": {
+				"display_text": "X end (px)",
+				"widget": SpinBox(value=2048, int=True, bounds=(1, 2048), dec=True),
+			},
+			"ystart": {
+				"display_text": "Y start (px)",
+				"widget": SpinBox(value=116, int=True, bounds=(1, 512), dec=True),
+			},
+			"yend": {
+				"display_text": "Y end (px)",
+				"widget": SpinBox(value=136, int=True, bounds=(1, 512), dec=True),
+			},
+			# hardware binning
+			"xbin": {
+				"display_text": "X bin",
+				"widget": SpinBox(value=1, int=True, bounds=(1, 2048), dec=True),
+			},
+			"ybin": {
+				"display_text": "Y bin",
+				"widget": SpinBox(value=512, int=True, bounds=(1, 512), dec=True),
+			},
+			"fit_model": {
+				"display_text": "Peak fit",
+				"widget": fit_combo,
+			},
+			"summary_windows": {
+				"display_text": "Summary windows (nm)",
+				"widget": QtWidgets.QLineEdit(""),
+			},
+			"push_spectra": {
+				"display_text": "Push full spectra",
+				"widget": push_spectra_checkbox,
+			},
+			# baseline removal before summaries/fits (0 = off, see baseline.py)
+			"baseline_lambda": {
+				"display_text": "Baseline stiffness (0 = off)",
+				"widget": SpinBox(value=0, bounds=(0, None), dec=True),
+			},
+			# streaming decomposition + clustering (see spectra_decomposition.py)
+			"decomposition": {
+				"display_text": "Decomposition",
+				"widget": decomposition_combo,
+			},
+			"n_components": {
+				"display_text": "Components",
+				"widget": SpinBox(value=3, int=True, bounds=(1, 50)),
+			},
+			"n_clusters": {
+				"display_text": "Clusters",
+				"widget": SpinBox(value=4, int=True, bounds=(1, 50)),
+			},
+		}
+
+		self.fun_kwargs = {
+			'wavelength': 0,
+			'grating': 0,
+		}
+
+		info = last_known_info()
+		if info is not None:
+			self.apply_info(info)
+
+		super().__init__(
+			params_config = params_config,
+			module = experiments.Spectra.take_adaptive_map,
+			cls = 'AdaptiveMapMeasurement',
+			fun_name = 'take_adaptive_map',
+			title="Adaptive Map",
+			layout=top_layout,
+			fun_kwargs=self.fun_kwargs,
+		)
+
+		self._timer = QtCore.QTimer(self)
+		self._timer.timeout.connect(self.check_status_queue)
+		self._timer.start(50) # check every 50 ms
+
+		self.worker = HoribaWorker()
+		self.worker.info_ready.connect(self.apply_info)
+		self.worker.failed.connect(lambda msg: self.status_lbl.setText(f"Status: {msg}"))
+		QtWidgets.QApplication.instance().aboutToQuit.connect(self.worker.stop)
+		self.worker.refresh()
+
+		# Follow the dataset in the background, the map only changes once per stage
+		self.watcher = DatasetWatcher(keys=('map',))
+		self.watcher.updated.connect(self.on_dataset_update)
+		self.watcher.failed.connect(lambda msg: self.status_lbl.setText(f"Status: {msg}"))
+		QtWidgets.QApplication.instance().aboutToQuit.connect(self.watcher.stop)
+		dataset_edit.editingFinished.connect(lambda: self.watch_dataset(dataset_edit.text().strip()))
+		self.watch_dataset(dataset_edit.text().strip())
+
+	def apply_info(self, info):
+		"""Wavelength/grating for the filenames, from the spectrometer info"""
+		try:
+			center = info.get("center", info.get("wavelength"))
+			cg = info.get("current_grating")
+			self.spec_lbl.setText(f"Spectrometer: {center:.2f} nm, {int(cg)} g/mm")
+			self.fun_kwargs = {
+				'wavelength': round(center, 1),
+				'grating': int(cg),
+			}
+		except Exception as e:
+			self.spec_lbl.setText(f"Spectrometer: failed to get info: {e}")
+
+	def watch_dataset(self, dataset):
+		self.map_image.clear()
+		self.map_widget.setTitle("Map")
+		self.watcher.watch(dataset)
+
+	def on_dataset_update(self, values):
+		raster = values.get('map')
+		if not raster:
+			return
+		image = np.asarray(raster['image'], dtype=float)
+		if not np.isfinite(image).any():
+			return
+		# NaN (not measured yet) is drawn transparent
+		self.map_image.setImage(image, autoLevels=False, levels=(np.nanmin(image), np.nanmax(image)))
+		x0, x1, y0, y1 = raster['extent']
+		self.map_image.setRect(QtCore.QRectF(x0, y0, x1 - x0, y1 - y0))
+		self.map_widget.setTitle(f"Map ({raster.get('field', 'signal')})")
+
+	def check_status_queue(self):
+		msg = experiment_widget_process_queue(self.queue_from_exp)
+		if not msg:
+			return
+		self.status_lbl.setText(f"Status: {msg}")
@@ -1,13 +1,15 @@
 # take single spectrum experiment
 
-from nspyre import InstrumentGateway
 from nspyre import DataSink, DataSource, StreamingList, experiment_widget_process_queue, nspyre_init_logger
 
 import logging
 from pathlib import Path
 import numpy as np
 from rpyc.utils.classic import obtain
-import os 
+
+from experiments.Spectra.spectra_files import format_filename, unpack_array
+from experiments.Spectra.spectra_catalog import SpectraCatalog
+from experiments.Spectra.gateway_session import shared_session
 
 _HERE = Path(__file__).parent
 _logger = logging.getLogger(__name__)
@@ -53,13 +55,17 @@ class SingleSpectraMeasurement:
 		g = kwargs.get('grating')
 		n = 1 # TODO: IMPLEMENT FILE NUMBERING
 
-		filename_params = filename.replace('%g', str(g)).replace('%t', str(exposure_s)).replace('%n', str(n)).replace('%w', str(w))
+		filename_params = format_filename(filename, grating=g, exposure_s=exposure_s, wavelength=w, n=n)
 		full_path = folder + '\\' + filename_params + '.txt'
 
 		try:
-			with InstrumentGateway() as gw, DataSource(dataset) as ds:
+			# Reuses this process' instrument server connection if there already is one
+			gw = shared_session().gateway()
+			with DataSource(dataset) as ds:
 
-				gw.horiba.capture_spectrum(
+				# Run the acquisition as a job on the instrument server so that no single
+				# RPyC call has to last as long as the exposure (RPYC_SYNC_TIMEOUT)
+				job_id = gw.horiba.start_capture(
 					exposure_s=exposure_s,
 					outfile=full_path,
 					spectra=True,
@@ -68,16 +74,28 @@ class SingleSpectraMeasurement:
 					xstart=xstart, xend=xend,
 					ystart=ystart, yend=yend,
 					xbin=xbin, ybin=ybin,
+					return_data=True,
 				)
-
-				# Data gets saved to a file, so read it to also push to dataserv
-				# For some reason the JY SDK always adds _0001_AREA1_1, rename first
-				full_path_JY = full_path[:-len('.txt')] + '_0001_AREA1_1.txt'
-				os.rename(full_path_JY, full_path)
-
-				data_arr = np.loadtxt(full_path, delimiter = '\t')
+				while not gw.horiba.wait(job_id, timeout=5):
+					pass
+				# The instrument server saves the file (without the _0001_AREA1_1 the
+				# JY SDK adds) and also sends the data back, so we don't have to read it
+				data_arr = unpack_array(gw.horiba.result(job_id))
 				wavelengths = data_arr[:,0]
 				counts = data_arr[:,1]
+				# The driver sets the y range of the ROI itself; record the one it actually used
+				xstart, xend, ystart, yend = obtain(gw.horiba.capture_roi(xstart, xend, ystart, yend))
+
+				# Record the acquisition in the spectra catalog (failing to do so shouldn't lose the data)
+				try:
+					SpectraCatalog().add(
+						full_path, counts=counts,
+						experiment='SingleSpectraMeasurement', dataset=dataset,
+						grating=g, wavelength=w, exposure_s=exposure_s, gain=gain, adc=adc,
+						xstart=xstart, xend=xend, ystart=ystart, yend=yend, xbin=xbin, ybin=ybin,
+					)
+				except Exception as e:
+					_logger.warning(f"Could not add {full_path} to the spectra catalog: {e}")
 
 				
 				spectrum_data = StreamingList()
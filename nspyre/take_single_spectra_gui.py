@@ -5,13 +5,14 @@ A. Wellisz 2025-10
 """
 
 
-from nspyre import InstrumentGateway, ExperimentWidget, experiment_widget_process_queue
-from pyqtgraph import SpinBox
-from pyqtgraph.Qt import QtWidgets, QtCore
+from nspyre import ExperimentWidget, experiment_widget_process_queue
+from pyqtgraph import SpinBox, PlotWidget
+from pyqtgraph.Qt import QtWidgets, QtCore, QtGui
 import logging
 from nspyre import FlexLinePlotWidget
 
 import experiments.Spectra.take_single_spectra
+from experiments.Spectra.horiba_worker import HoribaWorker, last_known_info
 
 _logger = logging.getLogger(__name__)
 
@@ -24,6 +25,7 @@ class SpectrometerWidget(ExperimentWidget):
 		self.status_lbl = QtWidgets.QLabel("Status: --")
 		self.status_lbl.setWordWrap(True)
 		top_wl_gr_widget.addWidget(self.status_lbl)
+		top_wl_gr_widget.addLayout(self.create_live_widget())
 
 		self.num_spectra = 0
 
@@ -63,9 +65,8 @@ class SpectrometerWidget(ExperimentWidget):
 			# capture settings
 			"exposure_s": {
 				"display_text": "Exp. Time",
-				# Max time must be less than RPYC_SYNC_TIMEOUT 
-				# Set RPYC_SYNC_TIMEOUT higher if necessary in nspyre.instrument.server
-				"widget": SpinBox(value=1.0, suffix="s", siPrefix=True, bounds=(0.0, 300), dec=True),
+				# Captures run as jobs on the instrument server, so this isn't limited by RPYC_SYNC_TIMEOUT
+				"widget": SpinBox(value=1.0, suffix="s", siPrefix=True, bounds=(0.0, 3600), dec=True),
 			},
 			"gain": {
 				"display_text": "Gain",
@@ -110,7 +111,11 @@ class SpectrometerWidget(ExperimentWidget):
 			'grating': 0,
 		}
 
-		self.refresh_info()
+		# Show the last known state right away; the actual refresh happens in the background
+		info = last_known_info()
+		if info is not None:
+			self.apply_info(info)
+			self.status_lbl.setText("Status: Showing last known spectrometer info, refreshing...")
 
 		super().__init__(
 			params_config = params_config,
@@ -127,6 +132,18 @@ class SpectrometerWidget(ExperimentWidget):
 		self._timer.timeout.connect(self.check_status_queue)
 		self._timer.start(50) # check every 100 ms
 
+		# All hardware calls go through a background thread, so the GUI never waits on the CLI
+		self.worker = HoribaWorker()
+		self.worker.info_ready.connect(self.apply_info)
+		self.worker.move_progress.connect(self.on_move_progress)
+		self.worker.move_finished.connect(self.on_move_finished)
+		self.worker.failed.connect(self.on_worker_failed)
+		self.worker.live_frame.connect(self.on_live_frame)
+		self.worker.live_status.connect(self.live_lbl.setText)
+		self.worker.live_stopped.connect(self.on_live_stopped)
+		QtWidgets.QApplication.instance().aboutToQuit.connect(self.worker.stop)
+		self.refresh_info()
+
 
 	def create_wl_gr_widget(self):
 
@@ -162,6 +179,11 @@ class SpectrometerWidget(ExperimentWidget):
 		self.gr_set_btn = QtWidgets.QPushButton("Set Grating")
 		self.gr_set_btn.clicked.connect(self.on_set_grating)
 		gr_layout.addWidget(self.gr_set_btn)
+
+		self.cancel_move_btn = QtWidgets.QPushButton("Cancel Move")
+		self.cancel_move_btn.setEnabled(False)
+		self.cancel_move_btn.clicked.connect(self.on_cancel_move)
+		gr_layout.addWidget(self.cancel_move_btn)
 		gr_layout.addStretch(1)
 
 		layout.addLayout(wl_layout)
@@ -170,77 +192,160 @@ class SpectrometerWidget(ExperimentWidget):
 
 		return layout
 
+	def create_live_widget(self):
+		"""Live view controls + plot (for focusing/alignment)"""
+		layout = QtWidgets.QVBoxLayout()
 
-	def refresh_info(self):
-		try:
+		live_layout = QtWidgets.QHBoxLayout()
+		live_layout.addWidget(QtWidgets.QLabel("Live exp.:"))
+		self.live_exp_spin = SpinBox(value=0.05, suffix="s", siPrefix=True, bounds=(0.001, 10), dec=True)
+		self.live_exp_spin.setFixedWidth(120)
+		live_layout.addWidget(self.live_exp_spin)
+
+		self.live_btn = QtWidgets.QPushButton("Start Live")
+		self.live_btn.setCheckable(True)
+		self.live_btn.toggled.connect(self.on_live_toggled)
+		live_layout.addWidget(self.live_btn)
+
+		self.live_lbl = QtWidgets.QLabel("")
+		live_layout.addWidget(self.live_lbl)
+		live_layout.addStretch(1)
+
+		self.live_plot = PlotWidget()
+		self.live_plot.setLabel('bottom', 'Wavelength (nm)')
+		self.live_plot.setLabel('left', 'Counts')
+		self.live_curve = self.live_plot.plot([], [])
+		self.live_plot.hide()
+
+		layout.addLayout(live_layout)
+		layout.addWidget(self.live_plot)
+
+		# Poll for frames at most once per screen refresh; frames arriving faster than that are skipped
+		refresh_hz = QtGui.QGuiApplication.primaryScreen().refreshRate() or 60
+		self._live_poll_ms = int(1000 / refresh_hz)
+		self._live_running = False
+
+		return layout
+
+	def on_live_toggled(self, checked):
+		if checked:
+			self.start_live()
+		else:
+			self.stop_live()
+
+	def start_live(self):
+		params = self.params_widget.all_params()
+		self.worker.start_live(
+			self._live_poll_ms,
+			exposure_s=self.live_exp_spin.value(),
+			gain=params['gain'], adc=params['adc'],
+			xstart=int(params['xstart']), xend=int(params['xend']),
+			ystart=int(params['ystart']), yend=int(params['yend']),
+			xbin=int(params['xbin']), ybin=int(params['ybin']),
+		)
+		self._live_running = True
+		self.live_plot.show()
+		self.live_btn.setText("Stop Live")
+		self.status_lbl.setText("Status: Starting live view...")
+
+	def stop_live(self):
+		if not self._live_running:
+			return
+		self._live_running = False
+		self.live_btn.setText("Start Live")
+		self.worker.stop_live()
+
+	def on_live_frame(self, wavelengths, counts):
+		self.live_curve.setData(wavelengths, counts)
 
-			with InstrumentGateway() as gw:
-				horiba = gw.horiba
-				info = horiba.get_spec_info()
+	def on_live_stopped(self, msg):
+		"""Live view was stopped (by us or the driver) or failed to start"""
+		self.status_lbl.setText(f"Status: {msg}")
+		if self._live_running:
+			self._live_running = False
+			self.live_btn.setText("Start Live")
+			self.live_btn.setChecked(False)
+		self.live_lbl.setText("")
 
-				# print(info)
 
-				wl = info.get("wavelength")
-				wl_start = info.get("wl_start")
-				wl_end = info.get("wl_end")
+	def refresh_info(self):
+		"""Ask the worker for fresh spectrometer info (result arrives in apply_info)"""
+		self.status_lbl.setText("Status: Refreshing spectrometer info...")
+		self.worker.refresh()
+
+	def apply_info(self, info):
+		try:
+			wl = info.get("wavelength")
+			wl_start = info.get("wl_start")
+			wl_end = info.get("wl_end")
+			# Actual center from the driver's dispersion model (the SDK wavelength is offset)
+			wl_true_center = info.get("center")
+			has_range = wl_start is not None and wl_end is not None
+			if wl_true_center is None and has_range:
 				wl_true_center = (wl_start + wl_end)/2
 
-				if wl is not None:
-					self.wl_value_lbl.setText(f"Center: {wl_true_center:.3f} | Range: {wl_start:.2f}-{wl_end:.2f}")
-					#self.wl_set_spin.setValue(float(wl))
-
-				cg = info.get("current_grating")
-				self.grating = cg
-				if cg is not None:
-					self.gr_value_lbl.setText(str(int(cg)))
-
-				# populate grating options
-				self.gr_combo.clear()
-				grs = info.get("gratings", [])
-				for g in grs:
-					self.gr_combo.addItem(str(int(g)))
-				# select current grating in dropdown
-				if cg is not None:
-					idx = self.gr_combo.findText(str(int(cg)))
-					if idx >= 0:
-						self.gr_combo.setCurrentIndex(idx)
-
-				# These kwargs are passed into the experiment just for naming purposes,
-				# so nominal wavelength is fine? (off by up to ~0.2 nm)
-				self.fun_kwargs = {
-					'wavelength': self.wl_set_spin.value(),
-					'grating': int(cg),
-				}
-
-				self.status_lbl.setText("Status: Spectrometer info loaded.")
+			if wl is not None:
+				center_text = f"{wl_true_center:.3f}" if wl_true_center is not None else f"{wl:.3f} (nominal)"
+				range_text = f"{wl_start:.2f}-{wl_end:.2f}" if has_range else "--"
+				self.wl_value_lbl.setText(f"Center: {center_text} | Range: {range_text}")
+				#self.wl_set_spin.setValue(float(wl))
+
+			cg = info.get("current_grating")
+			self.grating = cg
+			if cg is not None:
+				self.gr_value_lbl.setText(str(int(cg)))
+
+			# populate grating options
+			self.gr_combo.clear()
+			grs = info.get("gratings", [])
+			for g in grs:
+				self.gr_combo.addItem(str(int(g)))
+			# select current grating in dropdown
+			if cg is not None:
+				idx = self.gr_combo.findText(str(int(cg)))
+				if idx >= 0:
+					self.gr_combo.setCurrentIndex(idx)
+
+			# These kwargs are passed into the experiment just for naming purposes,
+			# so nominal wavelength is fine? (off by up to ~0.2 nm)
+			self.fun_kwargs = {
+				'wavelength': self.wl_set_spin.value(),
+				'grating': int(cg),
+			}
+
+			self.status_lbl.setText("Status: Spectrometer info loaded.")
 		except Exception as e:
 			self.status_lbl.setText(f"Status: Failed to get info: {e}")
 
 	def on_set_wavelength(self):
-		try:
-			wl = float(self.wl_set_spin.value())
+		wl = float(self.wl_set_spin.value())
+		self.set_moving(True)
+		self.worker.move(wavelength=wl)
 
-			with InstrumentGateway() as gw:
-				gw.horiba.set_spec_wavelength(wl)
+	def on_set_grating(self):
+		gr = self.gr_combo.currentText()
+		self.set_moving(True)
+		self.worker.move(grating=gr)
 
-			self.status_lbl.setText(f"Status: Wavelength set to {wl:.3f} nm.")
-			self.refresh_info()
-		except Exception as e:
-			self.status_lbl.setText(f"Error setting wavelength: {e}")
+	def on_cancel_move(self):
+		self.worker.cancel()
 
-	# TODO: MAKE THIS THREADED, OR MAYBE MAKE IT AN EXPERIMENT EXPLICITLY?
-	# FOR NOW THIS FREEZES NSPYRE
-	def on_set_grating(self):
-		try:
-			gr = self.gr_combo.currentText()
+	def set_moving(self, moving):
+		"""Only one move at a time (cancel is only available during one)"""
+		self.wl_set_btn.setEnabled(not moving)
+		self.gr_set_btn.setEnabled(not moving)
+		self.cancel_move_btn.setEnabled(moving)
 
-			with InstrumentGateway() as gw:
-				gw.horiba.set_spec_grating(gr)
-				
-			self.status_lbl.setText(f"Status: Grating set to {gr} g/mm.")
-			self.refresh_info()
-		except Exception as e:
-			self.status_lbl.setText(f"Error setting grating: {e}")
+	def on_move_progress(self, msg):
+		self.status_lbl.setText(f"Status: {msg}")
+
+	def on_move_finished(self, msg):
+		self.set_moving(False)
+		self.status_lbl.setText(f"Status: {msg}")
+
+	def on_worker_failed(self, msg):
+		self.set_moving(False)
+		self.status_lbl.setText(f"Status: {msg}")
 
 	def check_status_queue(self):
 		# Checks the queue from the experiment, built into ExperimentWidget
@@ -3,31 +3,46 @@ Takes one spectrum for each crosshair in a list of crosshairs.
 A. Wellisz 2025-10
 
 Limitations:
-	- Maximum integration time is limited by RPYC_SYNC_TIMEOUT which 
-	  has to be manually changed in nspyre/instrument/server.py. (For 
-	  some reason setting sync_timeout in the inserv constructor doesn't 
-	  work). Current max is 300 s (5 min). 
 	- You can't add xhairs mid-experiment (a local copy of existing xhairs
 	  in the given dataset is created at the start of the experiment).
 	- You can stop the experiment, but it will only stop after the
 	  current acquisition is finished.
+	  (Progress is checkpointed in <folder>/<dataset>_scan.json, so a
+	  stopped or failed scan can be continued with resume=True.)
 	- Uses hardcoded fsm1 to move between xhairs
 
 See drivers/horiba/horiba_driver.py to see limitations of the driver.
 """
 
-from nspyre import DataSink, DataSource, StreamingList, InstrumentGateway
+from nspyre import DataSink, DataSource, StreamingList
 from nspyre import experiment_widget_process_queue, nspyre_init_logger
 
 import os
+import time
 import logging
+from contextlib import contextmanager
 from pathlib import Path
 import numpy as np
 from rpyc.utils.classic import obtain
 
+from experiments.Spectra.spectra_files import format_filename, unpack_array, read_spectrum_file
+from experiments.Spectra.spectra_catalog import SpectraCatalog
+from experiments.Spectra.scan_monitor import ScanMonitor
+from experiments.Spectra.peak_fitting import fit_peaks
+from experiments.Spectra.gateway_session import shared_session
+from experiments.Spectra.scan_manifest import ScanManifest
+from experiments.Spectra.scan_order import MoveCost, travel_order
+from experiments.Spectra.spectra_reduction import SpectrumReducer, parse_windows
+from experiments.Spectra.baseline import BaselineRemover
+from experiments.Spectra.spectra_decomposition import SpectraDecomposition
+
 _HERE = Path(__file__).parent
 _logger = logging.getLogger(__name__)
 
+# How many times a failed acquisition is retried before giving up on the scan
+CAPTURE_RETRIES = 2
+RETRY_DELAY_S = 2
+
 class SpectraPerXhairMeasurement:
 
 	def __init__(self, queue_to_exp=None, queue_from_exp=None):
@@ -55,6 +70,15 @@ class SpectraPerXhairMeasurement:
 		xstart: int, xend: int,
 		ystart: int, yend: int,
 		xbin: int, ybin: int,
+		fit_model: str = 'None',
+		summary_windows: str = '',
+		push_spectra: bool = True,
+		resume: bool = False,
+		optimize_order: bool = False,
+		baseline_lambda: float = 0,
+		decomposition: str = 'None',
+		n_components: int = 3,
+		n_clusters: int = 4,
 		**kwargs):
 		"""
 		Takes 1 spectrum per xhair in a given xhair dataset.
@@ -68,23 +92,98 @@ class SpectraPerXhairMeasurement:
 		adc: adc setting
 		x/y start/end: start and end values for CCD ROI
 		x/y bin: binning (should be ybin=512 for spectra)
+		fit_model: peak model to fit to each spectrum as it arrives ('None', 'Lorentzian',
+			'Gaussian' or 'Voigt', see peak_fitting.py); results are pushed as
+			peak_center/peak_fwhm/peak_amplitude vs. xhair number
+		summary_windows: wavelength windows (e.g. '730-740, 750-760') to integrate the
+			counts over; if given (or if push_spectra is False), the integrals, peak
+			position and peak height are pushed as summary_<name> vs. xhair number
+			(see spectra_reduction.py)
+		push_spectra: if False, only the summaries are pushed to the dataserver (the
+			full spectra are still saved to `folder`), which keeps dense scans light
+		resume: continue the scan from its checkpoint (<folder>/<dataset>_scan.json)
+			instead of starting over. The settings have to match the original run;
+			completed xhairs are re-pushed from their files and skipped
+		optimize_order: visit the xhairs in a short path (see scan_order.py), weighted by
+			the FSM move times measured in past scans if there are enough, instead of in
+			label order. Spectra are still saved/pushed under their labels
+		baseline_lambda: if > 0, remove a smooth baseline with this stiffness (see
+			baseline.py) before the summaries and peak fits. The spectra are still
+			saved/pushed as acquired
+		decomposition: 'PCA' or 'NMF' to update a decomposition into n_components
+			components after each spectrum and sort the spectra into at most n_clusters
+			clusters (see spectra_decomposition.py). The scores and cluster of each
+			spectrum are pushed as pca_score1, ..., pca_cluster (nmf_...) vs. xhair
+			number, and 'clusters' holds (fsm x, fsm y, cluster) of every xhair so far
+			(shown by the clusters view of the spectra viewer).
+			The final decomposition is saved to <folder>/<dataset>_<pca|nmf>.npz
 		kwargs: should include wavelength + grating info for filename
 		"""
 
-		local_xhairs = self.get_copy_of_xhairs(xhairs)
-		num_xhairs = len(local_xhairs)
-
-		print(f"DEBUG: {num_xhairs} found")
-
 		w = kwargs.get('wavelength')
 		g = kwargs.get('grating')
 
 		# make the destination folder if it doesn't exist yet
 		os.makedirs(folder, exist_ok=True)
 
-		# connect to instrument server
+		catalog = self.open_catalog()
+
+		# shared instrument server connection (reconnects if it drops mid-scan)
+		session = shared_session()
+		# The driver sets the y range of the ROI itself; record the one it actually uses
+		xstart, xend, ystart, yend = self.get_capture_roi(session, xstart, xend, ystart, yend)
+
+		# Settings that determine how long each point takes (for the timing log / ETA)
+		timing_settings = {
+			'experiment': 'SpectraPerXhairMeasurement', 'exposure_s': exposure_s, 'gain': gain, 'adc': adc,
+			'xstart': xstart, 'xend': xend, 'ystart': ystart, 'yend': yend, 'xbin': xbin, 'ybin': ybin,
+		}
+
+		# Checkpoint, so a stopped/failed scan can be resumed (see scan_manifest.py)
+		manifest_path = os.path.join(folder, f'{dataset}_scan.json')
+		scan_settings = dict(timing_settings, xhairs=xhairs, dataset=dataset, filename=filename,
+							 wavelength=w, grating=g)
+		hardware = self.get_hardware_state(session)
+		if resume and os.path.exists(manifest_path):
+			manifest = ScanManifest.load(manifest_path)
+			try:
+				manifest.validate(scan_settings, hardware)
+			except ValueError as e:
+				self.queue_from_exp.put_nowait(f"Can't resume: {e}")
+				return
+			# Same xhairs as the original run, even if the xhair dataset changed since
+			local_xhairs = manifest.points
+		else:
+			local_xhairs = self.get_copy_of_xhairs(xhairs)
+			points = {label: {'cord': [float(c) for c in xhair['cord']]} for label, xhair in local_xhairs.items()}
+			manifest = ScanManifest.create(manifest_path, scan_settings, points, hardware)
+		num_xhairs = len(local_xhairs)
+		num_remaining = num_xhairs - len(manifest.completed)
+
+		_logger.info(f"{num_xhairs} xhairs found, {num_remaining} to go")
+
+		per_point_estimate_s = None
+		if catalog is not None:
+			try:
+				per_point_estimate_s = catalog.estimate_point_time(**timing_settings)
+			except Exception as e:
+				_logger.warning(f"Could not estimate time per point from the catalog: {e}")
+		monitor = ScanMonitor(num_remaining, exposure_s, per_point_estimate_s)
+
+		visit_order = self.get_visit_order(local_xhairs, manifest, catalog, optimize_order)
+
+		reducer = None
+		if summary_windows.strip() or not push_spectra:
+			reducer = SpectrumReducer(parse_windows(summary_windows))
+		baseline = BaselineRemover(lam=baseline_lambda) if baseline_lambda > 0 else None
+		decomposer = None
+		if decomposition != 'None':
+			decomposer = SpectraDecomposition(decomposition, n_components, n_clusters)
+		# (fsm x, fsm y, cluster) of each xhair, for coloring the xhairs by cluster
+		cluster_points = []
+
 		# connect to data server + create/connect to spectra data set
-		with InstrumentGateway() as gw, DataSource(dataset) as spec_data:
+		with DataSource(dataset) as spec_data, self.acquisition_session(session, f"the xhair scan '{dataset}'"):
 
 			# A dictionary that will contain all spectrometer datasets within it.
 			# Each key corresponds to a crosshair
@@ -100,65 +199,108 @@ class SpectraPerXhairMeasurement:
 				'datasets': spec_xhair_datasets
 			})
 
-			# For each xhair, move to the xhair and take 1 spectrum
+			# Show the xhairs done by a previous run of this scan again (from their files)
 			for n in range(num_xhairs):
+				xhair_label = 'cross' + str(n+1).zfill(3)
+				if not manifest.is_done(xhair_label):
+					continue
+				try:
+					data_arr = read_spectrum_file(manifest.completed[xhair_label]['path'])
+				except OSError as e:
+					_logger.warning(f"Could not reload {xhair_label} of the resumed scan: {e}")
+					continue
+				_, _, analysis = self.add_point_data(spec_xhair_datasets, n+1, xhair_label, data_arr,
+													 push_spectra, reducer, fit_model, baseline, decomposer)
+				if 'cluster' in analysis:
+					cluster_points.append((*local_xhairs[xhair_label]['cord'], analysis['cluster']))
+			if manifest.completed:
+				spec_data.push({
+					'params': {'exposure_s': exposure_s, 'gain': gain, 'adc': adc, 'roi': (xstart, xend, ystart, yend), 'bin': (xbin, ybin)},
+					'title': 'Spectrum per crosshair',
+					'xlabel': 'Wavelength (nm)',
+					'ylabel': 'Counts',
+					'datasets': spec_xhair_datasets,
+					'clusters': np.array(cluster_points, dtype=float).reshape(-1, 3),
+				})
+
+			# For each xhair, move to the xhair and take 1 spectrum
+			previous_coords = None
+			for n in visit_order:
 
-				# stop if GUI asks us to (NB: can only happen between acquisitions, not during one!)
-				if experiment_widget_process_queue(self.queue_to_exp) == 'stop':
-					return
-				
 				# cross001, cross002, etc
 				#xhair_label = f'cross{n+1:03d}'
 				xhair_label = 'cross' + str(n+1).zfill(3)
-				self.queue_from_exp.put_nowait(f"Running acquisition ({xhair_label})...")
+
+				# stop if GUI asks us to (NB: can only happen between acquisitions, not during one!)
+				if experiment_widget_process_queue(self.queue_to_exp) == 'stop':
+					self.queue_from_exp.put_nowait(f"Stopped before {xhair_label}. Run with 'Resume' to continue.")
+					self.save_decomposition(decomposer, folder, dataset)
+					return
+
+				self.queue_from_exp.put_nowait(f"Running acquisition ({xhair_label})... {monitor.status()}")
 				# coords is a 2-element list
 				coords = local_xhairs[xhair_label]['cord']
 
+				monitor.start_point()
+				gw = session.gateway()
+
 				# Move FSM to the xhair
 				# TODO: ADD DROPDOWN TO SELECT FSM?
 				gw.fsm1.move((coords[0], coords[1]))
+				monitor.moved()
+				move_distance = None if previous_coords is None else float(np.hypot(
+					coords[0] - previous_coords[0], coords[1] - previous_coords[1]))
+				previous_coords = coords
 
 				# Prepare filename for saving
-				filename_with_params = (filename
-										.replace('%g', str(g))
-										.replace('%t', str(exposure_s))
-										.replace('%n', str(n+1))
-										.replace('%w', str(w)))
+				filename_with_params = format_filename(filename, grating=g, exposure_s=exposure_s, wavelength=w, n=n+1)
 				
 				full_path = folder + '\\' + filename_with_params + '.txt'
 
 				# Take one spectrum with the given settings
-				gw.horiba.capture_spectrum(
-					exposure_s=exposure_s,
-					outfile=full_path,
-					spectra=True,
-					gain=gain,
-					adc=adc,
-					xstart=xstart, xend=xend,
-					ystart=ystart, yend=yend,
-					xbin=xbin, ybin=ybin,
-				)
-
-				# Data gets saved to a file, so we read it to also push to dataserv
-				# For some reason the JY SDK always adds _0001_AREA1_1; rename first
-				full_path_JY = full_path[:-len('.txt')] + '_0001_AREA1_1.txt'
-				os.rename(full_path_JY, full_path)
-
-				data_from_file = np.loadtxt(full_path, delimiter = '\t')
+				# The instrument server saves the file (without the _0001_AREA1_1 the
+				# JY SDK adds) and also sends the data back, so we don't have to read it
+				try:
+					data_from_file = self.acquire(
+						session, manifest, xhair_label,
+						exposure_s=exposure_s,
+						outfile=full_path,
+						spectra=True,
+						gain=gain,
+						adc=adc,
+						xstart=xstart, xend=xend,
+						ystart=ystart, yend=yend,
+						xbin=xbin, ybin=ybin,
+						return_data=True,
+					)
+				except Exception as e:
+					self.queue_from_exp.put_nowait(
+						f"Acquisition failed at {xhair_label} ({e}). Run with 'Resume' to continue from there.")
+					raise
 				wavelengths = data_from_file[:,0]
 				counts = data_from_file[:,1]
 				# Reshape to be what FlexLinePlot expects
 				data_arr = np.vstack([wavelengths, counts])
 
-				spec_xhair_dataset_name = f"spec_{xhair_label}"
-				if spec_xhair_dataset_name not in spec_xhair_datasets:
-					spec_xhair_datasets[spec_xhair_dataset_name] = StreamingList()
-				spec_xhair_datasets[spec_xhair_dataset_name].append(data_arr)
+				# Record the acquisition in the spectra catalog (failing to do so shouldn't stop the scan)
+				if catalog is not None:
+					try:
+						catalog.add(
+							full_path, counts=counts,
+							experiment='SpectraPerXhairMeasurement', dataset=dataset,
+							grating=g, wavelength=w, exposure_s=exposure_s, gain=gain, adc=adc,
+							xstart=xstart, xend=xend, ystart=ystart, yend=yend, xbin=xbin, ybin=ybin,
+							xhair=xhair_label, fsm_x=float(coords[0]), fsm_y=float(coords[1]),
+						)
+					except Exception as e:
+						_logger.warning(f"Could not add {full_path} to the spectra catalog: {e}")
 
-				# Maintain a 'latest' series for plotting
-				if 'latest' not in spec_xhair_datasets:
-					spec_xhair_datasets['latest'] = StreamingList()
-				spec_xhair_datasets['latest'].append(data_arr)
+				monitor.acquired()
+
+				_, _, analysis = self.add_point_data(spec_xhair_datasets, n+1, xhair_label, data_arr,
+													 push_spectra, reducer, fit_model, baseline, decomposer)
+				if 'cluster' in analysis:
+					cluster_points.append((coords[0], coords[1], analysis['cluster']))
 
 				spec_data.push({
 					'params': {
@@ -173,12 +315,204 @@ class SpectraPerXhairMeasurement:
 					'title': 'Spectrum',
 					'xlabel': 'Wavelength (nm)',
 					'ylabel': 'Counts',
-					'datasets': spec_xhair_datasets
+					'datasets': spec_xhair_datasets,
+					'clusters': np.array(cluster_points, dtype=float).reshape(-1, 3),
 				})
 
-		self.queue_from_exp.put_nowait(f"Acqusition on {num_xhairs} xhairs complete.")
+				timing = monitor.pushed()
+				_logger.debug(f"{xhair_label}: move {timing.move_s:.2f} s, exposure {timing.exposure_s:.2f} s, "
+							  f"overhead {timing.overhead_s:.2f} s, push {timing.push_s:.2f} s")
+				if catalog is not None:
+					try:
+						catalog.add_point_timing(timing.move_s, timing.overhead_s, timing.push_s, timing.total_s,
+												 move_distance=move_distance, **timing_settings)
+					except Exception as e:
+						_logger.warning(f"Could not log point timing to the spectra catalog: {e}")
+
+				manifest.mark_done(xhair_label, path=full_path, fsm=[float(coords[0]), float(coords[1])])
+
+		manifest.finish()
+		self.save_decomposition(decomposer, folder, dataset)
+		self.queue_from_exp.put_nowait(f"Acqusition on {num_xhairs} xhairs complete. {monitor.status()}")
 		return
+
+	@contextmanager
+	def acquisition_session(self, session, name: str):
+		"""
+		Keeps GUI moves/live view off the spectrometer while the scan runs
+		(see ACQUISITION SESSIONS in horiba_driver.py). Not being able to
+		start or end the session doesn't stop the scan.
+		"""
+		token = None
+		try:
+			token = session.gateway().horiba.begin_acquisition_session(name)
+		except Exception as e:
+			_logger.warning(f"Could not start the acquisition session: {e}")
+		try:
+			yield
+		finally:
+			if token is not None:
+				try:
+					session.gateway().horiba.end_acquisition_session(token)
+				except Exception as e:
+					_logger.warning(f"Could not end the acquisition session (it expires by itself): {e}")
+
+	def acquire(self, session, manifest: ScanManifest, xhair_label: str, **capture_kwargs):
+		"""
+		Takes one spectrum (kwargs as in Horiba.capture_spectrum) and returns
+		the data array. Failed attempts (e.g. a die() in the CLI, or a dropped
+		connection) are recorded in the manifest and retried up to
+		CAPTURE_RETRIES times. Every CLI run initializes the CCD from scratch,
+		so a retry also re-initializes it.
+		"""
+		for attempt in range(CAPTURE_RETRIES + 1):
+			job_id = None
+			try:
+				horiba = session.gateway().horiba
+				# Run the acquisition as a job on the instrument server so that no single
+				# RPyC call has to last as long as the exposure (RPYC_SYNC_TIMEOUT)
+				job_id = horiba.start_capture(**capture_kwargs)
+				while not horiba.wait(job_id, timeout=5):
+					pass
+				return unpack_array(horiba.result(job_id))
+			except Exception as e:
+				manifest.record_failure(xhair_label, str(e))
+				if isinstance(e, (EOFError, ConnectionError)):
+					session.reset()
+				if job_id is not None:
+					# We won't collect this attempt's job (e.g. the connection dropped while it ran)
+					try:
+						session.gateway().horiba.abandon(job_id)
+					except Exception as abandon_error:
+						_logger.debug(f"Could not abandon capture job {job_id}: {abandon_error}")
+				if attempt == CAPTURE_RETRIES:
+					raise
+				_logger.warning(f"Acquisition at {xhair_label} failed ({e}), retrying "
+								f"({attempt + 1}/{CAPTURE_RETRIES})")
+				time.sleep(RETRY_DELAY_S)
+
+	def add_point_data(self, datasets: dict, n: int, xhair_label: str, data_arr, push_spectra: bool,
+					   reducer, fit_model: str, baseline: BaselineRemover = None,
+					   decomposer: SpectraDecomposition = None) -> tuple:
+		"""
+		Adds one xhair's spectrum (2xN array) and/or its summaries/peak fit to
+		the datasets (computed after removing the `baseline`, if given).
+		Returns (counts after the baseline removal, summaries ({} without a
+		`reducer`), scores/cluster from the `decomposer` ({} without one)),
+		so callers don't have to redo them.
+		"""
+		wavelengths, counts = data_arr
+		if push_spectra:
+			spec_xhair_dataset_name = f"spec_{xhair_label}"
+			if spec_xhair_dataset_name not in datasets:
+				datasets[spec_xhair_dataset_name] = StreamingList()
+			datasets[spec_xhair_dataset_name].append(data_arr)
+
+			# Maintain a 'latest' series for plotting
+			if 'latest' not in datasets:
+				datasets['latest'] = StreamingList()
+			datasets['latest'].append(data_arr)
+
+		if baseline is not None:
+			counts = baseline(counts)
+
+		summary = reducer.reduce(wavelengths, counts) if reducer is not None else {}
+		for name, value in summary.items():
+			self.append_point(datasets, f'summary_{name}', n, value)
+
+		if fit_model != 'None':
+			self.push_peak_fit(datasets, n, wavelengths, counts, fit_model.lower())
+
+		analysis = {}
+		if decomposer is not None:
+			analysis = decomposer.update(counts)
+			for name, value in analysis.items():
+				self.append_point(datasets, f'{decomposer.method}_{name}', n, value)
+		return counts, summary, analysis
+
+	def save_decomposition(self, decomposer: SpectraDecomposition, folder: str, dataset: str):
+		"""Saves the decomposition of the scan (if any) next to its spectra."""
+		if decomposer is None or decomposer.n_seen == 0:
+			return
+		path = os.path.join(folder, f'{dataset}_{decomposer.method}.npz')
+		try:
+			decomposer.save(path)
+		except Exception as e:
+			_logger.warning(f"Could not save the decomposition to {path}: {e}")
+
+	def get_visit_order(self, local_xhairs: dict, manifest: ScanManifest, catalog: SpectraCatalog,
+						optimize_order: bool) -> list:
+		"""
+		Xhair indices (0 = cross001) that still have to be done, in the
+		order to visit them.
+		"""
+		remaining = [n for n in range(len(local_xhairs))
+					 if not manifest.is_done('cross' + str(n+1).zfill(3))]
+		if not optimize_order or len(remaining) < 3:
+			return remaining
+
+		cost = None
+		if catalog is not None:
+			try:
+				cost = MoveCost.from_measurements(catalog.move_times())
+			except Exception as e:
+				_logger.warning(f"Could not get FSM move times from the catalog: {e}")
+		# Start next to where the FSM was left (the last completed point of a resumed scan)
+		done = sorted(manifest.completed.values(), key=lambda info: info['timestamp'])
+		start = done[-1].get('fsm') if done else None
+
+		coords = [local_xhairs['cross' + str(n+1).zfill(3)]['cord'] for n in remaining]
+		order = travel_order(coords, start=start, cost=cost)
+		_logger.info(f"Visiting {len(remaining)} xhairs in travel order "
+					 f"({'measured move times' if cost is not None else 'distance'})")
+		return [remaining[i] for i in order]
+
+	def open_catalog(self):
+		"""The spectra catalog, or None if it can't be opened (the scan runs without it)."""
+		try:
+			return SpectraCatalog()
+		except Exception as e:
+			_logger.warning(f"Could not open the spectra catalog, not recording this scan in it: {e}")
+			return None
+
+	def get_capture_roi(self, session, xstart: int, xend: int, ystart: int, yend: int) -> tuple:
+		"""ROI the driver actually captures with (see Horiba.capture_roi), the requested one if it can't say."""
+		try:
+			return tuple(obtain(session.gateway().horiba.capture_roi(xstart, xend, ystart, yend)))
+		except Exception as e:
+			_logger.warning(f"Could not get the capture ROI from the driver: {e}")
+			return xstart, xend, ystart, yend
+
+	def get_hardware_state(self, session) -> dict:
+		"""Spectrometer state recorded in / checked against the scan manifest ({} if unavailable)."""
+		try:
+			info = obtain(session.gateway().horiba.get_spec_info(max_age_s=60))
+		except Exception as e:
+			_logger.warning(f"Could not get the spectrometer state: {e}")
+			return {}
+		return {key: info.get(key) for key in ('current_grating', 'wavelength', 'gratings')}
 	
+	def push_peak_fit(self, datasets: dict, n: int, wavelengths, counts, model: str):
+		"""
+		Fits one peak to the spectrum and appends (xhair number, value) for
+		center, fwhm and amplitude to the given datasets.
+		"""
+		try:
+			fit = fit_peaks(wavelengths, counts, model=model).as_dict(0)
+		except Exception as e:
+			_logger.warning(f"Peak fit failed for xhair {n}: {e}")
+			return
+		_logger.debug(f"xhair {n} peak fit: {fit}")
+
+		for name in ('center', 'fwhm', 'amplitude'):
+			self.append_point(datasets, f'peak_{name}', n, fit[name])
+
+	def append_point(self, datasets: dict, name: str, n: int, value: float):
+		"""Appends one (xhair number, value) point to the dataset `name` (creating it if needed)."""
+		if name not in datasets:
+			datasets[name] = StreamingList()
+		datasets[name].append(np.array([[n], [value]]))
+
 	def get_copy_of_xhairs(self, xhairs: str):
 		"""
 		Returns a local copy of the xhairs dataset.
@@ -8,17 +8,73 @@ TODO: FINISH THIS! FOR NOW IT'S JUST SPECTROM
 A. Wellisz 2025-10
 """
 
-from nspyre import InstrumentGateway, ExperimentWidget, experiment_widget_process_queue
+from nspyre import ExperimentWidget, DataSink, experiment_widget_process_queue
 from pyqtgraph import SpinBox
 from pyqtgraph.Qt import QtWidgets, QtCore
 import logging
 from nspyre import FlexLinePlotWidget
 
 import experiments.Spectra.take_xhair_spectra
+from experiments.Spectra.horiba_worker import HoribaWorker, last_known_info
+from experiments.Spectra.spectra_catalog import SpectraCatalog
+from experiments.Spectra.scan_monitor import format_duration
 
 _logger = logging.getLogger(__name__)
 
 
+class ScanTimeEstimator(QtCore.QObject):
+	"""
+	Estimates how long a scan will take (xhair count from dataserv, time
+	per point from the spectra catalog) on its own QThread, so neither
+	waiting for the xhairs nor SQLite ever blocks the Qt thread.
+	"""
+
+	finished = QtCore.Signal(str)  # status text
+
+	_estimate_requested = QtCore.Signal(object)
+
+	def __init__(self):
+		super().__init__()
+		self._thread = QtCore.QThread()
+		self.moveToThread(self._thread)
+		# Queued connection, since the slot lives in the worker thread
+		self._estimate_requested.connect(self._do_estimate)
+		self._thread.start()
+
+	def estimate(self, params: dict):
+		"""Estimate the scan time for the widget's `params`; the result arrives through `finished`."""
+		self._estimate_requested.emit(dict(params))
+
+	def stop(self):
+		self._thread.quit()
+		self._thread.wait(2000)
+
+	@QtCore.Slot(object)
+	def _do_estimate(self, params):
+		try:
+			with DataSink(params['xhairs']) as sink:
+				sink.pop(timeout=5)
+				num_xhairs = len(sink.datasets)
+
+			per_point_s = SpectraCatalog().estimate_point_time(
+				experiment='SpectraPerXhairMeasurement',
+				exposure_s=params['exposure_s'], gain=params['gain'], adc=params['adc'],
+				xstart=int(params['xstart']), xend=int(params['xend']),
+				ystart=int(params['ystart']), yend=int(params['yend']),
+				xbin=int(params['xbin']), ybin=int(params['ybin']),
+			)
+		except Exception as e:
+			self.finished.emit(f"Failed to estimate scan time: {e}")
+			return
+		if per_point_s is None:
+			self.finished.emit("No past scans to estimate from.")
+			return
+		self.finished.emit(
+			f"Estimated {format_duration(per_point_s * num_xhairs)} for {num_xhairs} xhairs "
+			f"({per_point_s:.1f} s per xhair)"
+		)
+
+
 class SpectraPerXhairWidget(ExperimentWidget):
 	def __init__(self):
 
@@ -28,6 +84,11 @@ class SpectraPerXhairWidget(ExperimentWidget):
 		self.status_lbl.setWordWrap(True)
 		top_wl_gr_widget.addWidget(self.status_lbl)
 
+		# Dry run: predict how long the scan will take from past scans with the same settings
+		self.estimate_btn = QtWidgets.QPushButton("Estimate Scan Time")
+		self.estimate_btn.clicked.connect(self.on_estimate)
+		top_wl_gr_widget.addWidget(self.estimate_btn)
+
 		self.num_spectra = 0
 
 		# QComboBoxes for later
@@ -46,6 +107,23 @@ class SpectraPerXhairWidget(ExperimentWidget):
 		self.wl_end = 0
 		self.grating = 0
 
+		fit_combo = QtWidgets.QComboBox()
+		fit_combo.addItems(["None", "Lorentzian", "Gaussian", "Voigt"])
+
+		decomposition_combo = QtWidgets.QComboBox()
+		decomposition_combo.addItems(["None", "PCA", "NMF"])
+
+		# Unchecked = only push summaries to the dataserver (spectra are still saved to files)
+		push_spectra_checkbox = QtWidgets.QCheckBox()
+		push_spectra_checkbox.setChecked(True)
+
+		# Checked = continue the last scan into this dataset from its checkpoint
+		resume_checkbox = QtWidgets.QCheckBox()
+
+		# Checked = visit the xhairs in a short path instead of in label order
+		optimize_order_checkbox = QtWidgets.QCheckBox()
+		optimize_order_checkbox.setChecked(False)
+
 		params_config = {
 			"xhairs": {
 				"display_text": "Xhair source",
@@ -66,9 +144,8 @@ class SpectraPerXhairWidget(ExperimentWidget):
 			# capture settings
 			"exposure_s": {
 				"display_text": "Exp. Time",
-				# Max time must be less than RPYC_SYNC_TIMEOUT 
-				# Set RPYC_SYNC_TIMEOUT higher if necessary in nspyre.instrument.server
-				"widget": SpinBox(value=1.0, suffix="s", siPrefix=True, bounds=(0.0, 300), dec=True),
+				# Captures run as jobs on the instrument server, so this isn't limited by RPYC_SYNC_TIMEOUT
+				"widget": SpinBox(value=1.0, suffix="s", siPrefix=True, bounds=(0.0, 3600), dec=True),
 			},
 			"gain": {
 				"display_text": "Gain",
@@ -104,6 +181,46 @@ class SpectraPerXhairWidget(ExperimentWidget):
 				"display_text": "Y bin",
 				"widget": SpinBox(value=512, int=True, bounds=(1, 512), dec=True),
 			},
+			# fit a peak to each spectrum as it comes in
+			"fit_model": {
+				"display_text": "Peak fit",
+				"widget": fit_combo,
+			},
+			# per-spectrum summaries (integrated counts per window, peak position/height)
+			"summary_windows": {
+				"display_text": "Summary windows (nm)",
+				"widget": QtWidgets.QLineEdit(""),
+			},
+			"push_spectra": {
+				"display_text": "Push full spectra",
+				"widget": push_spectra_checkbox,
+			},
+			# baseline removal before summaries/fits (0 = off, see baseline.py)
+			"baseline_lambda": {
+				"display_text": "Baseline stiffness (0 = off)",
+				"widget": SpinBox(value=0, bounds=(0, None), dec=True),
+			},
+			# streaming decomposition + clustering (see spectra_decomposition.py)
+			"decomposition": {
+				"display_text": "Decomposition",
+				"widget": decomposition_combo,
+			},
+			"n_components": {
+				"display_text": "Components",
+				"widget": SpinBox(value=3, int=True, bounds=(1, 50)),
+			},
+			"n_clusters": {
+				"display_text": "Clusters",
+				"widget": SpinBox(value=4, int=True, bounds=(1, 50)),
+			},
+			"resume": {
+				"display_text": "Resume",
+				"widget": resume_checkbox,
+			},
+			"optimize_order": {
+				"display_text": "Optimize xhair order",
+				"widget": optimize_order_checkbox,
+			},
 		}
 
 		self.fun_kwargs = {
@@ -111,7 +228,11 @@ class SpectraPerXhairWidget(ExperimentWidget):
 			'grating': 0,
 		}
 
-		self.refresh_info()
+		# Show the last known state right away; the actual refresh happens in the background
+		info = last_known_info()
+		if info is not None:
+			self.apply_info(info)
+			self.status_lbl.setText("Status: Showing last known spectrometer info, refreshing...")
 
 		super().__init__(
 			params_config = params_config,
@@ -128,6 +249,19 @@ class SpectraPerXhairWidget(ExperimentWidget):
 		self._timer.timeout.connect(self.check_status_queue)
 		self._timer.start(50) # check every 50 ms
 
+		# All hardware calls go through a background thread, so the GUI never waits on the CLI
+		self.worker = HoribaWorker()
+		self.worker.info_ready.connect(self.apply_info)
+		self.worker.move_progress.connect(self.on_move_progress)
+		self.worker.move_finished.connect(self.on_move_finished)
+		self.worker.failed.connect(self.on_worker_failed)
+		QtWidgets.QApplication.instance().aboutToQuit.connect(self.worker.stop)
+		self.refresh_info()
+
+		self.estimator = ScanTimeEstimator()
+		self.estimator.finished.connect(self.on_estimate_finished)
+		QtWidgets.QApplication.instance().aboutToQuit.connect(self.estimator.stop)
+
 
 	def create_wl_gr_widget(self):
 
@@ -163,6 +297,11 @@ class SpectraPerXhairWidget(ExperimentWidget):
 		self.gr_set_btn = QtWidgets.QPushButton("Set Grating")
 		self.gr_set_btn.clicked.connect(self.on_set_grating)
 		gr_layout.addWidget(self.gr_set_btn)
+
+		self.cancel_move_btn = QtWidgets.QPushButton("Cancel Move")
+		self.cancel_move_btn.setEnabled(False)
+		self.cancel_move_btn.clicked.connect(self.on_cancel_move)
+		gr_layout.addWidget(self.cancel_move_btn)
 		gr_layout.addStretch(1)
 
 		layout.addLayout(wl_layout)
@@ -173,75 +312,92 @@ class SpectraPerXhairWidget(ExperimentWidget):
 
 
 	def refresh_info(self):
-		try:
-
-			with InstrumentGateway() as gw:
-				horiba = gw.horiba
-				info = horiba.get_spec_info()
-
-				# print(info)
+		"""Ask the worker for fresh spectrometer info (result arrives in apply_info)"""
+		self.status_lbl.setText("Status: Refreshing spectrometer info...")
+		self.worker.refresh()
 
-				wl = info.get("wavelength")
-				wl_start = info.get("wl_start")
-				wl_end = info.get("wl_end")
+	def apply_info(self, info):
+		try:
+			wl = info.get("wavelength")
+			wl_start = info.get("wl_start")
+			wl_end = info.get("wl_end")
+			# Actual center from the driver's dispersion model (the SDK wavelength is offset)
+			wl_true_center = info.get("center")
+			has_range = wl_start is not None and wl_end is not None
+			if wl_true_center is None and has_range:
 				wl_true_center = (wl_start + wl_end)/2
 
-				if wl is not None:
-					self.wl_value_lbl.setText(f"Center: {wl_true_center:.3f} | Range: {wl_start:.2f}-{wl_end:.2f}")
-					#self.wl_set_spin.setValue(float(wl))
-
-				cg = info.get("current_grating")
-				self.grating = cg
-				if cg is not None:
-					self.gr_value_lbl.setText(str(int(cg)))
-
-				# populate grating options
-				self.gr_combo.clear()
-				grs = info.get("gratings", [])
-				for g in grs:
-					self.gr_combo.addItem(str(int(g)))
-				# select current grating in dropdown
-				if cg is not None:
-					idx = self.gr_combo.findText(str(int(cg)))
-					if idx >= 0:
-						self.gr_combo.setCurrentIndex(idx)
-
-				# These kwargs are passed into the experiment just for naming purposes,
-				# so nominal wavelength is fine? (off by up to ~0.2 nm)
-				self.fun_kwargs = {
-					'wavelength': self.wl_set_spin.value(),
-					'grating': int(cg),
-				}
-
-				self.status_lbl.setText("Status: Spectrometer info loaded.")
+			if wl is not None:
+				center_text = f"{wl_true_center:.3f}" if wl_true_center is not None else f"{wl:.3f} (nominal)"
+				range_text = f"{wl_start:.2f}-{wl_end:.2f}" if has_range else "--"
+				self.wl_value_lbl.setText(f"Center: {center_text} | Range: {range_text}")
+				#self.wl_set_spin.setValue(float(wl))
+
+			cg = info.get("current_grating")
+			self.grating = cg
+			if cg is not None:
+				self.gr_value_lbl.setText(str(int(cg)))
+
+			# populate grating options
+			self.gr_combo.clear()
+			grs = info.get("gratings", [])
+			for g in grs:
+				self.gr_combo.addItem(str(int(g)))
+			# select current grating in dropdown
+			if cg is not None:
+				idx = self.gr_combo.findText(str(int(cg)))
+				if idx >= 0:
+					self.gr_combo.setCurrentIndex(idx)
+
+			# These kwargs are passed into the experiment just for naming purposes,
+			# so nominal wavelength is fine? (off by up to ~0.2 nm)
+			self.fun_kwargs = {
+				'wavelength': self.wl_set_spin.value(),
+				'grating': int(cg),
+			}
+
+			self.status_lbl.setText("Status: Spectrometer info loaded.")
 		except Exception as e:
 			self.status_lbl.setText(f"Status: Failed to get info: {e}")
 
 	def on_set_wavelength(self):
-		try:
-			wl = float(self.wl_set_spin.value())
+		wl = float(self.wl_set_spin.value())
+		self.set_moving(True)
+		self.worker.move(wavelength=wl)
+
+	def on_set_grating(self):
+		gr = self.gr_combo.currentText()
+		self.set_moving(True)
+		self.worker.move(grating=gr)
 
-			with InstrumentGateway() as gw:
-				gw.horiba.set_spec_wavelength(wl)
+	def on_cancel_move(self):
+		self.worker.cancel()
 
-			self.status_lbl.setText(f"Status: Wavelength set to {wl:.3f} nm.")
-			self.refresh_info()
-		except Exception as e:
-			self.status_lbl.setText(f"Error setting wavelength: {e}")
+	def set_moving(self, moving):
+		"""Only one move at a time (cancel is only available during one)"""
+		self.wl_set_btn.setEnabled(not moving)
+		self.gr_set_btn.setEnabled(not moving)
+		self.cancel_move_btn.setEnabled(moving)
 
-	# TODO: MAKE THIS THREADED, OR MAYBE MAKE IT AN EXPERIMENT EXPLICITLY?
-	# FOR NOW THIS FREEZES NSPYRE
-	def on_set_grating(self):
-		try:
-			gr = self.gr_combo.currentText()
+	def on_move_progress(self, msg):
+		self.status_lbl.setText(f"Status: {msg}")
 
-			with InstrumentGateway() as gw:
-				gw.horiba.set_spec_grating(gr)
-				
-			self.status_lbl.setText(f"Status: Grating set to {gr} g/mm.")
-			self.refresh_info()
-		except Exception as e:
-			self.status_lbl.setText(f"Error setting grating: {e}")
+	def on_move_finished(self, msg):
+		self.set_moving(False)
+		self.status_lbl.setText(f"Status: {msg}")
+
+	def on_worker_failed(self, msg):
+		self.set_moving(False)
+		self.status_lbl.setText(f"Status: {msg}")
+
+	def on_estimate(self):
+		self.estimate_btn.setEnabled(False)
+		self.status_lbl.setText("Status: Estimating scan time...")
+		self.estimator.estimate(self.params_widget.all_params())
+
+	def on_estimate_finished(self, msg):
+		self.estimate_btn.setEnabled(True)
+		self.status_lbl.setText(f"Status: {msg}")
 
 	def check_status_queue(self):
 		# Checks the queue from the experiment, built into ExperimentWidget
@@ -0,0 +1,41 @@
+"""
+Smoke test for the Linux stand-in for Horiba_CLI.exe --job
+(`python horiba_driver.py --simulate --job PATH`).
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import horiba_driver
+from horiba_driver import JobPlan, job_manifest_path
+
+DRIVER = os.path.join(ROOT, "horiba_driver.py")
+
+
+def test_simulated_job_runs_to_the_end_with_stdin_closed(tmp_path):
+    plan = JobPlan()
+    plan.move(wavelength=700, grating=1200)
+    plan.capture(str(tmp_path / "spec700.txt"), exposure_s=0.01, frames=2)
+    plan.move(wavelength=750)
+    plan.capture(str(tmp_path / "spec750.txt"), exposure_s=0.01)
+    job_path = str(tmp_path / "plan.json")
+    with open(job_path, "w") as f:
+        json.dump(plan.as_dict(), f)
+
+    proc = subprocess.run([sys.executable, DRIVER, "--simulate", "--job", job_path],
+                          stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=60)
+
+    assert proc.returncode == 0, proc.stderr
+    assert "OK: job done" in proc.stdout
+    with open(job_manifest_path(job_path), "r") as f:
+        manifest = json.load(f)
+    assert manifest["status"] == "ok"
+    assert [step["status"] for step in manifest["steps"]] == ["ok"] * 4
+    for step in manifest["steps"]:
+        for path in step["files"]:
+            assert os.path.exists(horiba_driver.jy_saved_path(path))